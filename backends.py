@@ -0,0 +1,382 @@
+from abc import ABC, abstractmethod
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+import spatialite
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+DEFAULT_BACKEND = "spatialite"
+
+BACKENDS = ("spatialite", "duckdb")
+
+
+def text_digest(text: str) -> str:
+    "md5 hex digest of a text value, registered in sql as dq_digest(text)"
+    if text is None:
+        return None
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    return hashlib.md5(text).hexdigest()
+
+
+def sqlite_uri(database_path: str) -> str:
+    "Read-only uri of a sqlite file"
+    return Path(database_path).absolute().as_uri() + "?mode=ro"
+
+
+class Backend(ABC):
+    """Database engine a QueryRunner reads the dataset with. A backend opens
+    the connections (connect and attach must be implemented; execute,
+    detach) and writes the parts of the expectations' sql that differ
+    between engines (the dialect methods below, written here in sqlite's
+    dialect)."""
+
+    name = None
+    # exceptions raised by the engine for a failing query
+    error_types = (sqlite3.Error,)
+    # whether tables can be read by rowid (see QueryRunner.table_source)
+    supports_sampling = False
+    # whether sqlite scratch databases can be attached (see indexes.py)
+    supports_scratch_indexes = False
+    # how create_temp_table creates a table private to a connection
+    create_temp_table_sql = "CREATE TEMP TABLE"
+    # whether shapes can be indexed in an R*Tree (see spatial_index_statements)
+    supports_spatial_index = False
+    # ends a subquery that must be evaluated on its own, once per row, rather
+    # than flattened into the query reading it
+    unflattened_subquery_sql = "LIMIT -1 OFFSET 0"
+
+    @abstractmethod
+    def connect(self, dataset_path: str, read_only: bool):
+        "Opens a connection to the dataset"
+
+    def execute(self, con, sql_query: str):
+        "Runs a query, returns a dbapi cursor the caller closes"
+        return con.execute(sql_query)
+
+    @abstractmethod
+    def attach(self, con, database_path: str, alias: str, read_only: bool):
+        "Attaches another database file to a connection under an alias"
+
+    def detach(self, con, alias: str):
+        con.execute("DETACH DATABASE " + alias)
+
+    def create_temp_table(
+        self, con, table_name: str, columns: dict, rows, index_column: str = None
+    ):
+        """Creates a temporary table (seen by that connection only) with the
+        given {column name: type} and inserts the rows, any iterable of
+        tuples (consumed as it is inserted), optionally indexing a column"""
+        str_columns = ",".join(f"{name} {type}" for name, type in columns.items())
+        con.execute(f"{self.create_temp_table_sql} {table_name} ({str_columns});")
+        try:
+            placeholders = ",".join("?" for _ in columns)
+            con.executemany(f"INSERT INTO {table_name} VALUES ({placeholders});", rows)
+            # indexed once filled, faster than updating the index row by row
+            if index_column is not None:
+                con.execute(
+                    f"CREATE INDEX {table_name}_index ON {table_name} ({index_column});"
+                )
+        except BaseException:
+            self.drop_temp_table(con, table_name)
+            raise
+
+    def drop_temp_table(self, con, table_name: str):
+        con.execute(f"DROP TABLE {table_name};")
+
+    def tables_query(self) -> str:
+        "Query listing the name of every table of the dataset"
+        return "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name;"
+
+    def range_violation(
+        self, field_name: str, min_expected_value, max_expected_value
+    ) -> str:
+        "Predicate true when the field is out of the expected range"
+        return f"{field_name} < {min_expected_value} OR {field_name} > {max_expected_value}"
+
+    def geometry_from_text(self, wkt: str) -> str:
+        "Expression: the geometry of a WKT text, NULL if it can't be parsed"
+        return f"ST_GeomFromText({wkt})"
+
+    def is_valid(self, shape_field: str) -> str:
+        "Expression: 1 for a valid WKT shape, 0 for an invalid one, -1 if it can't be parsed"
+        return self.is_valid_geometry(self.geometry_from_text(shape_field))
+
+    def is_valid_geometry(self, geometry: str) -> str:
+        "Expression: is_valid of a geometry, -1 when it is NULL (couldn't be parsed)"
+        return f"ST_IsValid({geometry})"
+
+    def point_within(self, point: str, shape: str) -> str:
+        "Predicate true when a point geometry is within a shape geometry"
+        return f"ST_Within({point}, {shape}) = 1"
+
+    # expression of each metric of a geometry (see geometry_metric)
+    geometry_metric_functions = {
+        "area": "ST_Area({})",
+        "min_x": "MbrMinX({})",
+        "max_x": "MbrMaxX({})",
+        "min_y": "MbrMinY({})",
+        "max_y": "MbrMaxY({})",
+        "vertices": "ST_NPoints({})",
+        "srid": "ST_SRID({})",
+    }
+
+    def geometry_metric(self, metric: str, geometry: str) -> str:
+        "Expression: a metric (see geometry_metric_functions) of a geometry"
+        if metric not in self.geometry_metric_functions:
+            raise ValueError(
+                f"the geometry metric '{metric}' is not supported by the {self.name} backend, "
+                f"supported metrics are {list(self.geometry_metric_functions)}"
+            )
+        return self.geometry_metric_functions[metric].format(geometry)
+
+    def parsed_geometries_statements(
+        self, parsed_table: str, table_name: str, shape_field: str
+    ) -> list:
+        """Statements creating a table of the geometries of the WKT shapes of
+        a table, parsed once: (row_id, the rowid of the row, shape, NULL if
+        it couldn't be parsed, and its bounding box min_x, max_x, min_y,
+        max_y), for every row of the table"""
+        return [
+            f"""CREATE TABLE {parsed_table} (
+                row_id INTEGER PRIMARY KEY, shape BLOB,
+                min_x REAL, max_x REAL, min_y REAL, max_y REAL);""",
+            f"""INSERT INTO {parsed_table}
+                SELECT rowid, shape, MbrMinX(shape), MbrMaxX(shape), MbrMinY(shape), MbrMaxY(shape)
+                FROM (
+                    SELECT rowid, {self.geometry_from_text(shape_field)} AS shape
+                    FROM {table_name}
+                    {self.unflattened_subquery_sql});""",
+        ]
+
+    def spatial_index_statements(
+        self,
+        index_name: str,
+        table_name: str,
+        shape_field: str,
+        parsed_geometries: str = None,
+    ) -> list:
+        """Statements creating an R*Tree of the bounding boxes of the WKT
+        shapes of a table, whose ids are the rowids of the table (shapes that
+        can't be parsed are left out). Each shape is parsed once, or the
+        boxes are read from its parsed_geometries (see
+        parsed_geometries_statements) when given."""
+        if parsed_geometries is None:
+            boxes = f"""
+                SELECT rowid, MbrMinX(shape), MbrMaxX(shape), MbrMinY(shape), MbrMaxY(shape)
+                FROM (
+                    SELECT rowid, {self.geometry_from_text(shape_field)} AS shape
+                    FROM {table_name}
+                    {self.unflattened_subquery_sql})
+                WHERE shape IS NOT NULL"""
+        else:
+            boxes = f"""
+                SELECT row_id, min_x, max_x, min_y, max_y
+                FROM {parsed_geometries}
+                WHERE shape IS NOT NULL"""
+        return [
+            f"CREATE VIRTUAL TABLE {index_name} USING rtree(id, min_x, max_x, min_y, max_y);",
+            f"INSERT INTO {index_name} {boxes.strip()};",
+        ]
+
+    def lookup_key(self, field_name: str) -> str:
+        """Expression matched against text lookup values: the field itself,
+        sqlite converts the text to the affinity of the field (so an index
+        on the field is used)"""
+        return field_name
+
+    def json_extract_text(self, field: str, json_key: str) -> str:
+        "Expression: the value of a top level key of a json text"
+        return f"json_extract({field}, '$.{json_key}')"
+
+    def json_without_keys(self, field: str, json_keys: set) -> str:
+        "Expression: what is left of a json object once the given keys are removed"
+        str_json_keys = ",".join(f"'$.{json_key}'" for json_key in json_keys)
+        return f"json_remove({field}, {str_json_keys})"
+
+    def json_has_keys_left(self, json_without_keys: str) -> str:
+        "Predicate true when json_without_keys left some keys"
+        return f"{json_without_keys} IS NOT NULL AND {json_without_keys} <> '{{}}'"
+
+    def json_is_object(self, field: str) -> str:
+        "Predicate true when the field is a valid json text holding an object"
+        return f"(json_valid({field}) AND json_type({field}) = 'object')"
+
+    def json_key_type(self, field: str, json_key: str) -> str:
+        """Expression: the JSON Schema type (string, integer, number, boolean,
+        null, array or object) of the value of a top level key of a json
+        object, NULL when the key is missing"""
+        json_type = f"json_type({field}, '$.{json_key}')"
+        return f"""CASE {json_type} WHEN 'text' THEN 'string' WHEN 'real' THEN 'number'
+            WHEN 'true' THEN 'boolean' WHEN 'false' THEN 'boolean' ELSE {json_type} END"""
+
+    def is_iso_date(self, expression: str) -> str:
+        "Predicate true when a text is a valid YYYY-MM-DD date"
+        # the modifier normalises days past the end of the month (2022-02-30)
+        return f"COALESCE(date({expression}, '+0 days') = {expression}, 0)"
+
+    def values_differ(self, expression: str, other_expression: str) -> str:
+        "Predicate true when two values differ, NULL being a value"
+        return f"{expression} IS NOT {other_expression}"
+
+
+class SpatialiteBackend(Backend):
+    """sqlite with the spatialite extension, reading the sqlite3 dataset
+    files (read-only by default). The default backend."""
+
+    name = "spatialite"
+    error_types = (sqlite3.Error,)
+    supports_sampling = True
+    supports_scratch_indexes = True
+    supports_spatial_index = True
+
+    def connect(self, dataset_path: str, read_only: bool):
+        database = sqlite_uri(dataset_path) if read_only else dataset_path
+        # check_same_thread is disabled only so close() can be called from the
+        # thread owning the runner, each connection is used by a single thread
+        con = spatialite.connect(database, uri=read_only, check_same_thread=False)
+        con.create_function("dq_digest", 1, text_digest, deterministic=True)
+        return con
+
+    def attach(self, con, database_path: str, alias: str, read_only: bool):
+        database = sqlite_uri(database_path) if read_only else database_path
+        con.execute("ATTACH DATABASE ? AS " + alias, (database,))
+
+
+class DuckDBBackend(Backend):
+    """DuckDB, a columnar engine that is much faster on aggregations (lookup
+    counts, uniqueness, ...) over large tables. The dataset is either a
+    sqlite3 file, attached read-only through DuckDB's sqlite extension, or a
+    directory of parquet exports, one <table_name>.parquet per table. Every
+    table is exposed as a view under its own name so the expectations read
+    the same tables as with spatialite. Geoshape expectations need DuckDB's
+    spatial extension."""
+
+    name = "duckdb"
+    # queries run on duplicates of the connection (see execute), which don't
+    # see its temporary tables, but its in-memory database is private anyway
+    create_temp_table_sql = "CREATE TABLE"
+    # subqueries are not flattened
+    unflattened_subquery_sql = ""
+
+    def __init__(self):
+        if duckdb is None:
+            raise ImportError("the duckdb backend needs the duckdb package")
+        self.error_types = (duckdb.Error,)
+
+    def connect(self, dataset_path: str, read_only: bool):
+        con = duckdb.connect()
+        con.create_function(
+            "dq_digest", text_digest, ["VARCHAR"], "VARCHAR", side_effects=False
+        )
+        if os.path.isdir(dataset_path):
+            sources = {
+                parquet.stem: f"read_parquet('{parquet.absolute()}')"
+                for parquet in sorted(Path(dataset_path).glob("*.parquet"))
+            }
+        else:
+            self.attach(con, dataset_path, "dataset", read_only)
+            sources = {
+                table_name: f'dataset."{table_name}"'
+                for (table_name,) in con.execute(
+                    "SELECT table_name FROM duckdb_tables() WHERE database_name = 'dataset';"
+                ).fetchall()
+            }
+        for table_name, source in sources.items():
+            con.execute(f'CREATE VIEW "{table_name}" AS SELECT * FROM {source};')
+
+        try:
+            con.execute("LOAD spatial;")
+        except duckdb.Error:
+            # only the geoshape expectations need it
+            pass
+        return con
+
+    def execute(self, con, sql_query: str):
+        # a duplicate connection (same database) so closing the cursor keeps
+        # the pooled connection open
+        return con.cursor().execute(sql_query)
+
+    def attach(self, con, database_path: str, alias: str, read_only: bool):
+        str_read_only = ", READ_ONLY" if read_only else ""
+        con.execute(
+            f"ATTACH '{Path(database_path).absolute()}' AS {alias} (TYPE sqlite{str_read_only});"
+        )
+
+    def detach(self, con, alias: str):
+        con.execute(f"DETACH {alias};")
+
+    def tables_query(self) -> str:
+        return "SELECT table_name AS name FROM information_schema.tables WHERE table_schema = 'main' ORDER BY name;"
+
+    def range_violation(
+        self, field_name: str, min_expected_value, max_expected_value
+    ) -> str:
+        # compared as numbers, values that are not numbers are out of range
+        as_number = f"TRY_CAST({field_name} AS DOUBLE)"
+        return f"""{as_number} < {min_expected_value} OR {as_number} > {max_expected_value}
+            OR ({field_name} IS NOT NULL AND {as_number} IS NULL)"""
+
+    def lookup_key(self, field_name: str) -> str:
+        return f"CAST({field_name} AS VARCHAR)"
+
+    def geometry_from_text(self, wkt: str) -> str:
+        return f"TRY(ST_GeomFromText({wkt}))"
+
+    def is_valid_geometry(self, geometry: str) -> str:
+        return f"COALESCE(CAST(ST_IsValid({geometry}) AS INTEGER), -1)"
+
+    def point_within(self, point: str, shape: str) -> str:
+        return f"COALESCE(ST_Within({point}, {shape}), false)"
+
+    # geometries carry no SRID in DuckDB's spatial extension
+    geometry_metric_functions = {
+        "area": "ST_Area({})",
+        "min_x": "ST_XMin({})",
+        "max_x": "ST_XMax({})",
+        "min_y": "ST_YMin({})",
+        "max_y": "ST_YMax({})",
+        "vertices": "ST_NPoints({})",
+    }
+
+    def json_extract_text(self, field: str, json_key: str) -> str:
+        return f"json_extract_string({field}, '$.{json_key}')"
+
+    def json_without_keys(self, field: str, json_keys: set) -> str:
+        # the list of the keys that are not expected
+        str_json_keys = ",".join(f"'{json_key}'" for json_key in json_keys)
+        return f"list_filter(json_keys({field}), k -> NOT list_contains([{str_json_keys}], k))"
+
+    def json_has_keys_left(self, json_without_keys: str) -> str:
+        return f"len({json_without_keys}) > 0"
+
+    def json_is_object(self, field: str) -> str:
+        return f"COALESCE(json_valid({field}) AND json_type({field}) = 'OBJECT', false)"
+
+    def json_key_type(self, field: str, json_key: str) -> str:
+        json_type = f"json_type({field}, '$.{json_key}')"
+        return f"""CASE {json_type} WHEN 'VARCHAR' THEN 'string' WHEN 'BIGINT' THEN 'integer'
+            WHEN 'UBIGINT' THEN 'integer' WHEN 'DOUBLE' THEN 'number'
+            WHEN 'BOOLEAN' THEN 'boolean' ELSE lower({json_type}) END"""
+
+    def is_iso_date(self, expression: str) -> str:
+        return f"COALESCE(strftime(TRY_STRPTIME({expression}, '%Y-%m-%d'), '%Y-%m-%d') = {expression}, false)"
+
+    def values_differ(self, expression: str, other_expression: str) -> str:
+        # compared as text, as json_extract_string extracts them
+        return f"CAST({expression} AS VARCHAR) IS DISTINCT FROM CAST({other_expression} AS VARCHAR)"
+
+
+def make_backend(backend: str) -> Backend:
+    "Returns the backend with the given name"
+    if backend == "spatialite":
+        return SpatialiteBackend()
+    elif backend == "duckdb":
+        return DuckDBBackend()
+    else:
+        raise ValueError(f"backend must be one of {BACKENDS}, got '{backend}'")
@@ -0,0 +1,87 @@
+"""Compares the time and peak memory of saving an ExpectationResponse with a
+large details (e.g. 100k records_with_value_out_of_range) through the
+serializer (serializer.write_response_json) and through the previous path
+(copy.deepcopy of the response then dataclasses_json to_json).
+
+Run from the root of the repo:
+
+    PYTHONPATH=. python3 benchmarks/benchmark_serializer.py --records 100000
+"""
+
+import copy
+import io
+import time
+import tracemalloc
+import click
+from core import ExpectationResponse
+from serializer import write_response_json
+
+
+def make_response(records: int) -> ExpectationResponse:
+    "A failed range expectation with records rows in its details"
+    return ExpectationResponse(
+        expectation_input={
+            "query_runner": None,
+            "table_name": "entity",
+            "field_name": "entity",
+            "min_expected_value": 44000000,
+            "max_expected_value": 44999999,
+            "ref_fields": ["entity"],
+            "expectation_severity": "RaiseError",
+            "kwargs": {"data_quality_execution_time": "20220101_000000"},
+            "expectation_name": "expect_values_in_field_to_be_within_range",
+        },
+        result=False,
+        msg=f"Fail: found {records} values out of the expected range for field 'entity' on table 'entity', see details",
+        details={
+            "records_with_value_out_of_range": [
+                {"entity": 303443 + i, "reference": str(6407 + i)}
+                for i in range(records)
+            ]
+        },
+        sqlite_dataset="conservation-area.sqlite3",
+    )
+
+
+def deepcopy_to_json(response: ExpectationResponse, file):
+    "The way save_to_file used to write a response"
+    self_save_version = copy.deepcopy(response)
+    self_save_version.result = str(self_save_version.result)
+    file.write(self_save_version.to_json())
+
+
+def measure(save_function, response: ExpectationResponse, repeat: int):
+    "Best wall time and peak traced memory of save_function over repeat runs"
+    best_time = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        save_function(response, io.StringIO())
+        elapsed = time.perf_counter() - start
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+    tracemalloc.start()
+    save_function(response, io.StringIO())
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_time, peak_memory
+
+
+@click.command()
+@click.option("--records", default=100000, show_default=True)
+@click.option("--repeat", default=3, show_default=True)
+def benchmark_serializer(records, repeat):
+    response = make_response(records)
+
+    click.echo(f"details with {records} records, best of {repeat}")
+    for name, save_function in (
+        ("deepcopy + to_json", deepcopy_to_json),
+        ("write_response_json", write_response_json),
+    ):
+        best_time, peak_memory = measure(save_function, response, repeat)
+        click.echo(
+            f"{name:>20}: {best_time:8.3f} s  peak {peak_memory / 2**20:8.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    benchmark_serializer()
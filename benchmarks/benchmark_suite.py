@@ -0,0 +1,272 @@
+"""Times every expectation of expectations.py, one by one, and whole suites
+(e.g. conservation-area.yaml) against a dataset, typically one built by
+generate_dataset.py. Each measure runs in a fresh process so its peak RSS
+is its own. Reported per measure: wall time, cpu time, peak RSS, rows of
+the tables read and rows/sec.
+
+Results are appended to a history file (one json per line) tagged with
+the version (git commit by default), and each measure is compared with the
+latest measure of another version on the same dataset with the same run
+options (--fuse-scans, --engine).
+
+Run from the root of the repo:
+
+    PYTHONPATH=. python3 benchmarks/generate_dataset.py --path /tmp/synthetic.sqlite3 --entities 100000
+    PYTHONPATH=. python3 benchmarks/benchmark_suite.py --sqlite-dataset-path /tmp/synthetic.sqlite3 --data-quality-yaml conservation-area.yaml
+"""
+
+import inspect
+import json
+import os
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import click
+import expectations as dq_expectations
+from core import QueryRunner, config_parser
+from execution import run_suite
+from incremental import SCHEMA_TABLE, referenced_tables
+
+
+def default_expectations(query_runner: QueryRunner) -> list:
+    """One expectation per function of expectations.py, on the tables of the
+    digital-land schema (results don't matter, only their cost)"""
+    entity_range = query_runner.run_query(
+        "SELECT MIN(entity) AS low, MAX(entity) AS high FROM entity;"
+    ).iloc[0]
+    return [
+        {
+            "expectation_name": "expect_database_to_have_set_of_tables",
+            "expected_tables_set": ["entity", "fact", "fact_resource"],
+        },
+        {
+            "expectation_name": "expect_table_to_have_set_of_columns",
+            "table_name": "entity",
+            "expected_columns_set": ["entity", "geometry", "json", "reference"],
+        },
+        {
+            "expectation_name": "expect_table_row_count_to_be_in_range",
+            "table_name": "fact",
+            "min_expected_row_count": 0,
+            "max_expected_row_count": 10**12,
+        },
+        {
+            "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+            "table_name": "entity",
+            "field_name": "organisation_entity",
+            "count_ranges_per_value": [
+                {"lookup_value": "16", "min_row_count": 0, "max_row_count": 10**12},
+                {"lookup_value": "109", "min_row_count": 0, "max_row_count": 10**12},
+            ],
+        },
+        {
+            "expectation_name": "expect_field_values_to_be_within_set",
+            "table_name": "fact",
+            "field_name": "field",
+            "expected_values_set": ["name", "geometry", "reference"],
+        },
+        {
+            "expectation_name": "expect_values_for_field_to_be_unique",
+            "table_name": "fact_resource",
+            "fields": ["fact", "resource"],
+        },
+        {
+            "expectation_name": "expect_geoshapes_to_be_valid",
+            "table_name": "entity",
+            "shape_field": "geometry",
+            "ref_fields": ["entity"],
+        },
+        {
+            "expectation_name": "expect_values_for_a_key_stored_in_json_are_within_a_set",
+            "table_name": "entity",
+            "field": "json",
+            "json_key": "documentation-url",
+            "expected_values_set": [],
+            "ref_fields": ["entity"],
+        },
+        {
+            "expectation_name": "expect_keys_in_json_field_to_be_in_set_of_options",
+            "table_name": "entity",
+            "field_name": "json",
+            "expected_keys_set": ["documentation-url", "entry-date", "start-date"],
+            "ref_fields": ["entity"],
+        },
+        {
+            "expectation_name": "expect_values_in_field_to_be_within_range",
+            "table_name": "entity",
+            "field_name": "entity",
+            "min_expected_value": int(entity_range["low"]),
+            "max_expected_value": int(entity_range["high"]),
+            "ref_fields": ["entity"],
+        },
+        {
+            "expectation_name": "expect_custom_query_result_to_be_as_predicted",
+            "custom_query": "SELECT field, COUNT(*) AS n FROM fact GROUP BY field ORDER BY field;",
+            "expected_query_result": [],
+        },
+    ]
+
+
+def _rows_read(query_runner: QueryRunner, expectations: list) -> int:
+    "Rows of the tables read by the expectations (once per table)"
+    tables = set()
+    for expectation in expectations:
+        tables.update(referenced_tables(query_runner, expectation))
+    tables.discard(SCHEMA_TABLE)
+    return sum(
+        int(query_runner.run_query(f"SELECT COUNT(*) AS n FROM {table};")["n"][0])
+        for table in tables
+    )
+
+
+def _measure(sqlite_dataset_path: str, expectations: list, run_options: dict) -> dict:
+    "Runs in a fresh worker process, so ru_maxrss is the peak of this measure"
+    with QueryRunner(sqlite_dataset_path) as query_runner:
+        rows = _rows_read(query_runner, expectations)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        responses = list(run_suite(query_runner, expectations, **run_options))
+        wall_time = time.perf_counter() - start_wall
+        cpu_time = time.process_time() - start_cpu
+    return {
+        "wall_time_s": wall_time,
+        "cpu_time_s": cpu_time,
+        # kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rows": rows,
+        "rows_per_s": rows / wall_time if wall_time else None,
+        "passed": sum(bool(response.result) for response in responses),
+        "expectations": len(responses),
+    }
+
+
+def measure(sqlite_dataset_path: str, expectations: list, run_options: dict) -> dict:
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+        return pool.submit(
+            _measure, sqlite_dataset_path, expectations, run_options
+        ).result()
+
+
+def current_version() -> str:
+    "Short commit of the repo, or 'unknown' outside of a git checkout"
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_measures(
+    history_path: str, version: str, dataset: str, run_options: dict
+) -> dict:
+    """Latest measure of another version on the same dataset with the same
+    run_options, by measure name"""
+    previous = {}
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if (
+                    record["version"] != version
+                    and record["dataset"] == dataset
+                    and all(
+                        record.get(option) == value
+                        for option, value in run_options.items()
+                    )
+                ):
+                    previous[record["name"]] = record
+    return previous
+
+
+@click.command()
+@click.option("--sqlite-dataset-path", required=True)
+@click.option(
+    "--data-quality-yaml",
+    multiple=True,
+    help="suite to time as a whole (can be repeated)",
+)
+@click.option(
+    "--history",
+    default="benchmarks/history.ndjson",
+    show_default=True,
+    help="file the results are appended to",
+)
+@click.option(
+    "--version", default=None, help="label of the results (git commit by default)"
+)
+@click.option("--fuse-scans", is_flag=True, default=False)
+@click.option("--engine", default="sql", show_default=True)
+@click.option(
+    "--skip-expectations",
+    is_flag=True,
+    default=False,
+    help="only time the suites",
+)
+def benchmark_suite(
+    sqlite_dataset_path,
+    data_quality_yaml,
+    history,
+    version,
+    fuse_scans,
+    engine,
+    skip_expectations,
+):
+    version = version or current_version()
+    dataset = os.path.basename(sqlite_dataset_path)
+    run_options = {"fuse_scans": fuse_scans, "engine": engine}
+
+    measures = []
+    if not skip_expectations:
+        with QueryRunner(sqlite_dataset_path) as query_runner:
+            expectations = default_expectations(query_runner)
+        covered = {expectation["expectation_name"] for expectation in expectations}
+        for name, _ in inspect.getmembers(dq_expectations, inspect.isfunction):
+            if name.startswith("expect_") and name not in covered:
+                click.echo(f"warning: {name} has no default expectation", err=True)
+        measures += [
+            (expectation["expectation_name"], [expectation])
+            for expectation in expectations
+        ]
+    for suite_path in data_quality_yaml:
+        measures.append(
+            (
+                f"suite:{os.path.basename(suite_path)}",
+                config_parser(suite_path)["expectations"],
+            )
+        )
+
+    previous = previous_measures(history, version, dataset, run_options)
+    click.echo(f"version {version}, dataset {dataset}")
+    click.echo(
+        f"{'measure':<60} {'wall s':>9} {'cpu s':>9} {'rss MiB':>9} {'rows/s':>12} {'vs prev':>9}"
+    )
+    with open(history, "a") as f:
+        for name, expectations in measures:
+            record = {
+                "version": version,
+                "dataset": dataset,
+                "name": name,
+                "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+                **run_options,
+                **measure(sqlite_dataset_path, expectations, run_options),
+            }
+            f.write(json.dumps(record) + "\n")
+
+            if name in previous:
+                speedup = previous[name]["wall_time_s"] / record["wall_time_s"]
+                versus_previous = f"{speedup:8.2f}x"
+            else:
+                versus_previous = ""
+            click.echo(
+                f"{name:<60} {record['wall_time_s']:9.3f} {record['cpu_time_s']:9.3f} "
+                f"{record['peak_rss_mb']:9.1f} {record['rows_per_s'] or 0:12.0f} {versus_previous:>9}"
+            )
+
+
+if __name__ == "__main__":
+    benchmark_suite()
@@ -0,0 +1,134 @@
+"""Compares running the range, set, uniqueness and lookup count expectations
+of the fact and fact_resource tables one sql query each (engine sql) with
+evaluating them together over numpy arrays of their columns (engine
+vectorized, see vectorized.py). The suites only hold expectations that
+pass, as failing ones are re-run in sql by the vectorized engine anyway.
+
+Run from the root of the repo:
+
+    PYTHONPATH=. python3 benchmarks/benchmark_vectorized.py --sqlite-dataset-path <dataset.sqlite3>
+"""
+
+import time
+import click
+from core import QueryRunner
+from execution import run_suite
+
+
+def table_suites(query_runner: QueryRunner) -> dict:
+    "Passing expectations on fact and fact_resource, built from the data"
+    fact_fields = sorted(
+        query_runner.run_query(
+            "SELECT field FROM fact GROUP BY 1;", return_only_first_col_as_set=True
+        )
+    )
+    entry_number_range = query_runner.run_query(
+        "SELECT MIN(entry_number) AS low, MAX(entry_number) AS high FROM fact_resource;"
+    ).iloc[0]
+    busiest_entities = query_runner.run_query(
+        "SELECT entity, COUNT(*) AS n FROM fact GROUP BY entity ORDER BY n DESC LIMIT 20;"
+    )
+    count_ranges_per_value = [
+        {"lookup_value": str(entity), "min_row_count": 0, "max_row_count": n + 1}
+        for entity, n in zip(busiest_entities["entity"], busiest_entities["n"])
+    ]
+
+    return {
+        "fact": [
+            {
+                "expectation_name": "expect_field_values_to_be_within_set",
+                "table_name": "fact",
+                "field_name": "field",
+                "expected_values_set": fact_fields,
+            },
+            {
+                "expectation_name": "expect_values_for_field_to_be_unique",
+                "table_name": "fact",
+                "fields": ["fact"],
+            },
+            {
+                "expectation_name": "expect_values_for_field_to_be_unique",
+                "table_name": "fact",
+                "fields": ["fact", "field", "value"],
+            },
+            {
+                "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+                "table_name": "fact",
+                "field_name": "entity",
+                "count_ranges_per_value": count_ranges_per_value,
+            },
+            {
+                "expectation_name": "expect_values_in_field_to_be_within_range",
+                "table_name": "fact",
+                "field_name": "entity",
+                "min_expected_value": 0,
+                "max_expected_value": 2**62,
+                "ref_fields": ["fact"],
+            },
+        ],
+        "fact_resource": [
+            {
+                "expectation_name": "expect_values_in_field_to_be_within_range",
+                "table_name": "fact_resource",
+                "field_name": "entry_number",
+                "min_expected_value": int(entry_number_range["low"]),
+                "max_expected_value": int(entry_number_range["high"]),
+                "ref_fields": ["fact"],
+            },
+            {
+                "expectation_name": "expect_field_values_to_be_within_set",
+                "table_name": "fact_resource",
+                "field_name": "resource",
+                "expected_values_set": sorted(
+                    query_runner.run_query(
+                        "SELECT resource FROM fact_resource GROUP BY 1;",
+                        return_only_first_col_as_set=True,
+                    )
+                ),
+            },
+            {
+                "expectation_name": "expect_values_for_field_to_be_unique",
+                "table_name": "fact_resource",
+                "fields": ["fact", "resource", "entry_number"],
+            },
+        ],
+    }
+
+
+def measure(query_runner: QueryRunner, expectations: list, engine: str, repeat: int):
+    "Best wall time of running the suite with the engine over repeat runs"
+    best_time = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        responses = list(run_suite(query_runner, expectations, engine=engine))
+        elapsed = time.perf_counter() - start
+        assert all(response.result for response in responses)
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return best_time
+
+
+@click.command()
+@click.option(
+    "--sqlite-dataset-path",
+    default="unit_tests/testing_dataset/lb_single_res.sqlite3",
+    show_default=True,
+)
+@click.option("--repeat", default=3, show_default=True)
+def benchmark_vectorized(sqlite_dataset_path, repeat):
+    with QueryRunner(sqlite_dataset_path) as query_runner:
+        for table_name, expectations in table_suites(query_runner).items():
+            rows = query_runner.run_query(f"SELECT COUNT(*) AS n FROM {table_name};")[
+                "n"
+            ][0]
+            click.echo(
+                f"{table_name}: {len(expectations)} expectations, {rows} rows, best of {repeat}"
+            )
+            for engine in ("sql", "vectorized"):
+                best_time = measure(query_runner, expectations, engine, repeat)
+                click.echo(
+                    f"{engine:>12}: {best_time:8.3f} s  {rows / best_time:12.0f} rows/s"
+                )
+
+
+if __name__ == "__main__":
+    benchmark_vectorized()
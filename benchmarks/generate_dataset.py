@@ -0,0 +1,380 @@
+"""Builds a synthetic dataset with the digital-land schema (entity, fact,
+fact_resource, column_field, dataset_resource, issue, old_entity, same
+tables and indexes as the testing datasets) at any scale, to see how the
+expectations behave on large collections. The data is random but
+reproducible (seeded) and shaped like a real collection: WKT multipolygons
+with a few to a few hundred vertices (a share of them self-intersecting,
+hence invalid), JSON blobs with a few keys, about 9 facts per entity and
+one or two fact_resource rows per fact.
+
+Run from the root of the repo, e.g. for ~10M fact rows:
+
+    PYTHONPATH=. python3 benchmarks/generate_dataset.py --path /tmp/synthetic.sqlite3 --entities 1100000
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+import click
+
+SCHEMA = """
+CREATE TABLE dataset_resource (end_date TEXT,
+entry_date TEXT,
+dataset TEXT,
+entity_count INTEGER,
+entry_count INTEGER,
+line_count INTEGER,
+mime_type TEXT,
+internal_path TEXT,
+internal_mime_type TEXT,
+resource TEXT,
+start_date TEXT);
+CREATE TABLE column_field (end_date TEXT,
+entry_date TEXT,
+field TEXT,
+dataset TEXT,
+start_date TEXT,
+resource TEXT,
+column TEXT);
+CREATE TABLE issue (end_date TEXT,
+entry_date TEXT,
+entry_number INTEGER,
+field TEXT,
+issue_type TEXT,
+line_number INTEGER,
+dataset TEXT,
+resource TEXT,
+start_date TEXT,
+value TEXT);
+CREATE TABLE entity (dataset TEXT,
+end_date TEXT,
+entity INTEGER PRIMARY KEY,
+entry_date TEXT,
+geojson JSON,
+geometry TEXT,
+json JSON,
+name TEXT,
+organisation_entity TEXT,
+point TEXT,
+prefix TEXT,
+reference TEXT,
+start_date TEXT,
+typology TEXT);
+CREATE TABLE old_entity (end_date TEXT,
+entity INTEGER,
+entry_date TEXT,
+notes TEXT,
+old_entity TEXT PRIMARY KEY,
+start_date TEXT,
+status TEXT, FOREIGN KEY (entity) REFERENCES entity (entity));
+CREATE TABLE fact (end_date TEXT,
+entity INTEGER,
+fact TEXT PRIMARY KEY,
+field TEXT,
+entry_date TEXT,
+reference_entity TEXT,
+start_date TEXT,
+value TEXT, FOREIGN KEY (entity) REFERENCES entity (entity));
+CREATE TABLE fact_resource (end_date TEXT,
+fact TEXT,
+entry_date TEXT,
+entry_number INTEGER,
+resource TEXT,
+start_date TEXT, FOREIGN KEY (fact) REFERENCES fact (fact));
+"""
+
+# created once the tables are loaded, which is much faster
+INDEXES = """
+CREATE INDEX old_entity_on_entity_index on old_entity (entity);
+CREATE INDEX old_entity_on_old_entity_index on old_entity (old_entity);
+CREATE INDEX old_entity_on_status_index on old_entity (status);
+CREATE INDEX fact_on_entity_index on fact (entity);
+CREATE INDEX fact_resource_on_fact_index on fact_resource (fact);
+CREATE INDEX fact_resource_on_resource_index on fact_resource (resource);
+CREATE INDEX column_field_on_dataset_index on column_field (dataset);
+CREATE INDEX column_field_on_resource_index on column_field (resource);
+CREATE INDEX column_field_on_column_index on column_field (column);
+CREATE INDEX column_field_on_field_index on column_field (field);
+CREATE INDEX issue_on_resource_index on issue (resource);
+CREATE INDEX issue_on_dataset_index on issue (dataset);
+CREATE INDEX issue_on_field_index on issue (field);
+CREATE INDEX dataset_resource_on_resource_index on dataset_resource (resource);
+"""
+
+FIRST_ENTITY = 44000000
+
+# organisation_entity values and how often they appear
+ORGANISATIONS = [("16", 0.75), ("109", 0.05)] + [
+    (str(organisation), 0.2 / 50) for organisation in range(200, 250)
+]
+
+JSON_KEYS = ["documentation-url", "end-date", "entry-date", "start-date", "notes"]
+
+FACT_FIELDS = [
+    "name",
+    "geometry",
+    "reference",
+    "entry-date",
+    "start-date",
+    "documentation-url",
+    "organisation",
+    "notes",
+    "prefix",
+]
+
+ISSUE_TYPES = ["invalid geometry", "invalid date", "unknown entity", "missing value"]
+
+BATCH_SIZE = 50000
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _date(rng: random.Random) -> str:
+    return (
+        f"{rng.randint(1990, 2023)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    )
+
+
+def _ring(rng: random.Random, lon: float, lat: float, radius: float, vertices: int):
+    "A closed star-shaped (so simple) ring around (lon, lat)"
+    angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(vertices))
+    distances = [radius * rng.uniform(0.5, 1.0) for _ in range(vertices)]
+    points = [
+        (lon + distance * math.cos(angle), lat + distance * math.sin(angle))
+        for angle, distance in zip(angles, distances)
+    ]
+    return points + points[:1]
+
+
+def make_multipolygon(rng: random.Random, lon: float, lat: float, invalid: bool):
+    """WKT of a multipolygon of one to three parts (the first one at lon,
+    lat) with 6 to ~400 vertices each. An invalid one has two vertices of
+    its first part swapped, so its edges cross."""
+    polygons = []
+    previous_radius = None
+    for part in range(rng.choice([1, 1, 1, 2, 3])):
+        radius = rng.uniform(0.0005, 0.01)
+        if previous_radius is not None:
+            # parts side by side, apart from each other
+            lon += previous_radius + 1.5 * radius
+        vertices = min(int(rng.lognormvariate(3.0, 1.0)) + 6, 400)
+        polygons.append(_ring(rng, lon, lat, radius, vertices))
+        previous_radius = radius
+    if invalid:
+        first_ring = polygons[0]
+        opposite = len(first_ring) // 2
+        first_ring[1], first_ring[opposite] = first_ring[opposite], first_ring[1]
+    str_polygons = ",".join(
+        "((" + ",".join(f"{x:.6f} {y:.6f}" for x, y in ring) + "))" for ring in polygons
+    )
+    return f"MULTIPOLYGON ({str_polygons})"
+
+
+def _insert(con: sqlite3.Connection, table_name: str, rows: list):
+    if rows:
+        placeholders = ",".join("?" * len(rows[0]))
+        con.executemany(f"INSERT INTO {table_name} VALUES ({placeholders});", rows)
+
+
+def generate_dataset(
+    path: str,
+    entities: int = 10000,
+    facts_per_entity: int = 9,
+    resources: int = 100,
+    invalid_shapes_ratio: float = 0.01,
+    dataset: str = "conservation-area",
+    seed: int = 0,
+):
+    """Writes the synthetic dataset to path (replacing it). Returns the
+    number of rows of each table."""
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode = OFF;")
+    con.execute("PRAGMA synchronous = OFF;")
+    con.executescript(SCHEMA)
+
+    resource_hashes = [_sha256(f"{dataset}-resource-{i}") for i in range(resources)]
+    entry_date = "2023-01-01"
+    row_counts = dict.fromkeys(
+        [
+            "entity",
+            "fact",
+            "fact_resource",
+            "column_field",
+            "dataset_resource",
+            "issue",
+            "old_entity",
+        ],
+        0,
+    )
+
+    organisations, weights = zip(*ORGANISATIONS)
+    entity_rows, fact_rows, fact_resource_rows, issue_rows = [], [], [], []
+    for i in range(entities):
+        entity = FIRST_ENTITY + i
+        lon, lat = rng.uniform(-5.0, 1.5), rng.uniform(50.0, 55.0)
+        reference = str(1000 + i)
+        name = f"{dataset.replace('-', ' ').title()} {reference}"
+        geometry = make_multipolygon(
+            rng, lon, lat, invalid=rng.random() < invalid_shapes_ratio
+        )
+        json_blob = {
+            key: (
+                f"https://example.com/{dataset}/{reference}"
+                if key == "documentation-url"
+                else _date(rng)
+            )
+            for key in rng.sample(JSON_KEYS[:4], rng.randint(1, 4))
+        }
+        if rng.random() < 0.1:
+            json_blob["notes"] = " ".join(
+                rng.choice(["listed", "grade", "II", "house", "C18", "brick"])
+                for _ in range(rng.randint(5, 40))
+            )
+        entity_rows.append(
+            (
+                dataset,
+                "",
+                entity,
+                entry_date,
+                "",
+                geometry,
+                json.dumps(json_blob),
+                name,
+                rng.choices(organisations, weights)[0],
+                f"POINT({lon:.6f} {lat:.6f})",
+                dataset,
+                reference,
+                _date(rng),
+                "geography",
+            )
+        )
+
+        for field in FACT_FIELDS[:facts_per_entity]:
+            value = geometry if field == "geometry" else f"{field}-{reference}"
+            fact = _sha256(f"{entity}{field}{value}")
+            fact_rows.append(("", entity, fact, field, entry_date, "", "", value))
+            for _ in range(rng.choice([1, 1, 1, 2])):
+                fact_resource_rows.append(
+                    (
+                        "",
+                        fact,
+                        entry_date,
+                        rng.randint(1, entities),
+                        rng.choice(resource_hashes),
+                        "",
+                    )
+                )
+            if rng.random() < 0.01:
+                issue_rows.append(
+                    (
+                        "",
+                        entry_date,
+                        rng.randint(1, entities),
+                        field,
+                        rng.choice(ISSUE_TYPES),
+                        rng.randint(2, entities + 1),
+                        dataset,
+                        rng.choice(resource_hashes),
+                        "",
+                        value[:100],
+                    )
+                )
+
+        if len(fact_rows) >= BATCH_SIZE or i == entities - 1:
+            for table_name, rows in [
+                ("entity", entity_rows),
+                ("fact", fact_rows),
+                ("fact_resource", fact_resource_rows),
+                ("issue", issue_rows),
+            ]:
+                _insert(con, table_name, rows)
+                row_counts[table_name] += len(rows)
+                rows.clear()
+            con.commit()
+
+    old_entity_rows = [
+        (
+            "",
+            FIRST_ENTITY + rng.randrange(entities),
+            "",
+            "",
+            str(FIRST_ENTITY - 1 - i),
+            "",
+            "301",
+        )
+        for i in range(entities // 100)
+    ]
+    dataset_resource_rows = [
+        (
+            "",
+            entry_date,
+            dataset,
+            entities // resources,
+            entities // resources,
+            entities // resources + 1,
+            "text/csv",
+            "",
+            "",
+            resource,
+            "",
+        )
+        for resource in resource_hashes
+    ]
+    column_field_rows = [
+        ("", entry_date, field, dataset, "", resource, field.replace("-", "_").upper())
+        for resource in resource_hashes
+        for field in FACT_FIELDS
+    ]
+    for table_name, rows in [
+        ("old_entity", old_entity_rows),
+        ("dataset_resource", dataset_resource_rows),
+        ("column_field", column_field_rows),
+    ]:
+        _insert(con, table_name, rows)
+        row_counts[table_name] = len(rows)
+    con.commit()
+
+    con.executescript(INDEXES)
+    con.execute("ANALYZE;")
+    con.commit()
+    con.close()
+    return row_counts
+
+
+@click.command()
+@click.option("--path", required=True, help="sqlite3 file to write")
+@click.option("--entities", default=10000, show_default=True)
+@click.option("--facts-per-entity", default=9, show_default=True)
+@click.option("--resources", default=100, show_default=True)
+@click.option("--invalid-shapes-ratio", default=0.01, show_default=True)
+@click.option("--dataset", default="conservation-area", show_default=True)
+@click.option("--seed", default=0, show_default=True)
+def generate(
+    path, entities, facts_per_entity, resources, invalid_shapes_ratio, dataset, seed
+):
+    start = time.perf_counter()
+    row_counts = generate_dataset(
+        path,
+        entities=entities,
+        facts_per_entity=facts_per_entity,
+        resources=resources,
+        invalid_shapes_ratio=invalid_shapes_ratio,
+        dataset=dataset,
+        seed=seed,
+    )
+    for table_name, rows in row_counts.items():
+        click.echo(f"{table_name:>16}: {rows} rows")
+    click.echo(f"written to {path} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    generate()
@@ -1,11 +1,17 @@
-import spatialite
 import pandas as pd
 import yaml
 from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json
 from datetime import datetime
+from contextlib import contextmanager
+import math
+import os
+import shutil
+import threading
 import warnings
-import copy
+from serializer import write_response_json, response_to_json
+from backends import DEFAULT_BACKEND, make_backend
+from metrics import record_query, record_rows, record_scratch_use, span
 
 
 def transform_df_first_column_into_set(dataframe: pd.DataFrame) -> set:
@@ -13,6 +19,41 @@ def transform_df_first_column_into_set(dataframe: pd.DataFrame) -> set:
     return set(dataframe.iloc[:, 0].unique())
 
 
+def wilson_interval(violations: int, trials: int, z: float = 1.96) -> list:
+    """Wilson score interval of a proportion (95% confidence by default),
+    returns [lower, upper] or [None, None] when nothing was sampled"""
+    if not trials:
+        return [None, None]
+    proportion = violations / trials
+    denominator = 1 + z**2 / trials
+    centre = (proportion + z**2 / (2 * trials)) / denominator
+    margin = (
+        z
+        * math.sqrt(proportion * (1 - proportion) / trials + z**2 / (4 * trials**2))
+        / denominator
+    )
+    return [max(0.0, centre - margin), min(1.0, centre + margin)]
+
+
+def parse_sample(sample) -> dict:
+    """Validates the sample setting of a suite: None (exact mode),
+    {"fraction": 0 < f <= 1} or {"rows": n > 0}"""
+    if sample is None:
+        return None
+    if isinstance(sample, dict) and len(sample) == 1:
+        if 0 < sample.get("fraction", 0) <= 1:
+            return {"fraction": float(sample["fraction"])}
+        if sample.get("rows", 0) > 0:
+            return {"rows": int(sample["rows"])}
+    raise ValueError(
+        f"sample must be {{'fraction': 0 < f <= 1}} or {{'rows': n > 0}}, got '{sample}'"
+    )
+
+
+# alias the scratch database of a QueryRunner is attached as
+SCRATCH_ALIAS = "dq_scratch"
+
+
 def config_parser(filepath: str):
     "Will parse a config file"
     with open(filepath) as file:
@@ -32,36 +73,363 @@ class DataQualityException(Exception):
 
 
 class QueryRunner:
-    "Class to run queries usings spatialite"
+    """Class to run queries usings spatialite (or another backend, see
+    backends.py, e.g. QueryRunner(path, backend="duckdb"))
+
+    Keeps one warm connection per thread (spatialite is loaded once per
+    connection and SQLite's page cache survives between queries). The
+    connections are opened read-only and closed by close() or when the
+    runner is used as a context manager:
+
+        with QueryRunner("dataset.sqlite3") as query_runner:
+            query_runner.run_query("SELECT COUNT(*) FROM entity;")
+
+    With a sample ({"fraction": 0.01} or {"rows": 10000}) the expectations
+    that support it read a deterministic rowid stride of their table instead
+    of the whole table (see table_source and sample_report).
+
+    With a scratch database (see indexes.py) the grouping expectations read
+    indexed copies of the columns they group by (see grouping_source) and
+    the JSON expectations read their field already shredded (see
+    shredded_json).
+    """
 
-    def __init__(self, tested_dataset_path: str):
+    # whether an equivalent runner can be rebuilt from settings() in a
+    # worker process (see sharding.py)
+    runs_in_worker_processes = True
+
+    def __init__(
+        self,
+        tested_dataset_path: str,
+        read_only: bool = True,
+        sample: dict = None,
+        backend: str = DEFAULT_BACKEND,
+        scratch: dict = None,
+    ):
         "Receives a path/name of sqlite dataset against which it will run the queries"
         self.tested_dataset_path = tested_dataset_path
+        self.read_only = read_only
+        self.backend = make_backend(backend)
+        self.sample = parse_sample(sample)
+        if self.sample is not None and not self.backend.supports_sampling:
+            raise ValueError(f"the {self.backend.name} backend can't sample tables")
+        self.scratch = None
+        self._owned_scratch_path = None
+        if scratch is not None:
+            self.use_scratch(scratch)
+        self._sample_strides = {}
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def inform_dataset_path(self):
         return self.tested_dataset_path
 
+    def settings(self) -> dict:
+        "Arguments to build an equivalent runner (e.g. in a worker process)"
+        return {
+            "tested_dataset_path": self.tested_dataset_path,
+            "read_only": self.read_only,
+            "sample": self.sample,
+            "backend": self.backend.name,
+            "scratch": self.scratch,
+        }
+
+    @staticmethod
+    def scratch_key(table_name: str, columns: list, kind: str = None) -> str:
+        """Key of the table built from columns of a table in a scratch
+        database: their indexed copy, or another kind (e.g. json_each)"""
+        key = f"{table_name}({','.join(sorted(columns))})"
+        return key if kind is None else f"{kind}:{key}"
+
+    def use_scratch(self, scratch: dict, owned: bool = False):
+        """Reads grouped columns from a scratch database: {"path": <sqlite
+        file>, "tables": {<scratch_key>: {"scratch_table": <name>, ...}}}.
+        An owned scratch database is removed by close()."""
+        if not self.backend.supports_scratch_indexes:
+            raise ValueError(
+                f"the {self.backend.name} backend can't attach a scratch database"
+            )
+        self.scratch = scratch
+        if owned:
+            self._owned_scratch_path = scratch["path"]
+
+    def grouping_source(self, table_name: str, columns: list) -> str:
+        """What to read table_name from in the FROM clause of a GROUP BY over
+        columns: an indexed copy of those columns in the scratch database,
+        aliased as the table, when there is one, otherwise the table itself"""
+        if self.scratch is None:
+            return table_name
+        index = self.scratch["tables"].get(self.scratch_key(table_name, columns))
+        if index is None:
+            return table_name
+        record_scratch_use(index)
+        return f"{SCRATCH_ALIAS}.{index['scratch_table']} AS {table_name}"
+
+    def shredded_json(self, table_name: str, field_name: str) -> str:
+        """The table of the scratch database holding the json_each rows
+        (row_id, id, key, value, type) of the JSON objects of a field, with
+        row_id the rowid of their row, or None when the field wasn't
+        shredded (see shredding.py)"""
+        return self._scratch_table(
+            self.scratch_key(table_name, [field_name], "json_each")
+        )
+
+    def parsed_geometries(self, table_name: str, shape_field: str) -> str:
+        """The table of the scratch database holding the geometries of the
+        WKT shapes of a field parsed once (row_id, shape, min_x, max_x, min_y,
+        max_y), with row_id the rowid of their row, or None when the field
+        wasn't parsed (see parsed_geometries.py)"""
+        return self._scratch_table(
+            self.scratch_key(table_name, [shape_field], "geometry")
+        )
+
+    def _scratch_table(self, key: str) -> str:
+        "Qualified name of a table of the scratch database, None if not built"
+        if self.scratch is None:
+            return None
+        scratch_table = self.scratch["tables"].get(key)
+        if scratch_table is None:
+            return None
+        record_scratch_use(scratch_table)
+        return f"{SCRATCH_ALIAS}.{scratch_table['scratch_table']}"
+
+    def rowid_range(self, table_name: str) -> tuple:
+        """(MIN, MAX) of the rowids of a table, (None, None) when it is empty
+        (both are read from the ends of the rowid b-tree, cheap)"""
+        first_rowid, last_rowid = (
+            self.run_query(
+                f"""SELECT (SELECT MIN(rowid) FROM {table_name}) AS first_rowid,
+                       (SELECT MAX(rowid) FROM {table_name}) AS last_rowid;"""
+            )
+            .iloc[0]
+            .tolist()
+        )
+        if pd.isna(first_rowid):
+            return None, None
+        return int(first_rowid), int(last_rowid)
+
+    def _sample_stride(self, table_name: str) -> dict:
+        """Rowid range, row count and stride of the sample of a table,
+        computed once per table (min/max rowid and COUNT(*) are cheap)"""
+        stride = self._sample_strides.get(table_name)
+        if stride is None:
+            first_rowid, last_rowid, table_rows = (
+                self.run_query(
+                    f"""SELECT (SELECT MIN(rowid) FROM {table_name}) AS first_rowid,
+                           (SELECT MAX(rowid) FROM {table_name}) AS last_rowid,
+                           (SELECT COUNT(*) FROM {table_name}) AS table_rows;"""
+                )
+                .iloc[0]
+                .tolist()
+            )
+            if "fraction" in self.sample:
+                step = round(1 / self.sample["fraction"])
+            elif first_rowid is not None:
+                step = math.ceil((last_rowid - first_rowid + 1) / self.sample["rows"])
+            else:
+                step = 1
+            stride = {
+                "first_rowid": first_rowid,
+                "last_rowid": last_rowid,
+                "table_rows": int(table_rows),
+                "stride": max(step, 1),
+            }
+            self._sample_strides[table_name] = stride
+        return stride
+
+    def table_source(self, table_name: str) -> str:
+        """What to read table_name from in a FROM clause: the table itself
+        or, when sampling, a subquery (aliased as the table, with its rowid)
+        over every stride-th rowid of the table. The rowids are looked up
+        one by one, so only the pages holding sampled rows are read."""
+        if self.sample is None:
+            return table_name
+
+        stride = self._sample_stride(table_name)
+        if stride["first_rowid"] is None:
+            return f"(SELECT rowid, * FROM {table_name} WHERE 0) AS {table_name}"
+        return f"""(
+            WITH RECURSIVE sampled_rowid(rid) AS (
+                SELECT {stride["first_rowid"]}
+                UNION ALL
+                SELECT rid + {stride["stride"]} FROM sampled_rowid
+                WHERE rid + {stride["stride"]} <= {stride["last_rowid"]})
+            SELECT {table_name}.rowid AS rowid, {table_name}.*
+            FROM sampled_rowid JOIN {table_name} ON {table_name}.rowid = sampled_rowid.rid
+            ) AS {table_name}"""
+
+    def sample_report(self, table_name: str, violations_in_sample: int) -> dict:
+        """Estimated violation rate of a sampled expectation, with its 95%
+        Wilson confidence interval and the estimated number of violations in
+        the whole table. None in exact mode."""
+        if self.sample is None:
+            return None
+
+        stride = self._sample_stride(table_name)
+        if "sampled_rows" not in stride:
+            stride["sampled_rows"] = int(
+                self.run_query(
+                    f"SELECT COUNT(*) AS n FROM {self.table_source(table_name)};"
+                )["n"][0]
+            )
+        sampled_rows = stride["sampled_rows"]
+        rate = violations_in_sample / sampled_rows if sampled_rows else None
+        return {
+            "method": "rowid_stride",
+            "stride": stride["stride"],
+            "sampled_rows": sampled_rows,
+            "table_rows": stride["table_rows"],
+            "violations_in_sample": violations_in_sample,
+            "estimated_violation_rate": rate,
+            "violation_rate_95_interval": wilson_interval(
+                violations_in_sample, sampled_rows
+            ),
+            "estimated_violations": (
+                None if rate is None else round(rate * stride["table_rows"])
+            ),
+        }
+
+    def _connect(self):
+        "Opens a new backend connection to the dataset (read-only by default)"
+        return self.backend.connect(self.tested_dataset_path, self.read_only)
+
+    def get_connection(self):
+        "Returns the connection of the current thread, opening it on first use"
+        con = getattr(self._local, "connection", None)
+        if con is None:
+            con = self._connect()
+            self._local.connection = con
+            with self._connections_lock:
+                self._connections.append(con)
+        if (
+            self.scratch is not None
+            and getattr(self._local, "scratch_path", None) != self.scratch["path"]
+        ):
+            self.backend.attach(con, self.scratch["path"], SCRATCH_ALIAS, True)
+            self._local.scratch_path = self.scratch["path"]
+        return con
+
+    @contextmanager
+    def attached(self, database_path: str, alias: str):
+        """Attaches another (read-only) sqlite database to the connection of
+        the current thread for the duration of the with block"""
+        con = self.get_connection()
+        self.backend.attach(con, database_path, alias, self.read_only)
+        try:
+            yield con
+        finally:
+            self.backend.detach(con, alias)
+
+    @contextmanager
+    def temp_table(
+        self, table_name: str, columns: dict, rows, index_column: str = None
+    ):
+        """Creates a temporary table on the connection of the current thread,
+        filled with rows (see Backend.create_temp_table), for the duration of
+        the with block"""
+        con = self.get_connection()
+        self.backend.create_temp_table(con, table_name, columns, rows, index_column)
+        try:
+            yield table_name
+        finally:
+            self.backend.drop_temp_table(con, table_name)
+
+    @contextmanager
+    def spatial_index(self, table_name: str, shape_field: str):
+        """R*Tree of the bounding boxes of the shapes of a table (see
+        Backend.spatial_index_statements), for the duration of the with
+        block: the one of the scratch database when it was built there (see
+        indexes.py), otherwise a temporary one built on the connection of the
+        current thread. None when the backend can't index shapes."""
+        index_name = self._scratch_table(
+            self.scratch_key(table_name, [shape_field], "rtree")
+        )
+        if index_name is not None or not self.backend.supports_spatial_index:
+            yield index_name
+            return
+
+        con = self.get_connection()
+        try:
+            for statement in self.backend.spatial_index_statements(
+                "temp.dq_spatial_index",
+                table_name,
+                shape_field,
+                self.parsed_geometries(table_name, shape_field),
+            ):
+                con.execute(statement)
+            yield "temp.dq_spatial_index"
+        finally:
+            con.execute("DROP TABLE IF EXISTS temp.dq_spatial_index;")
+
+    def close(self):
+        "Closes every connection opened by the runner, in any thread"
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for con in connections:
+            con.close()
+        self._local = threading.local()
+        if self._owned_scratch_path is not None:
+            shutil.rmtree(os.path.dirname(self._owned_scratch_path), ignore_errors=True)
+            self.scratch = None
+            self._owned_scratch_path = None
+
     def run_query(self, sql_query: str, return_only_first_col_as_set: bool = False):
         """
         Receives a sql query and returns the results either in a pandas
         dataframe or just the first column as a set (this is useful to
         test presence or absence of items like tables, columns, etc).
 
-        Note: connection is openned and closed at each query, but for use
-        cases like the present one that would not offer big benefits and
-        would mean having to dev thread-lcoal connection pools. For more
-        info see: https://stackoverflow.com/a/14520670
+        Note: the query runs on the pooled connection of the current thread,
+        so later queries reuse the page cache filled by the earlier ones.
         """
-        with spatialite.connect(self.tested_dataset_path) as con:
-            cursor = con.execute(sql_query)
-            cols = [column[0] for column in cursor.description]
-            results = pd.DataFrame.from_records(data=cursor.fetchall(), columns=cols)
+        record_query()
+        with span("dq.query", {"sql": sql_query}):
+            cursor = self.backend.execute(self.get_connection(), sql_query)
+            try:
+                cols = [column[0] for column in cursor.description]
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        record_rows(len(rows))
+        results = pd.DataFrame.from_records(data=rows, columns=cols)
 
         if return_only_first_col_as_set:
             return transform_df_first_column_into_set(results)
         else:
             return results
 
+    def iter_query(
+        self, sql_query: str, batch_size: int = 10000, as_dataframe: bool = False
+    ):
+        """
+        Receives a sql query and yields its results in batches of at most
+        batch_size rows (using cursor.fetchmany), either as lists of row
+        tuples or, with as_dataframe=True, as small pandas dataframes. Memory
+        stays bounded by the batch size whatever the size of the result.
+        """
+        record_query()
+        cursor = self.backend.execute(self.get_connection(), sql_query)
+        try:
+            cols = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                record_rows(len(rows))
+                if as_dataframe:
+                    yield pd.DataFrame.from_records(data=rows, columns=cols)
+                else:
+                    yield rows
+        finally:
+            cursor.close()
+
 
 @dataclass_json
 @dataclass
@@ -74,6 +442,14 @@ class ExpectationResponse:
     details: dict = None
     sqlite_dataset: str = None
     data_quality_execution_time: str = field(init=False)
+    # set when the response was reused from a previous run (see incremental.py)
+    cached: bool = False
+    cached_from: str = None
+    # estimated violation rate when the expectation ran on a sample
+    sample: dict = None
+    # timings, rows fetched, ... when the suite ran with collect_metrics
+    # (see metrics.py)
+    metrics: dict = None
 
     def __post_init__(self):
         "Adds a few more interesting items and adjusts response for log"
@@ -94,8 +470,9 @@ class ExpectationResponse:
             now = datetime.now()
             self.data_quality_execution_time = now.strftime("%Y%m%d_%H%M%S")
 
-    def save_to_file(self, dir_path: str):
-        "Prepares a naming convention and saves the response to a provided path"
+    def save_to_file(self, dir_path: str) -> int:
+        """Prepares a naming convention and saves the response to a provided
+        path, returns the size of the saved json"""
 
         if self.result == True:
             name_status = "success"
@@ -106,9 +483,11 @@ class ExpectationResponse:
         file_name = f"{self.data_quality_execution_time}_{name_status}_{self.expectation_input['expectation_name']}_{name_hash}.json"
 
         with open(dir_path + file_name, "w") as f:
-            self_save_version = copy.deepcopy(self)
-            self_save_version.result = str(self_save_version.result)
-            f.write(self_save_version.to_json())
+            return write_response_json(self, f)
+
+    def to_saved_json(self) -> str:
+        "Returns the json saved for the response (with result as a string)"
+        return response_to_json(self)
 
     def act_on_failure(self):
         "Raises error if severity is RaiseError or shows warning if severity is LogWarning"
@@ -0,0 +1,150 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import chain
+from core import QueryRunner
+from planner import plan_suite, run_step
+from indexes import (
+    grouping_index_builds,
+    spatial_index_builds,
+    provision_scratch_tables,
+)
+from shredding import json_shredding_builds
+from parsed_geometries import geometry_parsing_builds
+from sharding import process_query_runner
+
+EXECUTORS = ("thread", "process")
+
+ENGINES = ("sql", "vectorized")
+
+
+def make_executor(executor: str, workers: int):
+    """Returns a thread or process pool with the given number of workers.
+    Thread workers share the QueryRunner (which keeps one connection per
+    thread), process workers open their own QueryRunner per dataset.
+    """
+    if executor == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    elif executor == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f"executor must be one of {EXECUTORS}, got '{executor}'")
+
+
+def _run_step_in_process(query_runner_settings: dict, step, kwargs: dict):
+    """Runs a step inside a worker process with the process' own QueryRunner,
+    built from the settings of the runner of the suite (see QueryRunner.settings)"""
+    return run_step(process_query_runner(query_runner_settings), step, **kwargs)
+
+
+def submit_steps(pool, query_runner: QueryRunner, steps: list, **kwargs) -> list:
+    "Submits every step to the pool, returning the futures in the same order"
+    if isinstance(pool, ProcessPoolExecutor):
+        return [
+            pool.submit(_run_step_in_process, query_runner.settings(), step, kwargs)
+            for step in steps
+        ]
+    return [pool.submit(run_step, query_runner, step, **kwargs) for step in steps]
+
+
+def _in_suite_order(step_results, ready: dict = None):
+    """Yields the responses of (position, response) pairs in suite order,
+    ready holds responses already known before any step ran"""
+    ready = dict(ready or {})
+    next_position = 0
+    for results in chain([()], step_results):
+        ready.update(results)
+        while next_position in ready:
+            yield ready.pop(next_position)
+            next_position += 1
+
+
+def run_suite(
+    query_runner: QueryRunner,
+    expectations: list,
+    fuse_scans: bool = False,
+    engine: str = "sql",
+    pool=None,
+    incremental_state=None,
+    collect_metrics: bool = False,
+    provision_indexes: bool = False,
+    shred_json: bool = False,
+    parse_geometries: bool = False,
+    **kwargs,
+):
+    """Runs the expectations of a suite and returns an iterator over their
+    ExpectationResponses in the order of the suite. Without a pool the steps
+    run one after the other as the iterator is consumed, with a pool (see
+    make_executor) they are all dispatched straight away and gathered back
+    in order, so several suites can be queued on the same pool. With
+    fuse_scans the suite is first grouped into fused table scans (see
+    planner.plan_suite). With the vectorized engine the range, set,
+    uniqueness and lookup count expectations of each table are evaluated
+    together over numpy arrays of its columns (see vectorized.py), the
+    others still run in sql. With an incremental_state (see incremental.py)
+    expectations whose tables did not change reuse their previous response.
+    With collect_metrics every response that ran gets its metrics (timings,
+    rows fetched, ..., see metrics.py). With provision_indexes the columns
+    several uniqueness or lookup count expectations group by, when no index
+    covers them, are copied once with an index into a scratch database they
+    then read, and the shapes several point lookups search are indexed there
+    in an R*Tree (see indexes.py); the dataset itself is never modified. With
+    shred_json the JSON fields several JSON expectations parse are shredded
+    once (json_each) into the same scratch database (see shredding.py). With
+    parse_geometries the shape fields several geometry expectations read are
+    parsed once into geometries there (see parsed_geometries.py), which the
+    R*Trees of provision_indexes are then built from.
+    kwargs (e.g. data_quality_execution_time) are passed to every expectation.
+    """
+    cached_responses = {}
+    if incremental_state is not None:
+        for position, expectation in enumerate(expectations):
+            response = incremental_state.cached_response(
+                query_runner, expectation, **kwargs
+            )
+            if response is not None:
+                cached_responses[position] = response
+
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {ENGINES}, got '{engine}'")
+
+    if fuse_scans or engine == "vectorized":
+        steps = plan_suite(
+            expectations,
+            skip_positions=cached_responses.keys(),
+            fuse_scans=fuse_scans,
+            vectorize=engine == "vectorized",
+        )
+    else:
+        steps = [
+            (position, expectation)
+            for position, expectation in enumerate(expectations)
+            if position not in cached_responses
+        ]
+
+    if query_runner.scratch is None and query_runner.backend.supports_scratch_indexes:
+        builds = []
+        if parse_geometries:
+            builds.extend(geometry_parsing_builds(query_runner, steps))
+        parsed_geometry_keys = [build["key"] for build in builds]
+        if provision_indexes:
+            builds.extend(grouping_index_builds(query_runner, steps))
+            builds.extend(
+                spatial_index_builds(
+                    query_runner, steps, parsed_geometry_keys=parsed_geometry_keys
+                )
+            )
+        if shred_json:
+            builds.extend(json_shredding_builds(query_runner, steps))
+        provision_scratch_tables(query_runner, builds)
+
+    if pool is None:
+        step_results = (
+            run_step(query_runner, step, collect_metrics=collect_metrics, **kwargs)
+            for step in steps
+        )
+    else:
+        futures = submit_steps(
+            pool, query_runner, steps, collect_metrics=collect_metrics, **kwargs
+        )
+        step_results = (future.result() for future in futures)
+
+    return _in_suite_order(step_results, ready=cached_responses)
@@ -1,9 +1,68 @@
+import csv
 import inspect
+import re
 import pandas as pd
 from core import QueryRunner, ExpectationResponse
+from validity_cache import invalid_shapes_with_validity_cache
+from json_schema import json_schema_violations
+from geometry_profile import geometry_profile_violations
+from sharding import rowid_shards, run_sharded_queries
 from math import inf
 
 
+def _run_failures_query(
+    query_runner: QueryRunner,
+    sql_query: str,
+    max_failure_samples: int = None,
+    count_failures: bool = False,
+    count_only: bool = False,
+):
+    """Runs a query that returns the rows violating an expectation. By default
+    every violating row is fetched. With max_failure_samples the scan stops
+    after that many rows (LIMIT), with count_failures the exact number of
+    violations is also counted when the samples were truncated, and with
+    count_only the violations are only counted. Returns the failing rows,
+    the number of failures (None if unknown) and whether rows were left out.
+    """
+    sql_query = sql_query.strip().rstrip(";")
+
+    if count_only:
+        failures_count = query_runner.run_query(
+            f"SELECT COUNT(*) AS failures_count FROM ({sql_query});"
+        )["failures_count"][0]
+        return pd.DataFrame(), int(failures_count), bool(failures_count > 0)
+
+    if max_failure_samples is None:
+        failing_rows = query_runner.run_query(sql_query)
+        return failing_rows, len(failing_rows), False
+
+    failing_rows = query_runner.run_query(
+        f"{sql_query}\n LIMIT {max_failure_samples + 1};"
+    )
+    truncated = len(failing_rows) > max_failure_samples
+    failing_rows = failing_rows.head(max_failure_samples)
+    if not truncated:
+        failures_count = len(failing_rows)
+    elif count_failures:
+        failures_count = query_runner.run_query(
+            f"SELECT COUNT(*) AS failures_count FROM ({sql_query});"
+        )["failures_count"][0]
+        failures_count = int(failures_count)
+    else:
+        failures_count = None
+
+    return failing_rows, failures_count, truncated
+
+
+# the value of a json_each row of a shredded JSON field (see
+# QueryRunner.shredded_json) as json, to rebuild objects with
+# json_group_object
+_SHREDDED_JSON_VALUE = """CASE
+    WHEN type IN ('object', 'array') THEN json(value)
+    WHEN type IN ('true', 'false', 'null') THEN json(type)
+    ELSE value END"""
+
+
 def expect_database_to_have_set_of_tables(
     query_runner: QueryRunner,
     expected_tables_set: set,
@@ -21,7 +80,7 @@ def expect_database_to_have_set_of_tables(
     expectation_input = locals()
     expected_tables_set = set(expected_tables_set)
 
-    sql_query = "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name;"
+    sql_query = query_runner.backend.tables_query()
     found_tables_set = query_runner.run_query(
         sql_query, return_only_first_col_as_set=True
     )
@@ -140,12 +199,37 @@ def expect_table_row_count_to_be_in_range(
     return expectation_response
 
 
+def _lookup_ranges_rows(count_ranges_per_value: list, count_ranges_csv_path: str):
+    """Yields (position, lookup_value as text, min_row_count, max_row_count)
+    for every count range, read from the list or, one line at a time, from
+    the csv file (columns lookup_value, min_row_count and max_row_count)"""
+    if count_ranges_per_value is not None:
+        for position, count_range in enumerate(count_ranges_per_value):
+            yield (
+                position,
+                str(count_range["lookup_value"]),
+                count_range["min_row_count"],
+                count_range["max_row_count"],
+            )
+        return
+
+    with open(count_ranges_csv_path, newline="") as f:
+        for position, count_range in enumerate(csv.DictReader(f)):
+            yield (
+                position,
+                count_range["lookup_value"],
+                int(count_range["min_row_count"]),
+                int(count_range["max_row_count"]),
+            )
+
+
 def expect_row_count_for_lookup_value_to_be_in_range(
     query_runner: QueryRunner,
     table_name: str,
     field_name: str,
-    count_ranges_per_value: dict,
+    count_ranges_per_value: list = None,
     expectation_severity: str = "RaiseError",
+    count_ranges_csv_path: str = None,
     **kwargs,
 ):
     """Receives a table name, a field name and a dictionary with row count
@@ -158,35 +242,47 @@ def expect_row_count_for_lookup_value_to_be_in_range(
     1 and 3. If the row counts for all fields are inside the ranges it will
     return True, if at least one of the counts is not inside the range it will
     return False
+
+    Instead of count_ranges_per_value the ranges can be read from a csv file
+    (count_ranges_csv_path) with the columns lookup_value, min_row_count and
+    max_row_count, e.g. thousands of expected counts per organisation. The
+    ranges are loaded into a temporary table and only the rows with one of
+    the lookup values are counted, in sql.
     """
     expectation_name = inspect.currentframe().f_code.co_name
     expectation_input = locals()
 
-    df_expected_counts_by_value = pd.DataFrame(count_ranges_per_value)
-    df_expected_counts_by_value["lookup_value"] = df_expected_counts_by_value[
-        "lookup_value"
-    ].astype("string")
-
-    sql_query = f"SELECT {field_name} AS lookup_value,COUNT(*) AS rows_found FROM {table_name} GROUP BY {field_name};"
-    counted_rows_by_grouped_value = query_runner.run_query(sql_query)
-    counted_rows_by_grouped_value["lookup_value"] = counted_rows_by_grouped_value[
-        "lookup_value"
-    ].astype("string")
-
-    expected_versus_found_df = df_expected_counts_by_value.merge(
-        counted_rows_by_grouped_value, on="lookup_value", how="left"
-    )
-
-    found_not_within_range = expected_versus_found_df.loc[
-        (
-            expected_versus_found_df["rows_found"]
-            >= expected_versus_found_df["max_row_count"]
-        )
-        | (
-            expected_versus_found_df["rows_found"]
-            <= expected_versus_found_df["min_row_count"]
+    if (count_ranges_per_value is None) == (count_ranges_csv_path is None):
+        raise ValueError(
+            "expected one of count_ranges_per_value or count_ranges_csv_path"
         )
-    ]
+
+    source = query_runner.grouping_source(table_name, [field_name])
+    lookup_key = query_runner.backend.lookup_key(field_name)
+    with query_runner.temp_table(
+        "dq_lookup_ranges",
+        {
+            "position": "INTEGER",
+            "lookup_value": "TEXT",
+            "min_row_count": "BIGINT",
+            "max_row_count": "BIGINT",
+        },
+        _lookup_ranges_rows(count_ranges_per_value, count_ranges_csv_path),
+        index_column="lookup_value",
+    ):
+        # lookup values not found at all are not flagged
+        sql_query = f"""
+            WITH found AS (
+                SELECT CAST({field_name} AS TEXT) AS found_value, COUNT(*) AS rows_found
+                FROM {source}
+                WHERE {lookup_key} IN (SELECT lookup_value FROM dq_lookup_ranges)
+                GROUP BY {field_name}
+            )
+            SELECT lookup_value, min_row_count, max_row_count, rows_found
+            FROM found JOIN dq_lookup_ranges ON lookup_value = found_value
+            WHERE rows_found >= max_row_count OR rows_found <= min_row_count
+            ORDER BY position;"""
+        found_not_within_range = query_runner.run_query(sql_query)
 
     result = len(found_not_within_range) == 0
 
@@ -227,20 +323,67 @@ def expect_field_values_to_be_within_set(
     If the flag fail_if_not_found_entire_expected_set is set to True it will
     also return False in cases where a value of the expected set was not
     present in the table.
+    The comparison runs in sql: the expected set is loaded into a temporary
+    table and only the unexpected values (with their row counts) and the
+    expected values not found are fetched, which the details report.
+    When sampling, only the unexpected values are looked for in the sample,
+    the expected values are always looked up in the whole table (a value
+    outside the sample is not missing).
     """
     expectation_name = inspect.currentframe().f_code.co_name
     expectation_input = locals()
     expected_values_set = set(expected_values_set)
 
-    sql_query = f"SELECT {field_name} FROM {table_name} GROUP BY 1;"
-    found_values_set = query_runner.run_query(
-        sql_query, return_only_first_col_as_set=True
-    )
-
-    if fail_if_not_found_entire_expected_set:
-        result = expected_values_set == found_values_set
-    else:
-        result = found_values_set.issubset(expected_values_set)
+    source = query_runner.table_source(table_name)
+    lookup_key = query_runner.backend.lookup_key(field_name)
+    # NULL is left out of the temporary table: "x NOT IN (..., NULL)" is
+    # never true
+    expects_null = None in expected_values_set
+    expected_values_by_text = {
+        str(value): value for value in expected_values_set if value is not None
+    }
+    with query_runner.temp_table(
+        "dq_expected_values",
+        {"value": "TEXT"},
+        ((value,) for value in expected_values_by_text),
+        index_column="value",
+    ):
+        unexpected_null = "" if expects_null else f"OR {field_name} IS NULL"
+        sql_query = f"""
+            SELECT {field_name} AS value, COUNT(*) AS rows_found
+            FROM {source}
+            WHERE {lookup_key} NOT IN (SELECT value FROM dq_expected_values)
+                {unexpected_null}
+            GROUP BY 1
+            ORDER BY 1;"""
+        unexpected_values = query_runner.run_query(sql_query)
+
+        missing_expected_values = []
+        if fail_if_not_found_entire_expected_set:
+            sql_query = f"""
+                SELECT value FROM dq_expected_values
+                WHERE value NOT IN (
+                    SELECT {lookup_key} FROM {table_name}
+                    WHERE {lookup_key} IN (SELECT value FROM dq_expected_values)
+                )
+                ORDER BY value;"""
+            missing_expected_values = [
+                expected_values_by_text[value]
+                for value in query_runner.run_query(sql_query)["value"]
+            ]
+            if expects_null:
+                null_found = query_runner.run_query(
+                    f"SELECT EXISTS (SELECT 1 FROM {table_name} WHERE {field_name} IS NULL) AS found;"
+                )["found"][0]
+                if not null_found:
+                    missing_expected_values.append(None)
+
+    sample = None
+    if query_runner.sample is not None:
+        violations_in_sample = int(unexpected_values["rows_found"].sum())
+        sample = query_runner.sample_report(table_name, violations_in_sample)
+
+    result = len(unexpected_values) == 0 and len(missing_expected_values) == 0
 
     if result:
         msg = "Success: data quality as expected"
@@ -249,9 +392,10 @@ def expect_field_values_to_be_within_set(
         msg = f"Fail: values for field '{field_name}' on table '{table_name}' do not fit expected set criteria, see details"
         details = {
             "table": table_name,
-            "expected_values": expected_values_set,
-            "found_values": found_values_set,
+            "unexpected_values": unexpected_values.to_dict(orient="records"),
         }
+        if fail_if_not_found_entire_expected_set:
+            details["missing_expected_values"] = missing_expected_values
 
     expectation_response = ExpectationResponse(
         expectation_input=expectation_input,
@@ -259,6 +403,7 @@ def expect_field_values_to_be_within_set(
         msg=msg,
         details=details,
         sqlite_dataset=query_runner.inform_dataset_path(),
+        sample=sample,
     )
 
     return expectation_response
@@ -280,7 +425,8 @@ def expect_values_for_field_to_be_unique(
     expectation_input = locals()
 
     str_fields = ",".join(fields)
-    sql_query = f"SELECT {str_fields},COUNT(*) AS duplicates_count FROM {table_name} GROUP BY {str_fields} HAVING COUNT(*)>1;"
+    source = query_runner.grouping_source(table_name, fields)
+    sql_query = f"SELECT {str_fields},COUNT(*) AS duplicates_count FROM {source} GROUP BY {str_fields} HAVING COUNT(*)>1;"
 
     found_duplicity = query_runner.run_query(sql_query)
 
@@ -304,28 +450,97 @@ def expect_values_for_field_to_be_unique(
     return expectation_response
 
 
+def _invalid_shapes_query(
+    query_runner: QueryRunner,
+    table_name: str,
+    shape_field: str,
+    ref_fields: list,
+    rowid_range: tuple = None,
+) -> str:
+    """Query of the ref_fields and is_valid of the invalid shapes of a table,
+    or of its rows within a (first_rowid, last_rowid) range"""
+    str_ref_fields = ",".join(ref_fields)
+    where_rowid = ""
+    if rowid_range is not None:
+        where_rowid = (
+            f"WHERE {table_name}.rowid BETWEEN {rowid_range[0]} AND {rowid_range[1]}"
+        )
+    parsed_geometries = query_runner.parsed_geometries(table_name, shape_field)
+    if parsed_geometries is not None:
+        # the shapes were parsed once for the run (see parsed_geometries.py),
+        # a shape that failed to parse has a NULL geometry
+        str_refs = ",".join(f"{table_name}.{ref_field}" for ref_field in ref_fields)
+        return f"""
+            SELECT {str_ref_fields}, is_valid FROM (
+                SELECT {str_refs}, {query_runner.backend.is_valid_geometry("parsed.shape")} AS is_valid
+                FROM {query_runner.table_source(table_name)}
+                LEFT JOIN {parsed_geometries} AS parsed ON parsed.row_id = {table_name}.rowid
+                {where_rowid}
+                {query_runner.backend.unflattened_subquery_sql})
+            WHERE is_valid IN (0,-1);"""
+    # the subquery is not flattened (which would validate each shape again in
+    # the WHERE clause)
+    return f"""
+        SELECT {str_ref_fields}, is_valid FROM (
+            SELECT {str_ref_fields}, {query_runner.backend.is_valid(shape_field)} AS is_valid
+            FROM {query_runner.table_source(table_name)}
+            {where_rowid}
+            {query_runner.backend.unflattened_subquery_sql})
+        WHERE is_valid IN (0,-1);"""
+
+
 def expect_geoshapes_to_be_valid(
     query_runner: QueryRunner,
     table_name: str,
     shape_field: str,
     ref_fields: list,
     expectation_severity: str = "RaiseError",
+    validity_cache_path: str = None,
+    shards: int = None,
     **kwargs,
 ):
     """Receives a table name, a shape field and an shape ref field (or set of)
     checks that the shapes are valid. Returns True if all are valid. Returns
     False if shapes are invalid and in the details returns ref for the shapes
     that were invalid (is_valid=0) or if shape parsing failed unknown(is_valid=-1).
+    If a validity_cache_path (sqlite file) is given, the validity of each
+    shape is cached there by a digest of its WKT so later runs only parse and
+    validate new or changed shapes, cache hits are reported in the details.
+    With shards the table is split into that many rowid ranges, validated in
+    parallel, each in its own worker process (see sharding.py).
     """
     expectation_name = inspect.currentframe().f_code.co_name
     expectation_input = locals()
 
-    str_ref_fields = ",".join(ref_fields)
-    sql_query = f"""
-        SELECT {str_ref_fields}, ST_IsValid(ST_GeomFromText({shape_field})) AS is_valid 
-        FROM {table_name}
-        WHERE ST_IsValid(ST_GeomFromText({shape_field})) IN (0,-1);"""
-    invalid_shapes = query_runner.run_query(sql_query)
+    if validity_cache_path is None:
+        rowid_ranges = []
+        if shards is not None:
+            rowid_ranges = rowid_shards(query_runner, table_name, shards)
+        if len(rowid_ranges) > 1:
+            invalid_shapes = run_sharded_queries(
+                query_runner,
+                [
+                    _invalid_shapes_query(
+                        query_runner, table_name, shape_field, ref_fields, rowid_range
+                    )
+                    for rowid_range in rowid_ranges
+                ],
+            )
+        else:
+            invalid_shapes = query_runner.run_query(
+                _invalid_shapes_query(query_runner, table_name, shape_field, ref_fields)
+            )
+        validity_cache_stats = None
+    elif shards is not None:
+        raise ValueError("shards can't be combined with a validity_cache_path")
+    else:
+        invalid_shapes, validity_cache_stats = invalid_shapes_with_validity_cache(
+            query_runner,
+            query_runner.table_source(table_name),
+            shape_field,
+            ref_fields,
+            validity_cache_path,
+        )
 
     result = len(invalid_shapes) == 0
 
@@ -336,12 +551,222 @@ def expect_geoshapes_to_be_valid(
         msg = f"Fail: {len(invalid_shapes)} invalid shapes found in field '{shape_field}' on table '{table_name}', see details"
         details = {"invalid_shapes": invalid_shapes.to_dict(orient="records")}
 
+    if validity_cache_stats is not None:
+        details = {**(details or {}), "validity_cache": validity_cache_stats}
+
     expectation_response = ExpectationResponse(
         expectation_input=expectation_input,
         result=result,
         msg=msg,
         details=details,
         sqlite_dataset=query_runner.inform_dataset_path(),
+        sample=query_runner.sample_report(table_name, len(invalid_shapes)),
+    )
+
+    return expectation_response
+
+
+def _point_probes_rows(probes: list, probes_csv_path: str):
+    """Yields (position, WKT point, expected_value as text) for every probe,
+    read from the list or, one line at a time, from the csv file (columns
+    point and expected_value)"""
+    if probes is not None:
+        for position, probe in enumerate(probes):
+            yield position, probe["point"], str(probe["expected_value"])
+        return
+
+    with open(probes_csv_path, newline="") as f:
+        for position, probe in enumerate(csv.DictReader(f)):
+            yield position, probe["point"], probe["expected_value"]
+
+
+# a 2d WKT point, e.g. POINT(-0.0785 51.5124)
+WKT_POINT = re.compile(r"^\s*POINT\s*\(\s*(\S+)\s+(\S+)\s*\)\s*$", re.IGNORECASE)
+
+
+def _point_coordinates(point: str) -> tuple:
+    "(x, y) of a WKT point, (None, None) when it isn't one"
+    match = WKT_POINT.match(point or "")
+    if match is None:
+        return None, None
+    try:
+        return float(match.group(1)), float(match.group(2))
+    except ValueError:
+        return None, None
+
+
+def expect_points_to_be_within_expected_shapes(
+    query_runner: QueryRunner,
+    table_name: str,
+    shape_field: str,
+    ref_field: str,
+    probes: list = None,
+    expectation_severity: str = "RaiseError",
+    probes_csv_path: str = None,
+    only_expected_shapes: bool = False,
+    **kwargs,
+):
+    """Receives a table name, a shape field, the field identifying its rows
+    (e.g. entity) and probes, each a WKT point and the expected_value of
+    ref_field of the row whose shape holds it, e.g.
+        [{"point": "POINT(-0.0785 51.5124)", "expected_value": 303443}]
+    Returns True if every point is within the shape of its expected row
+    (with only_expected_shapes, and of no other row). The probes can be read
+    from a csv file instead (probes_csv_path, columns point and
+    expected_value), e.g. thousands of them.
+    The probes are loaded into a temporary table and looked up through an
+    R*Tree of the bounding boxes of the shapes, built once (see
+    QueryRunner.spatial_index): only the shapes whose box holds a point are
+    tested with ST_Within, instead of parsing every shape for every point.
+    When the shapes were parsed for the run (see parsed_geometries.py) their
+    geometries are tested rather than parsed again.
+    """
+    expectation_name = inspect.currentframe().f_code.co_name
+    expectation_input = locals()
+
+    if (probes is None) == (probes_csv_path is None):
+        raise ValueError("expected one of probes or probes_csv_path")
+
+    backend = query_runner.backend
+    parsed_geometries = query_runner.parsed_geometries(table_name, shape_field)
+    if parsed_geometries is None:
+        shape = backend.geometry_from_text(f"{table_name}.{shape_field}")
+        join_parsed = ""
+    else:
+        shape = "parsed.shape"
+        join_parsed = (
+            f"JOIN {parsed_geometries} AS parsed ON parsed.row_id = {table_name}.rowid"
+        )
+    point_within = backend.point_within(
+        backend.geometry_from_text("probes.point"), shape
+    )
+    # the coordinates of the points are read once, as they are loaded, for
+    # the lookups in the R*Tree
+    probes_rows = (
+        (position, point, expected_value, *_point_coordinates(point))
+        for position, point, expected_value in _point_probes_rows(
+            probes, probes_csv_path
+        )
+    )
+    with query_runner.temp_table(
+        "dq_point_probes",
+        {
+            "position": "INTEGER",
+            "point": "TEXT",
+            "expected_value": "TEXT",
+            "x": "REAL",
+            "y": "REAL",
+        },
+        probes_rows,
+    ), query_runner.spatial_index(table_name, shape_field) as spatial_index:
+        if spatial_index is None:
+            sql_query = f"""
+                SELECT probes.position, {table_name}.{ref_field} AS found_value
+                FROM dq_point_probes AS probes
+                JOIN {table_name} ON 1
+                {join_parsed}
+                WHERE {point_within};"""
+        else:
+            # the boxes holding each point (CROSS JOIN keeps sqlite looping
+            # over the probes first), then the exact test on their shapes
+            sql_query = f"""
+                SELECT probes.position, {table_name}.{ref_field} AS found_value
+                FROM dq_point_probes AS probes
+                CROSS JOIN {spatial_index} AS boxes
+                    ON boxes.min_x <= probes.x AND boxes.max_x >= probes.x
+                    AND boxes.min_y <= probes.y AND boxes.max_y >= probes.y
+                JOIN {table_name} ON {table_name}.rowid = boxes.id
+                {join_parsed}
+                WHERE {point_within};"""
+        found_values = {}
+        for batch in query_runner.iter_query(sql_query):
+            for position, found_value in batch:
+                found_values.setdefault(position, []).append(str(found_value))
+
+    failed_probes = []
+    for position, point, expected_value in _point_probes_rows(probes, probes_csv_path):
+        found = sorted(found_values.get(position, []))
+        if expected_value not in found or (
+            only_expected_shapes and found != [expected_value]
+        ):
+            failed_probes.append(
+                {
+                    "point": point,
+                    "expected_value": expected_value,
+                    "found_values": found,
+                }
+            )
+
+    result = len(failed_probes) == 0
+
+    if result:
+        msg = "Success: data quality as expected"
+        details = None
+    else:
+        msg = f"Fail: {len(failed_probes)} points not within the expected shapes of field '{shape_field}' on table '{table_name}', see details"
+        details = {"failed_probes": failed_probes}
+
+    expectation_response = ExpectationResponse(
+        expectation_input=expectation_input,
+        result=result,
+        msg=msg,
+        details=details,
+        sqlite_dataset=query_runner.inform_dataset_path(),
+    )
+
+    return expectation_response
+
+
+def expect_geoshapes_to_match_profile(
+    query_runner: QueryRunner,
+    table_name: str,
+    shape_field: str,
+    metric_ranges: dict,
+    ref_fields: list,
+    expectation_severity: str = "RaiseError",
+    max_failure_samples: int = 10,
+    **kwargs,
+):
+    """Receives a table name, a shape field (WKT) and the expected range (min
+    and/or max) of metrics of its shapes: area, min_x, max_x, min_y, max_y
+    (the bounding box), vertices and srid, e.g. to catch empty or huge
+    shapes, shapes outside England or misprojected ones. Every metric is
+    computed in a single pass over the table, each shape being parsed once
+    (see geometry_profile.py). Shapes that can't be parsed fail the "parse"
+    rule. The details hold the number of violations per metric and, per
+    metric, up to max_failure_samples violating rows (None keeps them all).
+    """
+    expectation_name = inspect.currentframe().f_code.co_name
+    expectation_input = locals()
+
+    failures_count, violations_per_rule, samples_per_rule = geometry_profile_violations(
+        query_runner,
+        table_name,
+        shape_field,
+        metric_ranges,
+        ref_fields,
+        max_failure_samples,
+    )
+
+    result = failures_count == 0
+    if result:
+        msg = "Success: data quality as expected"
+        details = None
+    else:
+        msg = f"Fail: found {failures_count} shapes out of the expected profile in field '{shape_field}' on table '{table_name}', see details"
+        details = {
+            "records_with_violations": failures_count,
+            "violations_per_metric": violations_per_rule,
+            "samples_per_metric": samples_per_rule,
+        }
+
+    expectation_response = ExpectationResponse(
+        expectation_input=expectation_input,
+        result=result,
+        msg=msg,
+        details=details,
+        sqlite_dataset=query_runner.inform_dataset_path(),
+        sample=query_runner.sample_report(table_name, failures_count),
     )
 
     return expectation_response
@@ -355,6 +780,9 @@ def expect_values_for_a_key_stored_in_json_are_within_a_set(
     expected_values_set: set,
     ref_fields: list,
     expectation_severity: str = "RaiseError",
+    max_failure_samples: int = None,
+    count_failures: bool = False,
+    count_only: bool = False,
     **kwargs,
 ):
     """Receives:
@@ -369,6 +797,8 @@ def expect_values_for_a_key_stored_in_json_are_within_a_set(
     If any is not met it returns False.
     One-sided: will not check if all expected values are found, only if all
     found values are within the expected
+    max_failure_samples, count_failures and count_only bound the rows kept in
+    the details (see _run_failures_query)
     """
     expectation_name = inspect.currentframe().f_code.co_name
     expectation_input = locals()
@@ -376,17 +806,36 @@ def expect_values_for_a_key_stored_in_json_are_within_a_set(
 
     str_ref_fields = ",".join(ref_fields)
     str_expected_values_set = "','".join(expected_values_set)
+    shredded_json = query_runner.shredded_json(table_name, field)
+    if shredded_json is None:
+        value_found_for_key = query_runner.backend.json_extract_text(field, json_key)
+        source = query_runner.table_source(table_name)
+    else:
+        # the value of the key looked up in the shredded field by rowid
+        value_found_for_key = "shredded.dq_value"
+        str_json_key = json_key.replace("'", "''")
+        source = f"""{query_runner.table_source(table_name)}
+            LEFT JOIN (
+                SELECT row_id AS dq_row_id, value AS dq_value FROM {shredded_json}
+                WHERE key = '{str_json_key}'
+            ) AS shredded ON shredded.dq_row_id = {table_name}.rowid"""
 
     sql_query = f"""
-        SELECT {str_ref_fields},json_extract({field}, '$.{json_key}') AS value_found_for_key 
-        FROM {table_name} 
+        SELECT {str_ref_fields},{value_found_for_key} AS value_found_for_key 
+        FROM {source} 
         WHERE 
-            (json_extract({field}, '$.{json_key}') NOT IN ('{str_expected_values_set}'))
-            OR (json_extract({field}, '$.{json_key}')) IS NULL;"""
-
-    non_expected_values = query_runner.run_query(sql_query)
+            ({value_found_for_key} NOT IN ('{str_expected_values_set}'))
+            OR ({value_found_for_key}) IS NULL;"""
+
+    non_expected_values, failures_count, details_truncated = _run_failures_query(
+        query_runner,
+        sql_query,
+        max_failure_samples,
+        count_failures or query_runner.sample is not None,
+        count_only,
+    )
 
-    result = len(non_expected_values) == 0
+    result = failures_count == 0 and not details_truncated
 
     if result:
         msg = "Success: data quality as expected"
@@ -394,6 +843,9 @@ def expect_values_for_a_key_stored_in_json_are_within_a_set(
     else:
         msg = f"Fail: found non-expected values for key '{json_key}' in field '{field}' on table '{table_name}', see details"
         details = {"non_expected_values": non_expected_values.to_dict(orient="records")}
+        if max_failure_samples is not None or count_only:
+            details["failures_count"] = failures_count
+            details["details_truncated"] = details_truncated
 
     expectation_response = ExpectationResponse(
         expectation_input=expectation_input,
@@ -401,6 +853,7 @@ def expect_values_for_a_key_stored_in_json_are_within_a_set(
         msg=msg,
         details=details,
         sqlite_dataset=query_runner.inform_dataset_path(),
+        sample=query_runner.sample_report(table_name, failures_count),
     )
 
     return expectation_response
@@ -413,6 +866,9 @@ def expect_keys_in_json_field_to_be_in_set_of_options(
     expected_keys_set: set,
     ref_fields: list,
     expectation_severity: str = "RaiseError",
+    max_failure_samples: int = None,
+    count_failures: bool = False,
+    count_only: bool = False,
     **kwargs,
 ):
     """Receives a table name, a field name (of a field that has a JSON text
@@ -420,27 +876,54 @@ def expect_keys_in_json_field_to_be_in_set_of_options(
     are within the expected set of expected keys.
     One sided: will not check if all expected keys are found, only if all
     found are within the expected
+    max_failure_samples, count_failures and count_only bound the rows kept in
+    the details (see _run_failures_query)
     """
     expectation_name = inspect.currentframe().f_code.co_name
     expectation_input = locals()
     expected_keys_set = set(expected_keys_set)
 
     str_ref_fields = ",".join(ref_fields)
-
-    prep_key_set = [f"'$.{s}'" for s in expected_keys_set]
-    str_expected_keys_set = ",".join(prep_key_set)
-
-    sql_query = (
-        f"""
-        SELECT {str_ref_fields},json_remove({field_name}, {str_expected_keys_set}) AS non_expected_keys 
-        FROM {table_name} 
-        WHERE non_expected_keys IS NOT NULL AND non_expected_keys <> '"""
-        + "{}'"
+    shredded_json = query_runner.shredded_json(table_name, field_name)
+    if shredded_json is None:
+        non_expected_keys = query_runner.backend.json_without_keys(
+            field_name, expected_keys_set
+        )
+        sql_query = f"""
+            SELECT {str_ref_fields},{non_expected_keys} AS non_expected_keys 
+            FROM {query_runner.table_source(table_name)} 
+            WHERE {query_runner.backend.json_has_keys_left("non_expected_keys")}"""
+    else:
+        # only the rows with keys that are not expected, whose object is
+        # rebuilt from those keys (as json_remove leaves it, except for
+        # \uXXXX escapes, written as the characters they stand for)
+        str_expected_keys = ",".join(
+            "'" + key.replace("'", "''") + "'" for key in expected_keys_set
+        )
+        sql_query = f"""
+            SELECT {str_ref_fields},shredded.non_expected_keys AS non_expected_keys
+            FROM {query_runner.table_source(table_name)}
+            JOIN (
+                SELECT row_id AS dq_row_id,
+                    json_group_object(key, {_SHREDDED_JSON_VALUE}) AS non_expected_keys
+                FROM (
+                    SELECT * FROM {shredded_json}
+                    WHERE key NOT IN ({str_expected_keys})
+                    ORDER BY rowid
+                )
+                GROUP BY row_id
+            ) AS shredded ON shredded.dq_row_id = {table_name}.rowid
+            ORDER BY {table_name}.rowid"""
+
+    non_expected_keys, failures_count, details_truncated = _run_failures_query(
+        query_runner,
+        sql_query,
+        max_failure_samples,
+        count_failures or query_runner.sample is not None,
+        count_only,
     )
 
-    non_expected_keys = query_runner.run_query(sql_query)
-
-    result = len(non_expected_keys) == 0
+    result = failures_count == 0 and not details_truncated
     if result:
         msg = "Success: data quality as expected"
         details = None
@@ -451,6 +934,66 @@ def expect_keys_in_json_field_to_be_in_set_of_options(
                 orient="records"
             )
         }
+        if max_failure_samples is not None or count_only:
+            details["failures_count"] = failures_count
+            details["details_truncated"] = details_truncated
+
+    expectation_response = ExpectationResponse(
+        expectation_input=expectation_input,
+        result=result,
+        msg=msg,
+        details=details,
+        sqlite_dataset=query_runner.inform_dataset_path(),
+        sample=query_runner.sample_report(table_name, failures_count),
+    )
+
+    return expectation_response
+
+
+def expect_json_field_to_match_schema(
+    query_runner: QueryRunner,
+    table_name: str,
+    field_name: str,
+    json_schema: dict,
+    ref_fields: list,
+    expectation_severity: str = "RaiseError",
+    max_failure_samples: int = 10,
+    **kwargs,
+):
+    """Receives a table name, a field name (of a field that has a JSON text
+    stored in it) and a JSON Schema style description of its objects:
+    required keys, per key the type, the allowed values (enum), the format
+    ("date", YYYY-MM-DD) or a column the value must be equal to
+    (equals_field), and additionalProperties: false to check the keys as
+    expect_keys_in_json_field_to_be_in_set_of_options does. The schema is
+    compiled once into sql rules, checked together in a single pass over
+    the table (see json_schema.py). The details hold the number of
+    violations per rule and, per rule, up to max_failure_samples violating
+    rows (None keeps them all).
+    """
+    expectation_name = inspect.currentframe().f_code.co_name
+    expectation_input = locals()
+
+    failures_count, violations_per_rule, samples_per_rule = json_schema_violations(
+        query_runner,
+        table_name,
+        field_name,
+        json_schema,
+        ref_fields,
+        max_failure_samples,
+    )
+
+    result = failures_count == 0
+    if result:
+        msg = "Success: data quality as expected"
+        details = None
+    else:
+        msg = f"Fail: found {failures_count} records whose json in the field '{field_name}' on table '{table_name}' doesn't match the schema, see details"
+        details = {
+            "records_with_violations": failures_count,
+            "violations_per_rule": violations_per_rule,
+            "samples_per_rule": samples_per_rule,
+        }
 
     expectation_response = ExpectationResponse(
         expectation_input=expectation_input,
@@ -458,6 +1001,7 @@ def expect_keys_in_json_field_to_be_in_set_of_options(
         msg=msg,
         details=details,
         sqlite_dataset=query_runner.inform_dataset_path(),
+        sample=query_runner.sample_report(table_name, failures_count),
     )
 
     return expectation_response
@@ -471,33 +1015,58 @@ def expect_values_in_field_to_be_within_range(
     max_expected_value: int,
     ref_fields: list,
     expectation_severity: str = "RaiseError",
+    max_failure_samples: int = None,
+    count_failures: bool = False,
+    count_only: bool = False,
     **kwargs,
 ):
     """Receives a table name, a field name checks the values found in the field
     are within the expected range
+    max_failure_samples, count_failures and count_only bound the rows kept in
+    the details (see _run_failures_query)
     """
     expectation_name = inspect.currentframe().f_code.co_name
     expectation_input = locals()
 
     str_ref_fields = ",".join(ref_fields)
 
+    out_of_range = query_runner.backend.range_violation(
+        field_name, min_expected_value, max_expected_value
+    )
     sql_query = f"""SELECT {str_ref_fields},{field_name} 
-                    FROM {table_name} 
-                    WHERE {field_name} < {min_expected_value} OR {field_name} > {max_expected_value}"""
-
-    records_with_value_out_of_range = query_runner.run_query(sql_query)
+                    FROM {query_runner.table_source(table_name)} 
+                    WHERE {out_of_range}"""
+
+    (
+        records_with_value_out_of_range,
+        failures_count,
+        details_truncated,
+    ) = _run_failures_query(
+        query_runner,
+        sql_query,
+        max_failure_samples,
+        count_failures or query_runner.sample is not None,
+        count_only,
+    )
 
-    result = len(records_with_value_out_of_range) == 0
+    result = failures_count == 0 and not details_truncated
     if result:
         msg = "Success: data quality as expected"
         details = None
     else:
-        msg = f"Fail: found {len(records_with_value_out_of_range)} values out of the expected range for field '{field_name}' on table '{table_name}', see details"
+        if failures_count is None:
+            failures_found = f"more than {max_failure_samples}"
+        else:
+            failures_found = failures_count
+        msg = f"Fail: found {failures_found} values out of the expected range for field '{field_name}' on table '{table_name}', see details"
         details = {
             "records_with_value_out_of_range": records_with_value_out_of_range.to_dict(
                 orient="records"
             )
         }
+        if max_failure_samples is not None or count_only:
+            details["failures_count"] = failures_count
+            details["details_truncated"] = details_truncated
 
     expectation_response = ExpectationResponse(
         expectation_input=expectation_input,
@@ -505,6 +1074,7 @@ def expect_values_in_field_to_be_within_range(
         msg=msg,
         details=details,
         sqlite_dataset=query_runner.inform_dataset_path(),
+        sample=query_runner.sample_report(table_name, failures_count),
     )
 
     return expectation_response
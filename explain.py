@@ -0,0 +1,335 @@
+import json
+import math
+import os
+import re
+from contextlib import contextmanager
+import pandas as pd
+from core import QueryRunner
+from planner import FusedScan, compile_fused_scan, plan_suite, run_expectation
+
+# Rough cost model of a query plan, in "row reads": reading a row of a table
+# costs 1, parsing a WKT shape or a JSON text of a row costs the factors
+# below. Calibrated on a synthetic dataset (benchmarks/generate_dataset.py)
+# where a row read takes about ROW_READ_SECONDS.
+ROW_READ_SECONDS = 5e-7
+GEOMETRY_PARSING_FACTOR = 150
+JSON_PARSING_FACTOR = 10
+# share of the rows a range constraint (rowid>?) is assumed to select, as
+# sqlite's planner assumes without statistics
+RANGE_SELECTIVITY = 0.25
+
+GEOMETRY_PARSING = re.compile(r"\b(ST_\w+|GeomFrom\w+)\s*\(", re.IGNORECASE)
+JSON_PARSING = re.compile(r"\bjson_\w+\s*\(", re.IGNORECASE)
+TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+([\w.]+)\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+PLAN_LOOP = re.compile(
+    r"^(SCAN|SEARCH) (?:TABLE )?(\S+)(?: USING (COVERING )?INDEX (\S+))?(?: \((.*)\))?"
+)
+SUBQUERY = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\S+)")
+TEMP_B_TREE = re.compile(r"^USE TEMP B-TREE FOR (.*)")
+
+
+class TableStatistics:
+    """Row counts of the tables of a dataset and average rows per key of its
+    indexes, from sqlite_stat1 (written by ANALYZE) when the dataset has it,
+    otherwise tables are counted (once each)"""
+
+    def __init__(self, query_runner: QueryRunner):
+        self.query_runner = query_runner
+        self.tables = QueryRunner.run_query(
+            query_runner,
+            "SELECT name FROM sqlite_master WHERE type='table';",
+            return_only_first_col_as_set=True,
+        ) | {"sqlite_master"}
+        self.table_rows = {}
+        self.rows_per_key = {}
+        if "sqlite_stat1" in self.tables:
+            stat1 = QueryRunner.run_query(
+                query_runner, "SELECT tbl, idx, stat FROM sqlite_stat1;"
+            )
+            for table_name, index_name, stat in stat1.itertuples(index=False):
+                numbers = [int(number) for number in stat.split()[:2]]
+                self.table_rows[table_name] = numbers[0]
+                if index_name is not None and len(numbers) > 1:
+                    self.rows_per_key[index_name] = numbers[1]
+
+    def rows(self, table_name: str) -> int:
+        "Rows of a table, None for names that are not tables (e.g. subqueries)"
+        if table_name not in self.tables:
+            return None
+        if table_name not in self.table_rows:
+            self.table_rows[table_name] = int(
+                QueryRunner.run_query(
+                    self.query_runner, f"SELECT COUNT(*) AS n FROM {table_name};"
+                )["n"][0]
+            )
+        return self.table_rows[table_name]
+
+
+def estimate_plan_cost(statistics: TableStatistics, sql_query: str, plan: list):
+    """Estimates the cost (in row reads, see ROW_READ_SECONDS) of a query
+    from its EXPLAIN QUERY PLAN rows (id, parent, notused, detail) and flags
+    what makes it expensive: full table scans, temporary b-trees (GROUP BY,
+    ORDER BY, DISTINCT) and shapes or JSON parsed for every scanned row.
+    Loops under the same parent are nested, so each loop runs once per row
+    of the loops before it. Subqueries and common table expressions whose
+    size is unknown (e.g. the rowid strides of a sample) count as one row.
+    Returns (cost, flags)."""
+    aliases = {
+        alias.lower(): table_name.split(".")[-1]
+        for table_name, alias in TABLE_ALIAS.findall(sql_query)
+    }
+    # cost of a scanned row, reading it and parsing its shapes or JSON
+    parsing_factor = 1
+    parsing_flags = []
+    if GEOMETRY_PARSING.search(sql_query):
+        parsing_factor += GEOMETRY_PARSING_FACTOR
+        parsing_flags.append("geometry parsed for every scanned row")
+    if JSON_PARSING.search(sql_query):
+        parsing_factor += JSON_PARSING_FACTOR
+        parsing_flags.append("JSON parsed for every scanned row")
+
+    cost = 0
+    flags = []
+    # rows produced so far by the loops under each parent
+    loop_rows = {}
+    subquery_ids = {}
+    for plan_id, parent, _, detail in plan:
+        outer_rows = loop_rows.get(parent, 1)
+        subquery = SUBQUERY.match(detail)
+        if subquery:
+            subquery_ids[subquery.group(1)] = plan_id
+            continue
+
+        temp_b_tree = TEMP_B_TREE.match(detail)
+        if temp_b_tree:
+            cost += outer_rows * math.log2(outer_rows + 1)
+            flags.append(
+                f"temporary b-tree for {temp_b_tree.group(1)} of ~{outer_rows:.0f} rows"
+            )
+            continue
+
+        loop = PLAN_LOOP.match(detail)
+        if not loop:
+            continue
+        operation, name, covering, index_name, constraint = loop.groups()
+        table_name = aliases.get(name.lower(), name)
+        table_rows = statistics.rows(table_name)
+        if table_rows is None:
+            # a subquery or a common table expression
+            table_rows = loop_rows.get(subquery_ids.get(name), 1)
+
+        if operation == "SCAN":
+            rows = table_rows
+            # shapes and JSON are parsed in the scans of the tables, not
+            # again when reading the rows of a subquery
+            parsed = not covering and statistics.rows(table_name) is not None
+            cost += outer_rows * rows * (parsing_factor if parsed else 1)
+            if statistics.rows(table_name) is not None:
+                kind = "full index scan" if covering else "full scan"
+                nested = (
+                    f" for each of ~{outer_rows:.0f} rows" if outer_rows > 1 else ""
+                )
+                flags.append(f"{kind} of {table_name} (~{rows} rows){nested}")
+                if not covering and rows > 1:
+                    flags.extend(parsing_flags)
+        else:
+            if constraint is not None and re.search(r"[<>]", constraint):
+                rows = table_rows * RANGE_SELECTIVITY
+            elif index_name is not None:
+                rows = statistics.rows_per_key.get(index_name, 1)
+            else:
+                # by rowid
+                rows = 1
+            cost += outer_rows * (math.log2(table_rows + 1) + rows * parsing_factor)
+        loop_rows[parent] = outer_rows * rows
+
+    # the same flag once, in order of appearance
+    return cost, list(dict.fromkeys(flags))
+
+
+class ExplainQueryRunner(QueryRunner):
+    """QueryRunner of a dry run: the queries of the expectations are not run
+    but planned (EXPLAIN QUERY PLAN) and costed, see explained. They get an
+    empty result back so an expectation stops (or ends with a meaningless
+    response) after its main query. Only the small queries the runner needs
+    for itself (sampling strides, table statistics) are run. Needs sqlite
+    (the spatialite backend).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.backend.name != "spatialite":
+            raise ValueError(
+                f"explain needs the spatialite backend, got '{self.backend.name}'"
+            )
+        self._run_for_real = False
+        self.statistics = TableStatistics(self)
+        self.explained = []
+
+    # a runner rebuilt from its settings would run the queries
+    runs_in_worker_processes = False
+
+    def _sample_stride(self, table_name: str) -> dict:
+        # the stride queries are cheap, they are run for real
+        self._run_for_real = True
+        try:
+            return super()._sample_stride(table_name)
+        finally:
+            self._run_for_real = False
+
+    def rowid_range(self, table_name: str) -> tuple:
+        # cheap as well, the shards of a table are then explained
+        self._run_for_real = True
+        try:
+            return super().rowid_range(table_name)
+        finally:
+            self._run_for_real = False
+
+    def explain_query(self, sql_query: str) -> dict:
+        "Plans a query, returns its plan, flags and estimated cost"
+        try:
+            plan = QueryRunner.run_query(self, "EXPLAIN QUERY PLAN " + sql_query)
+        except self.backend.error_types as error:
+            return {"sql": sql_query, "error": str(error), "cost": 0, "flags": []}
+        plan_rows = list(plan.itertuples(index=False, name=None))
+        cost, flags = estimate_plan_cost(self.statistics, sql_query, plan_rows)
+        return {
+            "sql": sql_query,
+            "plan": [detail for _, _, _, detail in plan_rows],
+            "cost": cost,
+            "flags": flags,
+        }
+
+    def run_query(self, sql_query: str, return_only_first_col_as_set: bool = False):
+        if self._run_for_real:
+            return super().run_query(sql_query, return_only_first_col_as_set)
+        self.explained.append(self.explain_query(sql_query))
+        return set() if return_only_first_col_as_set else pd.DataFrame()
+
+    def iter_query(
+        self, sql_query: str, batch_size: int = 10000, as_dataframe: bool = False
+    ):
+        self.explained.append(self.explain_query(sql_query))
+        return iter(())
+
+    @contextmanager
+    def spatial_index(self, table_name: str, shape_field: str):
+        # the temporary R*Tree is created empty, so the lookups through it can
+        # be planned, and the query filling it is planned with them
+        if self.scratch is not None and self.scratch["tables"].get(
+            self.scratch_key(table_name, [shape_field], "rtree")
+        ):
+            with super().spatial_index(table_name, shape_field) as index_name:
+                yield index_name
+            return
+
+        create_index, *fill_index = self.backend.spatial_index_statements(
+            "temp.dq_spatial_index",
+            table_name,
+            shape_field,
+            self.parsed_geometries(table_name, shape_field),
+        )
+        con = self.get_connection()
+        con.execute(create_index)
+        try:
+            for statement in fill_index:
+                self.explained.append(self.explain_query(statement))
+            yield "temp.dq_spatial_index"
+        finally:
+            con.execute("DROP TABLE IF EXISTS temp.dq_spatial_index;")
+
+
+def explain_suite(
+    query_runner: ExplainQueryRunner, expectations: list, fuse_scans: bool = False
+) -> list:
+    """Dry run of a suite: the queries of every expectation (or of every
+    fused scan with fuse_scans) are planned, not run. Returns one entry per
+    step with its queries, flags, estimated cost and seconds, the most
+    expensive first. Estimates are rough (see estimate_plan_cost) and for
+    the sql engine; failing members of a fused scan are re-run on their own,
+    which is not counted. An expectation that stops before its end (e.g. it
+    can't go on with the empty results of its planned queries, or it is
+    misconfigured) has its error in its entry, its queries up to there are
+    explained."""
+    if fuse_scans:
+        steps = plan_suite(expectations, fuse_scans=True)
+    else:
+        steps = list(enumerate(expectations))
+
+    report = []
+    for step in steps:
+        query_runner.explained = []
+        error = None
+        if isinstance(step, FusedScan):
+            members = step.members
+            sql_query, _ = compile_fused_scan(step, query_runner.backend)
+            query_runner.run_query(sql_query)
+        else:
+            members = [step]
+            try:
+                run_expectation(query_runner=query_runner, **step[1])
+            except Exception as exception:
+                error = f"{type(exception).__name__}: {exception}"
+
+        cost = sum(query["cost"] for query in query_runner.explained)
+        report.append(
+            {
+                "positions": [position for position, _ in members],
+                "expectation_names": [
+                    expectation["expectation_name"] for _, expectation in members
+                ],
+                "table_name": members[0][1].get("table_name"),
+                "estimated_cost": cost,
+                "estimated_seconds": cost * ROW_READ_SECONDS,
+                "flags": list(
+                    dict.fromkeys(
+                        flag
+                        for query in query_runner.explained
+                        for flag in query["flags"]
+                    )
+                ),
+                "queries": query_runner.explained,
+                "error": error,
+            }
+        )
+
+    return sorted(report, key=lambda entry: entry["estimated_cost"], reverse=True)
+
+
+def _duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def format_explain_report(collection_name: str, report: list) -> str:
+    "Ranked text summary of an explain_suite report"
+    total_seconds = sum(entry["estimated_seconds"] for entry in report)
+    lines = [f"{collection_name}: estimated {_duration(total_seconds)} (rough)"]
+    for rank, entry in enumerate(report, start=1):
+        str_positions = ",".join(str(position) for position in entry["positions"])
+        str_names = ", ".join(dict.fromkeys(entry["expectation_names"]))
+        lines.append(
+            f"{rank:>4}. {_duration(entry['estimated_seconds']):>8}  [{str_positions}] {str_names}"
+            + (f" on {entry['table_name']}" if entry["table_name"] else "")
+        )
+        if entry["error"] is not None:
+            lines.append(f"{'':>16}- stopped before its end: {entry['error']}")
+        for flag in entry["flags"]:
+            lines.append(f"{'':>16}- {flag}")
+        for query in entry["queries"]:
+            if "error" in query:
+                lines.append(f"{'':>16}- could not plan a query: {query['error']}")
+    return "\n".join(lines)
+
+
+def save_explain_report(results_path: str, data_quality_execution_time: str, report):
+    "Saves the report as <results_path>/<data_quality_execution_time>_explain.json"
+    file_path = os.path.join(
+        results_path, f"{data_quality_execution_time}_explain.json"
+    )
+    with open(file_path, "w") as f:
+        json.dump(report, f, indent=2)
+    return file_path
@@ -0,0 +1,105 @@
+from core import QueryRunner
+import rule_violations
+
+# name of the rule of the rows whose shape can't be parsed
+PARSE_RULE = "parse"
+
+RANGE_BOUNDS = ("min", "max")
+
+
+def compile_metric_ranges(backend, metric_ranges: dict, geometry: str) -> list:
+    """The rules of the metrics of a profile, e.g.
+        {"area": {"min": 1e-10}, "vertices": {"max": 10000}}
+    each metric (see Backend.geometry_metric) with a min and/or a max, as
+    {"rule": metric, "value": its expression over geometry, "violation": a
+    predicate over the value true when it is out of range}"""
+    rules = []
+    for metric, metric_range in metric_ranges.items():
+        unknown_bounds = set(metric_range) - set(RANGE_BOUNDS)
+        if unknown_bounds or not metric_range:
+            raise ValueError(
+                f"the range of the metric '{metric}' must have a min and/or a max, got {metric_range}"
+            )
+        value = f"dq_value_{len(rules)}"
+        violations = []
+        if "min" in metric_range:
+            violations.append(f"{value} < {float(metric_range['min'])}")
+        if "max" in metric_range:
+            violations.append(f"{value} > {float(metric_range['max'])}")
+        rules.append(
+            {
+                "rule": metric,
+                "value": value,
+                "expression": backend.geometry_metric(metric, geometry),
+                "violation": " OR ".join(violations),
+            }
+        )
+    return rules
+
+
+def geometry_profile_violations(
+    query_runner: QueryRunner,
+    table_name: str,
+    shape_field: str,
+    metric_ranges: dict,
+    ref_fields: list,
+    max_failure_samples: int = None,
+    batch_size: int = 10000,
+):
+    """Profiles the WKT shapes of a field in a single pass over the table:
+    each shape is parsed once (or read from the geometries parsed for the
+    run, see parsed_geometries.py), every metric of metric_ranges (see
+    compile_metric_ranges) is computed once from it and only the rows out
+    of a range are streamed. Rows whose field is NULL are not checked, rows
+    whose shape can't be parsed violate the "parse" rule only. Returns what
+    rule_violations.collect_rule_violations does.
+    """
+    backend = query_runner.backend
+    metric_rules = compile_metric_ranges(backend, metric_ranges, "dq_shape")
+
+    parsed_geometries = query_runner.parsed_geometries(table_name, shape_field)
+    if parsed_geometries is None:
+        shape = backend.geometry_from_text(f"{table_name}.{shape_field}")
+        join_parsed = ""
+    else:
+        shape = "parsed.shape"
+        join_parsed = f"LEFT JOIN {parsed_geometries} AS parsed ON parsed.row_id = {table_name}.rowid"
+
+    read_columns = [
+        f"{table_name}.{ref_field} AS dq_ref_{position}"
+        for position, ref_field in enumerate(ref_fields)
+    ]
+    ref_columns = [f"dq_ref_{position}" for position in range(len(ref_fields))]
+    values = [f"{rule['expression']} AS {rule['value']}" for rule in metric_rules]
+    rules = [
+        {
+            "rule": PARSE_RULE,
+            "violation": "dq_has_shape AND dq_shape IS NULL",
+            "sample_column": None,
+        }
+    ] + [
+        {
+            "rule": rule["rule"],
+            "violation": f"dq_shape IS NOT NULL AND ({rule['violation']})",
+            "sample_column": rule["value"],
+        }
+        for rule in metric_rules
+    ]
+    # the metrics are not flattened either, so each shape is parsed once and
+    # each metric computed once, however many bounds read it
+    rows_query = f"""
+        SELECT {",".join(ref_columns + ["dq_has_shape", "dq_shape"] + values)}
+        FROM (
+            SELECT {",".join(read_columns)},
+                {table_name}.{shape_field} IS NOT NULL AS dq_has_shape,
+                {shape} AS dq_shape
+            FROM {query_runner.table_source(table_name)}
+            {join_parsed}
+            {backend.unflattened_subquery_sql})"""
+    sql_query = rule_violations.rule_violations_query(
+        backend, ref_columns, rules, rows_query
+    )
+
+    return rule_violations.collect_rule_violations(
+        query_runner, sql_query, ref_fields, rules, max_failure_samples, batch_size
+    )
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import re
+from core import QueryRunner, ExpectationResponse
+from planner import expectation_input_for
+from serializer import encode_json_value
+
+STATE_FILE_NAME = "dq_incremental_state.json"
+
+# pseudo table standing for the schema of the database
+SCHEMA_TABLE = "sqlite_master"
+
+# number of rows, spread across the rowid range, hashed into the digest
+DIGEST_SAMPLE_SIZE = 256
+
+# arguments of the expectations naming input files (not caches) they read
+INPUT_FILE_ARGUMENTS = ("count_ranges_csv_path", "probes_csv_path")
+
+
+def _digest(rows) -> str:
+    return hashlib.md5(repr(rows).encode("utf-8")).hexdigest()
+
+
+def with_input_file_digests(expectation: dict) -> dict:
+    """The config of an expectation plus the digest of the content of the
+    input files it names (so editing the file invalidates its response)"""
+    expectation = dict(expectation)
+    for argument in INPUT_FILE_ARGUMENTS:
+        if expectation.get(argument) is not None:
+            with open(expectation[argument], "rb") as f:
+                expectation[f"{argument}_digest"] = hashlib.md5(f.read()).hexdigest()
+    return expectation
+
+
+def expectation_config_hash(expectation: dict) -> str:
+    "Hash of the configuration of an expectation as written in the suite"
+    return hashlib.md5(
+        json.dumps(expectation, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def table_fingerprint(query_runner: QueryRunner, table_name: str) -> dict:
+    """Cheap fingerprint of a table: its schema, row count, rowid range and a
+    digest of DIGEST_SAMPLE_SIZE rows picked across the rowid range plus the
+    last rows. It catches appends, deletes, schema changes and most updates
+    without reading the whole table (an update to a row outside the sample
+    that keeps the row count is not detected, use --force for those).
+    """
+    if table_name == SCHEMA_TABLE:
+        schema = query_runner.run_query(
+            "SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY type, name;"
+        )
+        return {"schema_digest": _digest(schema.values.tolist())}
+
+    table_sql = query_runner.run_query(
+        f"SELECT sql FROM sqlite_master WHERE name = '{table_name}';"
+    )
+    row_count = query_runner.run_query(f"SELECT COUNT(*) AS n FROM {table_name};")
+    rowid_range = query_runner.run_query(
+        f"""SELECT (SELECT MIN(rowid) FROM {table_name}) AS min_rowid,
+                   (SELECT MAX(rowid) FROM {table_name}) AS max_rowid;"""
+    )
+    min_rowid = rowid_range["min_rowid"][0]
+    max_rowid = rowid_range["max_rowid"][0]
+
+    sampled_rows = []
+    if max_rowid is not None and max_rowid == max_rowid:
+        min_rowid, max_rowid = int(min_rowid), int(max_rowid)
+        step = max((max_rowid - min_rowid) // DIGEST_SAMPLE_SIZE, 1)
+        sampled_rowids = ",".join(
+            str(rowid) for rowid in range(min_rowid, max_rowid + 1, step)
+        )
+        sampled_rows = query_runner.run_query(
+            f"""SELECT * FROM {table_name} WHERE rowid IN ({sampled_rowids})
+                UNION ALL
+                SELECT * FROM (
+                    SELECT * FROM {table_name} ORDER BY rowid DESC LIMIT {DIGEST_SAMPLE_SIZE}
+                );"""
+        ).values.tolist()
+        max_rowid = int(max_rowid)
+
+    return {
+        "schema_digest": _digest(table_sql.values.tolist()),
+        "row_count": int(row_count["n"][0]),
+        "max_rowid": max_rowid,
+        "content_digest": _digest(sampled_rows),
+    }
+
+
+def referenced_tables(query_runner: QueryRunner, expectation: dict) -> list:
+    """Tables an expectation reads. Expectations with a table_name read that
+    table, expectations on the database structure read the schema, and
+    custom queries read every table named in the query."""
+    if "table_name" in expectation:
+        return [expectation["table_name"]]
+
+    if expectation["expectation_name"] == "expect_database_to_have_set_of_tables":
+        return [SCHEMA_TABLE]
+
+    all_tables = query_runner.run_query(
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name;",
+        return_only_first_col_as_set=True,
+    )
+    custom_query = expectation.get("custom_query")
+    if custom_query is None:
+        return [SCHEMA_TABLE] + sorted(all_tables)
+
+    return [SCHEMA_TABLE] + [
+        table
+        for table in sorted(all_tables)
+        if re.search(rf"\b{re.escape(table)}\b", custom_query, flags=re.IGNORECASE)
+    ]
+
+
+class IncrementalState:
+    """Previous responses of a dataset, kept in a json file next to the
+    results, with the fingerprints of the tables each expectation read.
+
+    cached_response() returns a response marked as cached when the config of
+    the expectation and the fingerprints of its tables did not change since
+    it was recorded, and record() stores the responses of the current run.
+    With force=True nothing is reused but the state is still refreshed.
+    """
+
+    def __init__(self, results_path: str, force: bool = False):
+        self.state_path = os.path.join(results_path, STATE_FILE_NAME)
+        self.force = force
+        self._fingerprints = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        else:
+            self.state = {}
+
+    def save(self):
+        with open(self.state_path, "w") as f:
+            json.dump(self.state, f)
+
+    def _dataset_state(self, query_runner: QueryRunner) -> dict:
+        dataset = os.path.abspath(query_runner.inform_dataset_path())
+        return self.state.setdefault(dataset, {})
+
+    def _response_key(self, query_runner: QueryRunner, expectation: dict) -> str:
+        "Key of a response: the expectation config, and the sample if any"
+        expectation = with_input_file_digests(expectation)
+        if query_runner.sample is None:
+            return expectation_config_hash(expectation)
+        # sampled responses never stand in for exact ones (nor the reverse)
+        return expectation_config_hash(
+            {"expectation": expectation, "sample": query_runner.sample}
+        )
+
+    def _fingerprints_for(self, query_runner: QueryRunner, expectation: dict):
+        "Current fingerprints of the tables read by an expectation"
+        fingerprints = {}
+        for table_name in referenced_tables(query_runner, expectation):
+            key = (query_runner.inform_dataset_path(), table_name)
+            if key not in self._fingerprints:
+                self._fingerprints[key] = table_fingerprint(query_runner, table_name)
+            fingerprints[table_name] = self._fingerprints[key]
+        return fingerprints
+
+    def cached_response(
+        self, query_runner: QueryRunner, expectation: dict, **kwargs
+    ) -> ExpectationResponse:
+        "Returns the previous response if still valid, None otherwise"
+        if self.force:
+            return None
+
+        previous = self._dataset_state(query_runner).get(
+            self._response_key(query_runner, expectation)
+        )
+        if previous is None:
+            return None
+
+        try:
+            fingerprints = self._fingerprints_for(query_runner, expectation)
+        except query_runner.backend.error_types:
+            # tables that can't be fingerprinted (missing, without rowid, not
+            # in a sqlite file...) are never considered unchanged
+            return None
+        if fingerprints != previous["tables"]:
+            return None
+
+        response = previous["response"]
+        return ExpectationResponse(
+            expectation_input=expectation_input_for(
+                query_runner, **expectation, **kwargs
+            ),
+            result=response["result"],
+            msg=response["msg"],
+            details=response["details"],
+            sqlite_dataset=response["sqlite_dataset"],
+            sample=response.get("sample"),
+            cached=True,
+            cached_from=response["data_quality_execution_time"],
+        )
+
+    def record(
+        self,
+        query_runner: QueryRunner,
+        expectation: dict,
+        response: ExpectationResponse,
+    ):
+        "Stores the response of an expectation with its tables' fingerprints"
+        try:
+            fingerprints = self._fingerprints_for(query_runner, expectation)
+        except query_runner.backend.error_types:
+            return
+
+        self._dataset_state(query_runner)[
+            self._response_key(query_runner, expectation)
+        ] = {
+            "tables": fingerprints,
+            "response": {
+                "result": None if response.result is None else bool(response.result),
+                "msg": response.msg,
+                "details": json.loads(encode_json_value(response.details)),
+                "sqlite_dataset": response.sqlite_dataset,
+                "sample": response.sample,
+                # a reused response keeps the time of the run that evaluated it
+                "data_quality_execution_time": response.cached_from
+                or response.data_quality_execution_time,
+            },
+        }
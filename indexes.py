@@ -0,0 +1,208 @@
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import spatialite
+from core import QueryRunner
+from backends import sqlite_uri
+
+# Expectations running a GROUP BY over some columns of their table, mapped to
+# a function returning those columns
+GROUPING_EXPECTATIONS = {
+    "expect_values_for_field_to_be_unique": lambda expectation: expectation["fields"],
+    "expect_row_count_for_lookup_value_to_be_in_range": lambda expectation: [
+        expectation["field_name"]
+    ],
+}
+
+# Expectations looking shapes up by their bounding box, mapped to the argument
+# naming the shape field
+SPATIAL_EXPECTATIONS = {
+    "expect_points_to_be_within_expected_shapes": "shape_field",
+}
+
+SCRATCH_DATABASE_NAME = "dq_scratch.sqlite3"
+
+
+def grouping_key(expectation: dict):
+    """(table_name, sorted columns) an expectation groups by, or None. The
+    order of the columns doesn't matter: sqlite reorders the terms of a GROUP
+    BY to follow an index."""
+    columns = GROUPING_EXPECTATIONS.get(expectation.get("expectation_name"))
+    if columns is None or "table_name" not in expectation:
+        return None
+    return expectation["table_name"], tuple(sorted(columns(expectation)))
+
+
+def has_covering_index(query_runner: QueryRunner, table_name: str, columns) -> bool:
+    """Checks if the table has an index (or an INTEGER PRIMARY KEY, for a
+    single column) whose first columns are the grouped columns, which sqlite
+    walks in order instead of sorting the table into a temporary b-tree"""
+    table_info = query_runner.run_query(f"PRAGMA table_info('{table_name}');")
+    primary_keys = table_info.loc[table_info["pk"] > 0]
+    if (
+        len(columns) == 1
+        and len(primary_keys) == 1
+        and primary_keys["name"].iloc[0] == columns[0]
+        and primary_keys["type"].iloc[0].upper() == "INTEGER"
+    ):
+        return True
+
+    index_list = query_runner.run_query(f"PRAGMA index_list('{table_name}');")
+    for index_name, partial in zip(index_list["name"], index_list["partial"]):
+        if partial:
+            continue
+        index_columns = query_runner.run_query(f"PRAGMA index_info('{index_name}');")
+        if set(index_columns["name"][: len(columns)]) == set(columns):
+            return True
+    return False
+
+
+def grouping_index_builds(
+    query_runner: QueryRunner, steps: list, min_expectations: int = 2
+) -> list:
+    """Scratch tables (see provision_scratch_tables) indexing the columns
+    that at least min_expectations of the expectations of steps (the
+    (position, expectation) steps of a plan) group by, for every (table,
+    columns) without a covering index in the dataset"""
+    positions_by_key = {}
+    for step in steps:
+        if not isinstance(step, tuple):
+            continue
+        position, expectation = step
+        key = grouping_key(expectation)
+        if key is not None:
+            positions_by_key.setdefault(key, []).append(position)
+
+    builds = []
+    for (table_name, columns), positions in positions_by_key.items():
+        if len(positions) < min_expectations:
+            continue
+        table_columns = set(
+            query_runner.run_query(f"PRAGMA table_info('{table_name}');")["name"]
+        )
+        # fields that are sql expressions can't be indexed here
+        if not set(columns) <= table_columns:
+            continue
+        if has_covering_index(query_runner, table_name, columns):
+            continue
+        str_columns = ",".join(f'"{column}"' for column in columns)
+        builds.append(
+            {
+                "key": QueryRunner.scratch_key(table_name, columns),
+                "stage": "index_build",
+                "prefix": "grouping",
+                "statements": [
+                    f"CREATE TABLE {{scratch_table}} AS SELECT {str_columns} FROM source.{table_name};",
+                    f"CREATE INDEX {{scratch_table}}_index ON {{scratch_table}} ({str_columns});",
+                ],
+                "members": len(positions),
+            }
+        )
+    return builds
+
+
+def spatial_index_builds(
+    query_runner: QueryRunner,
+    steps: list,
+    min_expectations: int = 2,
+    parsed_geometry_keys=(),
+) -> list:
+    """Scratch tables (see provision_scratch_tables) holding the R*Tree of
+    the shapes of every (table, shape field) that at least min_expectations
+    of the expectations of steps look shapes up in, so the shapes are parsed
+    and indexed once per run (a single expectation builds its own, see
+    QueryRunner.spatial_index). The boxes of the shapes whose scratch key is
+    in parsed_geometry_keys are read from their parsed geometries (see
+    parsed_geometries.py), built first."""
+    positions_by_key = {}
+    for step in steps:
+        if not isinstance(step, tuple):
+            continue
+        position, expectation = step
+        argument = SPATIAL_EXPECTATIONS.get(expectation.get("expectation_name"))
+        if argument is None or "table_name" not in expectation:
+            continue
+        key = (expectation["table_name"], expectation[argument])
+        positions_by_key.setdefault(key, []).append(position)
+
+    builds = []
+    for (table_name, shape_field), positions in positions_by_key.items():
+        if len(positions) < min_expectations:
+            continue
+        parsed_key = QueryRunner.scratch_key(table_name, [shape_field], "geometry")
+        uses = {}
+        if parsed_key in parsed_geometry_keys:
+            uses["parsed_geometries"] = parsed_key
+        builds.append(
+            {
+                "key": QueryRunner.scratch_key(table_name, [shape_field], "rtree"),
+                "stage": "index_build",
+                "prefix": "rtree",
+                "statements": query_runner.backend.spatial_index_statements(
+                    "{scratch_table}",
+                    f"source.{table_name}",
+                    shape_field,
+                    "{parsed_geometries}" if uses else None,
+                ),
+                "members": len(positions),
+                "uses": uses,
+            }
+        )
+    return builds
+
+
+def provision_scratch_tables(query_runner: QueryRunner, builds: list) -> dict:
+    """Builds scratch tables in a scratch database and makes query_runner
+    read them. Each build has the scratch key the runner looks the table up
+    by, the stage it is timed as in the metrics of the expectations reading
+    it, a prefix for its name, the statements creating it (formatted with
+    scratch_table, reading the dataset attached as "source") and the number
+    of expectations reading it. A build may read the tables of the builds
+    before it: its "uses" map placeholders of its statements to their keys. The dataset is never modified: the scratch
+    database is a temporary file, attached read-only by the connections of
+    the query_runner and removed when it is closed. Returns the scratch
+    settings of the runner, None when there was nothing to build.
+    """
+    if not builds:
+        return None
+
+    scratch_dir = tempfile.mkdtemp(prefix="dq_scratch_")
+    scratch_path = str(Path(scratch_dir) / SCRATCH_DATABASE_NAME)
+    tables = {}
+    # uri=True so the dataset can be attached read-only, spatialite for the
+    # statements parsing shapes
+    con = spatialite.connect(Path(scratch_path).as_uri(), uri=True)
+    try:
+        con.execute(
+            "ATTACH DATABASE ? AS source;",
+            (sqlite_uri(query_runner.tested_dataset_path),),
+        )
+        for number, build in enumerate(builds):
+            scratch_table = f"{build['prefix']}_{number}"
+            start_wall, start_cpu = time.perf_counter(), time.thread_time()
+            with con:
+                used_tables = {
+                    placeholder: tables[key]["scratch_table"]
+                    for placeholder, key in build.get("uses", {}).items()
+                }
+                for statement in build["statements"]:
+                    con.execute(
+                        statement.format(scratch_table=scratch_table, **used_tables)
+                    )
+            tables[build["key"]] = {
+                "scratch_table": scratch_table,
+                "stage": build["stage"],
+                "wall_time_s": time.perf_counter() - start_wall,
+                "cpu_time_s": time.thread_time() - start_cpu,
+                "rows_fetched": 0,
+                "members": build["members"],
+            }
+    except BaseException:
+        con.close()
+        shutil.rmtree(scratch_dir)
+        raise
+    con.close()
+
+    query_runner.use_scratch({"path": scratch_path, "tables": tables}, owned=True)
+    return query_runner.scratch
@@ -0,0 +1,231 @@
+from core import QueryRunner
+import rule_violations
+
+# JSON Schema types, mapped to the types (see Backend.json_key_type) a value
+# can have to be of that type
+SCHEMA_TYPES = {
+    "string": ("string",),
+    "integer": ("integer",),
+    "number": ("integer", "number"),
+    "boolean": ("boolean",),
+    "array": ("array",),
+    "object": ("object",),
+    "null": ("null",),
+}
+
+SCHEMA_KEYWORDS = ("type", "properties", "required", "additionalProperties")
+
+PROPERTY_KEYWORDS = ("type", "enum", "format", "equals_field")
+
+PROPERTY_FORMATS = ("date",)
+
+# name of the rule of the rows whose field is not a JSON object
+OBJECT_RULE = "object"
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f"enum values must be strings or numbers, got {value!r}")
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class CompiledJsonSchema:
+    """A JSON Schema style description of the JSON objects of a field,
+    compiled into sql. Supported keywords: "required" (keys), "properties"
+    (key: {"type", "enum", "format": "date", "equals_field": a column the
+    value must be equal to}) and "additionalProperties": false (the keys
+    must be within the properties, as
+    expect_keys_in_json_field_to_be_in_set_of_options checks them).
+
+    The parts of the objects the rules read (the type and the value of a
+    key, the keys left once the properties are removed) are extracted once
+    per row into the columns of extractions, evaluated over json_field (the
+    field, NULL when it is not an object). Each rule has a name, a predicate
+    over those columns true when a row violates it and the column reported
+    in its samples (or None). compared_columns are the columns of the table
+    equals_field compares with, read as dq_column_<n>."""
+
+    def __init__(self, backend, json_schema: dict, json_field: str = "dq_json"):
+        unknown_keywords = set(json_schema) - set(SCHEMA_KEYWORDS)
+        if unknown_keywords:
+            raise ValueError(f"unsupported schema keywords {sorted(unknown_keywords)}")
+        if json_schema.get("type", "object") != "object":
+            raise ValueError("the schema of a JSON field must be of type object")
+
+        self.backend = backend
+        self.json_field = json_field
+        self.extractions = {}
+        # position of each key the rules read, naming its columns
+        self.keys = {}
+        self.rules = []
+        self.compared_columns = []
+
+        properties = json_schema.get("properties", {})
+        for json_key in json_schema.get("required", []):
+            self._add_rule(f"required:{json_key}", f"{self._type(json_key)} IS NULL")
+
+        for json_key, json_property in properties.items():
+            self._compile_property(json_key, json_property)
+
+        if json_schema.get("additionalProperties", True) is False:
+            non_expected_keys = self._extract(
+                "dq_non_expected_keys",
+                backend.json_without_keys(json_field, set(properties)),
+            )
+            self._add_rule(
+                "additional_keys",
+                backend.json_has_keys_left(non_expected_keys),
+                non_expected_keys,
+            )
+
+    def _extract(self, column: str, expression: str) -> str:
+        self.extractions.setdefault(column, expression)
+        return column
+
+    def _key_position(self, json_key: str) -> int:
+        return self.keys.setdefault(json_key, len(self.keys))
+
+    def _type(self, json_key: str) -> str:
+        return self._extract(
+            f"dq_type_{self._key_position(json_key)}",
+            self.backend.json_key_type(self.json_field, json_key),
+        )
+
+    def _value(self, json_key: str) -> str:
+        return self._extract(
+            f"dq_value_{self._key_position(json_key)}",
+            self.backend.json_extract_text(self.json_field, json_key),
+        )
+
+    def _add_rule(self, rule: str, violation: str, sample_column: str = None):
+        self.rules.append(
+            {"rule": rule, "violation": violation, "sample_column": sample_column}
+        )
+
+    def _compile_property(self, json_key: str, json_property: dict):
+        unknown_keywords = set(json_property) - set(PROPERTY_KEYWORDS)
+        if unknown_keywords:
+            raise ValueError(
+                f"unsupported keywords {sorted(unknown_keywords)} for the key '{json_key}'"
+            )
+
+        if "type" in json_property:
+            schema_types = json_property["type"]
+            if isinstance(schema_types, str):
+                schema_types = [schema_types]
+            unknown_types = set(schema_types) - set(SCHEMA_TYPES)
+            if unknown_types:
+                raise ValueError(
+                    f"unsupported types {sorted(unknown_types)} for the key '{json_key}'"
+                )
+            allowed_types = sorted(
+                {allowed for type in schema_types for allowed in SCHEMA_TYPES[type]}
+            )
+            str_allowed_types = ",".join(f"'{allowed}'" for allowed in allowed_types)
+            key_type = self._type(json_key)
+            self._add_rule(
+                f"type:{json_key}",
+                f"{key_type} NOT IN ({str_allowed_types})",
+                key_type,
+            )
+
+        if "enum" in json_property:
+            enum = list(json_property["enum"])
+            str_enum = ",".join(
+                _sql_literal(option) for option in enum if option is not None
+            )
+            key_type, value = self._type(json_key), self._value(json_key)
+            # json null values are extracted as NULL
+            violation = f"{key_type} <> 'null' AND {value} NOT IN ({str_enum})"
+            if None not in enum:
+                violation = f"{key_type} = 'null' OR ({violation})"
+            self._add_rule(f"enum:{json_key}", violation, value)
+
+        if "format" in json_property:
+            if json_property["format"] not in PROPERTY_FORMATS:
+                raise ValueError(
+                    f"unsupported format '{json_property['format']}' for the key '{json_key}', "
+                    f"supported formats are {PROPERTY_FORMATS}"
+                )
+            key_type, value = self._type(json_key), self._value(json_key)
+            self._add_rule(
+                f"format:{json_key}",
+                f"{key_type} = 'string' AND NOT {self.backend.is_iso_date(value)}",
+                value,
+            )
+
+        if "equals_field" in json_property:
+            column = f"dq_column_{len(self.compared_columns)}"
+            self.compared_columns.append(json_property["equals_field"])
+            key_type, value = self._type(json_key), self._value(json_key)
+            self._add_rule(
+                f"equals_field:{json_key}",
+                f"{key_type} IS NOT NULL AND {self.backend.values_differ(value, column)}",
+                value,
+            )
+
+
+def json_schema_violations(
+    query_runner: QueryRunner,
+    table_name: str,
+    field_name: str,
+    json_schema: dict,
+    ref_fields: list,
+    max_failure_samples: int = None,
+    batch_size: int = 10000,
+):
+    """Validates the JSON objects of a field against a schema (see
+    CompiledJsonSchema) in a single pass over the table: the field is read
+    once per row, the keys the rules read are extracted once, every rule is
+    evaluated in the same query and only the rows violating at
+    least one rule are streamed. Rows whose field is NULL are not checked,
+    rows whose field is not a JSON object violate the "object" rule only.
+    Returns what rule_violations.collect_rule_violations does.
+    """
+    backend = query_runner.backend
+    schema = CompiledJsonSchema(backend, json_schema)
+
+    # the columns the rules compare with are carried through as dq_column_<n>
+    read_columns = [
+        f"{ref_field} AS dq_ref_{position}"
+        for position, ref_field in enumerate(ref_fields)
+    ] + [
+        f"{column} AS dq_column_{position}"
+        for position, column in enumerate(schema.compared_columns)
+    ]
+    ref_columns = [f"dq_ref_{position}" for position in range(len(ref_fields))]
+    carried_columns = ref_columns + [
+        f"dq_column_{position}" for position in range(len(schema.compared_columns))
+    ]
+    extractions = [
+        f"{expression} AS {column}" for column, expression in schema.extractions.items()
+    ]
+    rules = [
+        {
+            "rule": OBJECT_RULE,
+            "violation": "dq_has_json AND dq_json IS NULL",
+            "sample_column": None,
+        }
+    ] + [
+        {**rule, "violation": f"dq_json IS NOT NULL AND ({rule['violation']})"}
+        for rule in schema.rules
+    ]
+    # the extractions are not flattened either, so whether the field is an
+    # object is checked once per row and each type or value is extracted once
+    rows_query = f"""
+        SELECT {",".join(carried_columns + ["dq_has_json", "dq_json"] + extractions)}
+        FROM (
+            SELECT {",".join(read_columns)},
+                {field_name} IS NOT NULL AS dq_has_json,
+                CASE WHEN {backend.json_is_object(field_name)} THEN {field_name} END AS dq_json
+            FROM {query_runner.table_source(table_name)}
+            {backend.unflattened_subquery_sql})"""
+    sql_query = rule_violations.rule_violations_query(
+        backend, ref_columns, rules, rows_query
+    )
+
+    return rule_violations.collect_rule_violations(
+        query_runner, sql_query, ref_fields, rules, max_failure_samples, batch_size
+    )
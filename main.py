@@ -1,48 +1,375 @@
 from core import QueryRunner, config_parser, DataQualityException
-from expectations import *
+from backends import BACKENDS, DEFAULT_BACKEND
+from execution import ENGINES, EXECUTORS, make_executor, run_suite
+from incremental import IncrementalState
+from sinks import SINKS, make_sink
+from metrics import RunSummary
+from explain import (
+    ExplainQueryRunner,
+    explain_suite,
+    format_explain_report,
+    save_explain_report,
+)
 from math import inf
 from datetime import datetime
+from contextlib import ExitStack
+from pathlib import Path
 import click
+import os
+import tracemalloc
+import warnings
 
 
 @click.command()
 @click.option("--results-path", help="path to save json results", required=True)
-@click.option("--sqlite-dataset-path", help="path to sqlite3 dataset", required=True)
-@click.option("--data-quality-yaml", help="path to expectations yaml", required=True)
-def run_dq_suite(results_path, sqlite_dataset_path, data_quality_yaml):
+@click.option("--sqlite-dataset-path", help="path to sqlite3 dataset")
+@click.option("--data-quality-yaml", help="path to expectations yaml")
+@click.option(
+    "--manifest",
+    help="path to a yaml listing several (sqlite dataset, expectations yaml) pairs to run in one process",
+)
+@click.option(
+    "--fuse-scans",
+    is_flag=True,
+    default=False,
+    help="evaluate expectations on the same table with one scan",
+)
+@click.option(
+    "--provision-indexes",
+    is_flag=True,
+    default=False,
+    help="index the columns several uniqueness or lookup count expectations group by, in a temporary scratch database",
+)
+@click.option(
+    "--shred-json",
+    is_flag=True,
+    default=False,
+    help="parse the JSON fields several JSON expectations check once, into a temporary scratch database",
+)
+@click.option(
+    "--parse-geometries",
+    is_flag=True,
+    default=False,
+    help="parse the shapes several geometry expectations check once, into a temporary scratch database",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(ENGINES),
+    default="sql",
+    show_default=True,
+    help="evaluate range, set, uniqueness and lookup count expectations in sql or over numpy arrays",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(BACKENDS),
+    default=None,
+    help=f"database engine, overrides the backend of the suites (default {DEFAULT_BACKEND})",
+)
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    help="number of expectations to run concurrently",
+)
+@click.option(
+    "--executor",
+    type=click.Choice(EXECUTORS),
+    default="thread",
+    show_default=True,
+    help="backend used to run expectations when workers > 1",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="reuse previous results of expectations whose tables did not change",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="with --incremental, re-run every expectation and refresh the saved state",
+)
+@click.option(
+    "--results-sink",
+    type=click.Choice(SINKS),
+    default="file",
+    show_default=True,
+    help="one json file per expectation, one ndjson file per run or a sqlite results database",
+)
+@click.option(
+    "--metrics-path",
+    default=None,
+    help="collect per-expectation metrics and write a summary of the run to this Prometheus textfile (.prom)",
+)
+@click.option(
+    "--trace-memory",
+    is_flag=True,
+    default=False,
+    help="with --metrics-path, also measure the peak python memory of every expectation (slower)",
+)
+@click.option(
+    "--explain",
+    is_flag=True,
+    default=False,
+    help="dry run: plan the queries of every expectation without running them and print a ranked cost report",
+)
+def run_dq_suite(
+    results_path,
+    sqlite_dataset_path,
+    data_quality_yaml,
+    manifest,
+    fuse_scans,
+    provision_indexes,
+    shred_json,
+    parse_geometries,
+    engine,
+    backend,
+    workers,
+    executor,
+    incremental,
+    force,
+    results_sink,
+    metrics_path,
+    trace_memory,
+    explain,
+):
 
     now = datetime.now()
     data_quality_execution_time = now.strftime("%Y%m%d_%H%M%S")
 
-    data_quality_suite_config = config_parser(data_quality_yaml)
-
-    query_runner = QueryRunner(sqlite_dataset_path)
+    if manifest:
+        collections = collections_from_manifest(manifest, results_path)
+    elif sqlite_dataset_path and data_quality_yaml:
+        collections = [
+            {
+                "sqlite_dataset_path": sqlite_dataset_path,
+                "data_quality_yaml": data_quality_yaml,
+                "results_path": results_path,
+            }
+        ]
+    else:
+        raise click.UsageError(
+            "Either --manifest or both --sqlite-dataset-path and --data-quality-yaml are required"
+        )
 
-    expectations = data_quality_suite_config.get("expectations", None)
+    if explain:
+        explain_collections(collections, fuse_scans, data_quality_execution_time)
+        return
 
-    failed_expectation_with_error_severity = 0
+    # suites shared by several collections are parsed only once
+    data_quality_suite_configs = {}
 
-    for expectation in expectations:
+    collections_with_failed_expectations = []
+    # "<collection_name> (<error>)" of the collections of a batch that
+    # couldn't be set up or run
+    collections_with_errors = []
 
-        arguments = {**expectation}
+    run_summary = None
+    if metrics_path:
+        run_summary = RunSummary()
+        if trace_memory:
+            tracemalloc.start()
 
-        response = run_expectation(
-            query_runner=query_runner,
-            data_quality_execution_time=data_quality_execution_time,
-            **arguments
+    with ExitStack() as stack:
+        sink = stack.enter_context(
+            make_sink(results_sink, results_path, data_quality_execution_time)
         )
+        pool = None
+        if workers > 1:
+            pool = stack.enter_context(make_executor(executor, workers))
+
+        # every collection is queued before the results of the first one are
+        # collected, so a shared pool is never idle between collections
+        collection_runs = []
+        for collection in collections:
+            try:
+                data_quality_yaml = collection["data_quality_yaml"]
+                if data_quality_yaml not in data_quality_suite_configs:
+                    data_quality_suite_configs[data_quality_yaml] = config_parser(
+                        data_quality_yaml
+                    )
+                data_quality_suite_config = data_quality_suite_configs[
+                    data_quality_yaml
+                ]
+                expectations = data_quality_suite_config.get("expectations", None)
+                collection.setdefault(
+                    "collection_name",
+                    data_quality_suite_config.get(
+                        "collection_name", Path(collection["sqlite_dataset_path"]).stem
+                    ),
+                )
+
+                query_runner = stack.enter_context(
+                    QueryRunner(
+                        collection["sqlite_dataset_path"],
+                        sample=data_quality_suite_config.get("sample", None),
+                        backend=backend
+                        or data_quality_suite_config.get("backend", DEFAULT_BACKEND),
+                    )
+                )
+                incremental_state = None
+                if incremental:
+                    incremental_state = IncrementalState(
+                        collection["results_path"], force=force
+                    )
+                responses = run_suite(
+                    query_runner,
+                    expectations,
+                    fuse_scans=fuse_scans,
+                    engine=engine,
+                    pool=pool,
+                    incremental_state=incremental_state,
+                    collect_metrics=run_summary is not None,
+                    provision_indexes=provision_indexes,
+                    shred_json=shred_json,
+                    parse_geometries=parse_geometries,
+                    data_quality_execution_time=data_quality_execution_time,
+                )
+            except Exception as error:
+                # in a batch the other collections still run
+                if not manifest:
+                    raise
+                collections_with_errors.append(_collection_error(collection, error))
+                continue
+            collection_runs.append(
+                (collection, query_runner, expectations, incremental_state, responses)
+            )
+
+        for (
+            collection,
+            query_runner,
+            expectations,
+            incremental_state,
+            responses,
+        ) in collection_runs:
+            failed_expectation_with_error_severity = 0
+
+            try:
+                # responses come back in the order of the suite, so results
+                # and warnings are produced in the same order whatever the
+                # executor
+                for position, (expectation, response) in enumerate(
+                    zip(expectations, responses)
+                ):
+                    bytes_serialized = sink.write(
+                        response,
+                        collection_name=collection["collection_name"],
+                        results_path=collection["results_path"],
+                    )
+                    if run_summary is not None:
+                        run_summary.add(
+                            collection["collection_name"],
+                            position,
+                            response,
+                            bytes_serialized,
+                        )
+                    failed_expectation_with_error_severity += response.act_on_failure()
+                    if incremental_state is not None:
+                        incremental_state.record(query_runner, expectation, response)
+
+                if incremental_state is not None:
+                    incremental_state.save()
+            except Exception as error:
+                if not manifest:
+                    raise
+                collections_with_errors.append(_collection_error(collection, error))
+                continue
+            finally:
+                query_runner.close()
+
+            if failed_expectation_with_error_severity > 0:
+                collections_with_failed_expectations.append(
+                    collection["collection_name"]
+                )
+
+    if run_summary is not None:
+        run_summary.write_textfile(metrics_path)
+        if trace_memory:
+            tracemalloc.stop()
 
-        response.save_to_file(results_path)
-        failed_expectation_with_error_severity += response.act_on_failure()
+    if collections_with_failed_expectations or collections_with_errors:
+        msgs = []
+        if collections_with_failed_expectations:
+            msg = "One or more expectations with severity RaiseError failed, see results for more details"
+            if manifest:
+                msg += (
+                    f" (collections: {', '.join(collections_with_failed_expectations)})"
+                )
+            msgs.append(msg)
+        if collections_with_errors:
+            msgs.append(
+                f"One or more collections could not be run (collections: {', '.join(collections_with_errors)})"
+            )
+        raise DataQualityException("; ".join(msgs))
 
-    if failed_expectation_with_error_severity > 0:
-        raise DataQualityException(
-            "One or more expectations with severity RaiseError failed, see results for more details"
+
+def _collection_error(collection: dict, error: Exception) -> str:
+    "Warns that a collection of a batch couldn't be run, returns its name and error"
+    collection_name = collection.get(
+        "collection_name", Path(collection["sqlite_dataset_path"]).stem
+    )
+    warnings.warn(f"collection '{collection_name}' could not be run: {error!r}")
+    return f"{collection_name} ({type(error).__name__}: {error})"
+
+
+def collections_from_manifest(manifest_path: str, results_path: str) -> list:
+    """Parses a batch manifest. It is a yaml with a list of collections, each
+    with a sqlite_dataset_path, a data_quality_yaml and optionally a
+    collection_name (by default the name of the sqlite file):
+
+        collections:
+          - collection_name: conservation-area
+            sqlite_dataset_path: conservation-area.sqlite3
+            data_quality_yaml: conservation-area.yaml
+
+    Results of each collection are saved to results_path/<collection_name>/
+    """
+    collections = []
+    for collection in config_parser(manifest_path)["collections"]:
+        collection_name = collection.get(
+            "collection_name", Path(collection["sqlite_dataset_path"]).stem
+        )
+        collection_results_path = os.path.join(results_path, collection_name, "")
+        os.makedirs(collection_results_path, exist_ok=True)
+        collections.append(
+            {
+                "collection_name": collection_name,
+                "sqlite_dataset_path": collection["sqlite_dataset_path"],
+                "data_quality_yaml": collection["data_quality_yaml"],
+                "results_path": collection_results_path,
+            }
         )
+    return collections
 
 
-def run_expectation(query_runner: QueryRunner, expectation_name: str, **kwargs):
-    return globals()[expectation_name](query_runner=query_runner, **kwargs)
+def explain_collections(
+    collections: list, fuse_scans: bool, data_quality_execution_time: str
+):
+    """Dry run of every collection (see explain.py): prints the ranked cost
+    report of each suite and saves it as <time>_explain.json in the results
+    path of the collection"""
+    for collection in collections:
+        data_quality_suite_config = config_parser(collection["data_quality_yaml"])
+        collection_name = collection.get(
+            "collection_name",
+            data_quality_suite_config.get(
+                "collection_name", Path(collection["sqlite_dataset_path"]).stem
+            ),
+        )
+        with ExplainQueryRunner(
+            collection["sqlite_dataset_path"],
+            sample=data_quality_suite_config.get("sample", None),
+        ) as query_runner:
+            report = explain_suite(
+                query_runner,
+                data_quality_suite_config["expectations"],
+                fuse_scans=fuse_scans,
+            )
+        save_explain_report(
+            collection["results_path"], data_quality_execution_time, report
+        )
+        click.echo(format_explain_report(collection_name, report))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# metrics of the expectation running in the current thread (see measure)
+_current = threading.local()
+
+# callable opening trace spans, see set_span_hook
+_span_hook = None
+
+
+def set_span_hook(hook):
+    """Plugs a tracer in: hook(name, attributes) must return a context manager
+    wrapping the span, e.g. with OpenTelemetry:
+
+        set_span_hook(lambda name, attributes: tracer.start_as_current_span(name, attributes=attributes))
+
+    Spans are opened for every expectation ("dq.expectation"), fused or
+    vectorized scan ("dq.scan") and query ("dq.query"). None removes the
+    hook. The hook is process wide, process workers don't inherit it.
+    """
+    global _span_hook
+    _span_hook = hook
+
+
+def span(name: str, attributes: dict):
+    "Context manager of a trace span, a no-op when no hook is set"
+    if _span_hook is None:
+        return nullcontext()
+    return _span_hook(name, attributes)
+
+
+def empty_metrics() -> dict:
+    "Metrics of an expectation that did nothing (yet)"
+    return {
+        "wall_time_s": 0.0,
+        "cpu_time_s": 0.0,
+        "queries": 0,
+        "rows_fetched": 0,
+        "peak_python_memory_bytes": None,
+    }
+
+
+def record_query():
+    "Called by QueryRunner for every query it runs"
+    metrics = getattr(_current, "metrics", None)
+    if metrics is not None:
+        metrics["queries"] += 1
+
+
+def record_rows(rows: int):
+    "Called by QueryRunner for every batch of rows it fetches"
+    metrics = getattr(_current, "metrics", None)
+    if metrics is not None:
+        metrics["rows_fetched"] += rows
+
+
+def record_scratch_use(scratch_table: dict):
+    """Called by QueryRunner when an expectation reads a table built for it
+    (and others) in a scratch database, see indexes.py: its build is shared
+    under the stage of the table (index_build, json_shred, geometry_parse)"""
+    metrics = getattr(_current, "metrics", None)
+    if metrics is not None:
+        metrics[scratch_table["stage"]] = {
+            key: scratch_table[key]
+            for key in (
+                "scratch_table",
+                "wall_time_s",
+                "cpu_time_s",
+                "rows_fetched",
+                "members",
+            )
+        }
+
+
+@contextmanager
+def measure():
+    """Measures the block in the current thread: yields a metrics dict (see
+    empty_metrics) filled with its wall and cpu time, the queries it ran and
+    the rows they fetched. The peak python memory (above the memory in use
+    when the block started) is only measured while tracemalloc is tracing,
+    as tracing slows everything down; it is a process wide peak so, with
+    thread workers, the peaks of concurrent expectations overlap.
+    """
+    metrics = empty_metrics()
+    previous = getattr(_current, "metrics", None)
+    _current.metrics = metrics
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    start_wall, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield metrics
+    finally:
+        metrics["wall_time_s"] = time.perf_counter() - start_wall
+        metrics["cpu_time_s"] = time.thread_time() - start_cpu
+        if tracing:
+            metrics["peak_python_memory_bytes"] = max(
+                tracemalloc.get_traced_memory()[1] - start_memory, 0
+            )
+        _current.metrics = previous
+
+
+def with_scan_share(metrics: dict, scan_metrics: dict, members: int) -> dict:
+    """Metrics of a member of a fused or vectorized scan: its own (those of
+    its re-run when it failed) plus the metrics of the whole scan, shared by
+    its members"""
+    return {
+        **(metrics or empty_metrics()),
+        "scan": {**scan_metrics, "members": members},
+    }
+
+
+def expectation_totals(metrics: dict, bytes_serialized: int = None) -> dict:
+    """Wall time, cpu time and rows fetched of an expectation, counting its
+    share of the scan it was part of and of the scratch tables built for it,
+    and the size of its saved response (bytes_serialized, 0 if unknown)"""
+    totals = {}
+    for key in ("wall_time_s", "cpu_time_s", "rows_fetched"):
+        totals[key] = metrics[key]
+        for shared in ("scan", "index_build", "json_shred", "geometry_parse"):
+            if metrics.get(shared) is not None:
+                totals[key] += metrics[shared][key] / metrics[shared]["members"]
+    totals["bytes_serialized"] = bytes_serialized or 0
+    totals["peak_python_memory_bytes"] = metrics["peak_python_memory_bytes"]
+    return totals
+
+
+# (metric name, help, key of expectation_totals) of the metrics exported per
+# expectation, and of the totals of each collection
+EXPECTATION_FAMILIES = [
+    ("dq_expectation_wall_seconds", "Wall time of the expectation", "wall_time_s"),
+    ("dq_expectation_cpu_seconds", "Cpu time of the expectation", "cpu_time_s"),
+    ("dq_expectation_rows_fetched", "Rows fetched by the expectation", "rows_fetched"),
+    (
+        "dq_expectation_bytes_serialized",
+        "Size of the saved response of the expectation",
+        "bytes_serialized",
+    ),
+    (
+        "dq_expectation_peak_python_memory_bytes",
+        "Peak python memory of the expectation",
+        "peak_python_memory_bytes",
+    ),
+]
+
+RUN_FAMILIES = [
+    ("dq_run_cpu_seconds", "Cpu time of the expectations", "cpu_time_s"),
+    ("dq_run_rows_fetched", "Rows fetched by the expectations", "rows_fetched"),
+    ("dq_run_bytes_serialized", "Size of the saved responses", "bytes_serialized"),
+    (
+        "dq_run_peak_python_memory_bytes",
+        "Highest peak python memory of an expectation",
+        "peak_python_memory_bytes",
+    ),
+]
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items())
+
+
+class RunSummary:
+    """Gathers the responses of a run (with the size of their saved json, as
+    returned by the sink that saved them) and writes a summary of it in the
+    Prometheus text format, for node exporter's textfile collector:
+
+        summary = RunSummary()
+        summary.add(collection_name, position, response, bytes_serialized)
+        summary.write_textfile("/var/lib/node_exporter/textfile/dq.prom")
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self._start_wall = time.perf_counter()
+        self.responses = []
+
+    def add(
+        self,
+        collection_name: str,
+        position: int,
+        response,
+        bytes_serialized: int = None,
+    ):
+        self.responses.append((collection_name, position, response, bytes_serialized))
+
+    def _samples(self) -> dict:
+        "Samples of every metric family, {(name, help): [(labels, value)]}"
+        families = {
+            ("dq_run_wall_seconds", "Wall time of the run"): [
+                ({}, time.perf_counter() - self._start_wall)
+            ],
+            ("dq_run_timestamp_seconds", "Start of the run (unix time)"): [
+                ({}, self.start_time)
+            ],
+            ("dq_run_expectations", "Expectations run, by status"): [],
+        }
+        expectations_by_status = {}
+        collection_totals = {}
+        expectation_samples = {family: [] for family in EXPECTATION_FAMILIES}
+
+        for collection_name, position, response, bytes_serialized in self.responses:
+            if response.cached:
+                status = "cached"
+            elif response.result:
+                status = "success"
+            else:
+                status = "fail"
+            key = (collection_name, status)
+            expectations_by_status[key] = expectations_by_status.get(key, 0) + 1
+            if response.metrics is None:
+                continue
+
+            totals = expectation_totals(response.metrics, bytes_serialized)
+            labels = {
+                "collection": collection_name,
+                "expectation": response.expectation_input["expectation_name"],
+                "position": position,
+            }
+            collection_total = collection_totals.setdefault(
+                collection_name,
+                {**dict.fromkeys(totals, 0), "peak_python_memory_bytes": None},
+            )
+            for family in EXPECTATION_FAMILIES:
+                total = family[2]
+                if totals[total] is None:
+                    continue
+                expectation_samples[family].append((labels, totals[total]))
+                if total == "peak_python_memory_bytes":
+                    collection_total[total] = max(
+                        collection_total[total] or 0, totals[total]
+                    )
+                else:
+                    collection_total[total] += totals[total]
+
+        families[("dq_run_expectations", "Expectations run, by status")] = [
+            ({"collection": collection_name, "status": status}, count)
+            for (collection_name, status), count in expectations_by_status.items()
+        ]
+        for name, help_text, total in RUN_FAMILIES:
+            families[(name, help_text)] = [
+                ({"collection": collection_name}, totals[total])
+                for collection_name, totals in collection_totals.items()
+                if totals[total] is not None
+            ]
+        for name, help_text, total in EXPECTATION_FAMILIES:
+            families[(name, help_text)] = expectation_samples[(name, help_text, total)]
+        return families
+
+    def to_text(self) -> str:
+        "The summary in the Prometheus text exposition format"
+        lines = []
+        for (name, help_text), samples in self._samples().items():
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                str_labels = f"{{{_labels(labels)}}}" if labels else ""
+                lines.append(f"{name}{str_labels} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Writes the summary to path, through a temporary file renamed over
+        it so the collector never reads a partial file"""
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            f.write(self.to_text())
+        os.replace(temporary_path, path)
@@ -0,0 +1,64 @@
+from core import QueryRunner
+
+# Expectations parsing the WKT shapes of a field, mapped to the argument
+# naming the field
+GEOMETRY_EXPECTATIONS = {
+    "expect_geoshapes_to_be_valid": "shape_field",
+    "expect_points_to_be_within_expected_shapes": "shape_field",
+    "expect_geoshapes_to_match_profile": "shape_field",
+}
+
+
+def shape_field_key(expectation: dict):
+    "(table_name, shape field) of the WKT shapes an expectation parses, or None"
+    argument = GEOMETRY_EXPECTATIONS.get(expectation.get("expectation_name"))
+    if argument is None or "table_name" not in expectation:
+        return None
+    # with a validity cache only the new shapes are parsed
+    if expectation.get("validity_cache_path") is not None:
+        return None
+    return expectation["table_name"], expectation[argument]
+
+
+def geometry_parsing_builds(
+    query_runner: QueryRunner, steps: list, min_expectations: int = 2
+) -> list:
+    """Scratch tables (see indexes.provision_scratch_tables) holding, for
+    every shape field parsed by at least min_expectations of the
+    expectations of steps (the (position, expectation) steps of a plan), the
+    geometry of every row parsed once, with its bounding box (see
+    Backend.parsed_geometries_statements). The expectations then read the
+    parsed geometries (see QueryRunner.parsed_geometries), the time spent
+    parsing is reported apart, as the geometry_parse stage of their
+    metrics."""
+    positions_by_key = {}
+    for step in steps:
+        if not isinstance(step, tuple):
+            continue
+        position, expectation = step
+        key = shape_field_key(expectation)
+        if key is not None:
+            positions_by_key.setdefault(key, []).append(position)
+
+    builds = []
+    for (table_name, shape_field), positions in positions_by_key.items():
+        if len(positions) < min_expectations:
+            continue
+        table_columns = set(
+            query_runner.run_query(f"PRAGMA table_info('{table_name}');")["name"]
+        )
+        # fields that are sql expressions are parsed by the expectations
+        if shape_field not in table_columns:
+            continue
+        builds.append(
+            {
+                "key": QueryRunner.scratch_key(table_name, [shape_field], "geometry"),
+                "stage": "geometry_parse",
+                "prefix": "geometry",
+                "statements": query_runner.backend.parsed_geometries_statements(
+                    "{scratch_table}", f"source.{table_name}", f'"{shape_field}"'
+                ),
+                "members": len(positions),
+            }
+        )
+    return builds
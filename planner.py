@@ -0,0 +1,369 @@
+import inspect
+from dataclasses import dataclass, field
+import expectations as dq_expectations
+from core import QueryRunner, ExpectationResponse
+from backends import Backend, DEFAULT_BACKEND, make_backend
+from vectorized import VECTORIZED_EXPECTATIONS, evaluate_table
+from metrics import measure, span, with_scan_share
+
+
+def _sql_values_list(values) -> str:
+    "Formats python values as the comma separated list of a sql IN (...)"
+    return ",".join("'" + str(value).replace("'", "''") + "'" for value in values)
+
+
+def _values_in_field_to_be_within_range_violation(
+    backend: Backend,
+    field_name: str,
+    min_expected_value: int,
+    max_expected_value: int,
+    **kwargs,
+):
+    return backend.range_violation(field_name, min_expected_value, max_expected_value)
+
+
+def _geoshapes_to_be_valid_violation(backend: Backend, shape_field: str, **kwargs):
+    return f"{backend.is_valid(shape_field)} IN (0,-1)"
+
+
+def _values_for_a_key_stored_in_json_are_within_a_set_violation(
+    backend: Backend, field: str, json_key: str, expected_values_set: set, **kwargs
+):
+    str_expected_values_set = "','".join(set(expected_values_set))
+    value_found_for_key = backend.json_extract_text(field, json_key)
+    return f"""({value_found_for_key} NOT IN ('{str_expected_values_set}'))
+            OR ({value_found_for_key}) IS NULL"""
+
+
+def _keys_in_json_field_to_be_in_set_of_options_violation(
+    backend: Backend, field_name: str, expected_keys_set: set, **kwargs
+):
+    non_expected_keys = backend.json_without_keys(field_name, set(expected_keys_set))
+    return backend.json_has_keys_left(non_expected_keys)
+
+
+# Expectations whose violations can be counted row by row, mapped to the sql
+# predicate (in the dialect of the backend) that is true for a violating row
+# (same predicate as in the WHERE clause of the expectation itself)
+ROW_VIOLATION_PREDICATES = {
+    "expect_values_in_field_to_be_within_range": _values_in_field_to_be_within_range_violation,
+    "expect_geoshapes_to_be_valid": _geoshapes_to_be_valid_violation,
+    "expect_values_for_a_key_stored_in_json_are_within_a_set": _values_for_a_key_stored_in_json_are_within_a_set_violation,
+    "expect_keys_in_json_field_to_be_in_set_of_options": _keys_in_json_field_to_be_in_set_of_options_violation,
+}
+
+LOOKUP_COUNT_EXPECTATION = "expect_row_count_for_lookup_value_to_be_in_range"
+
+
+@dataclass
+class FusedScan:
+    """Expectations (with their position in the suite) that are evaluated
+    together by a single scan of table_name"""
+
+    table_name: str
+    members: list = field(default_factory=list)
+
+
+@dataclass
+class VectorizedScan:
+    """Expectations (with their position in the suite) that are evaluated
+    together by the vectorized engine over the columns of table_name"""
+
+    table_name: str
+    members: list = field(default_factory=list)
+
+
+def is_vectorizable(expectation: dict) -> bool:
+    "Checks if an expectation of a suite can run on the vectorized engine"
+    return (
+        "table_name" in expectation
+        and expectation.get("expectation_name") in VECTORIZED_EXPECTATIONS
+    )
+
+
+def is_fusable(expectation: dict) -> bool:
+    "Checks if an expectation of a suite can take part in a fused table scan"
+    name = expectation.get("expectation_name")
+    if "table_name" not in expectation:
+        return False
+    # cached validity is cheaper than validating every shape in the scan
+    if expectation.get("validity_cache_path") is not None:
+        return False
+    # sharded validation runs in worker processes of its own
+    if expectation.get("shards") is not None:
+        return False
+    # thousands of ranges read from a csv are counted by the expectation
+    # itself, through a temporary table
+    if expectation.get("count_ranges_csv_path") is not None:
+        return False
+    return name in ROW_VIOLATION_PREDICATES or name == LOOKUP_COUNT_EXPECTATION
+
+
+def plan_suite(
+    expectations: list,
+    skip_positions: set = frozenset(),
+    fuse_scans: bool = True,
+    vectorize: bool = False,
+) -> list:
+    """Groups the expectations of a suite into steps. With vectorize the
+    expectations the vectorized engine supports become one VectorizedScan
+    per table. With fuse_scans fusable expectations targeting the same table
+    become one FusedScan. Every other expectation (and tables with a single
+    fusable expectation) is kept as a (position, expectation) step. Steps
+    are ordered by first appearance. Expectations at skip_positions are
+    left out of the plan.
+    """
+    steps = []
+    scans_by_table = {}
+    for position, expectation in enumerate(expectations):
+        if position in skip_positions:
+            continue
+        if vectorize and is_vectorizable(expectation):
+            scan_class = VectorizedScan
+        elif fuse_scans and is_fusable(expectation):
+            scan_class = FusedScan
+        else:
+            steps.append((position, expectation))
+            continue
+        key = (scan_class, expectation["table_name"])
+        if key not in scans_by_table:
+            scans_by_table[key] = scan_class(expectation["table_name"])
+            steps.append(scans_by_table[key])
+        scans_by_table[key].members.append((position, expectation))
+
+    return [
+        (
+            step.members[0]
+            if isinstance(step, FusedScan) and len(step.members) == 1
+            else step
+        )
+        for step in steps
+    ]
+
+
+def _lookup_value_aggregates(field_name: str, count_ranges_per_value: list):
+    "One SUM(CASE ...) per lookup value, comparing as text like the expectation"
+    return [
+        f"SUM(CASE WHEN CAST({field_name} AS TEXT) = {_sql_values_list([count_range['lookup_value']])} THEN 1 ELSE 0 END)"
+        for count_range in count_ranges_per_value
+    ]
+
+
+def compile_fused_scan(fused_scan: FusedScan, backend: Backend = None):
+    """Compiles the members of a FusedScan into one SELECT over the table, in
+    the dialect of the backend (spatialite by default). Returns the sql and,
+    per member, the list of result columns it owns.
+    """
+    backend = backend or make_backend(DEFAULT_BACKEND)
+    aggregates = []
+    member_columns = []
+    for position, expectation in fused_scan.members:
+        name = expectation["expectation_name"]
+        if name == LOOKUP_COUNT_EXPECTATION:
+            member_aggregates = _lookup_value_aggregates(
+                expectation["field_name"], expectation["count_ranges_per_value"]
+            )
+        else:
+            predicate = ROW_VIOLATION_PREDICATES[name](backend=backend, **expectation)
+            member_aggregates = [f"SUM(CASE WHEN ({predicate}) THEN 1 ELSE 0 END)"]
+
+        columns = []
+        for aggregate in member_aggregates:
+            column = f"agg_{len(aggregates)}"
+            aggregates.append(f"{aggregate} AS {column}")
+            columns.append(column)
+        member_columns.append(columns)
+
+    str_aggregates = ",\n            ".join(aggregates)
+    sql_query = f"""
+        SELECT {str_aggregates}
+        FROM {fused_scan.table_name};"""
+    return sql_query, member_columns
+
+
+def _member_failed(expectation: dict, aggregated_values: list) -> bool:
+    "Reads the violation flag of a member out of its aggregated values"
+    if expectation["expectation_name"] != LOOKUP_COUNT_EXPECTATION:
+        return (aggregated_values[0] or 0) > 0
+
+    for count_range, rows_found in zip(
+        expectation["count_ranges_per_value"], aggregated_values
+    ):
+        # lookup values not found at all are not flagged by the expectation
+        if not rows_found:
+            continue
+        if (
+            rows_found >= count_range["max_row_count"]
+            or rows_found <= count_range["min_row_count"]
+        ):
+            return True
+    return False
+
+
+def expectation_input_for(
+    query_runner: QueryRunner, expectation_name: str, **kwargs
+) -> dict:
+    """Rebuilds the expectation_input an expectation records for the given
+    arguments (its arguments with defaults applied plus its name)"""
+    expectation_function = getattr(dq_expectations, expectation_name)
+    bound_arguments = inspect.signature(expectation_function).bind(
+        query_runner=query_runner, **kwargs
+    )
+    bound_arguments.apply_defaults()
+    return {**bound_arguments.arguments, "expectation_name": expectation_name}
+
+
+def _success_response(
+    query_runner: QueryRunner, expectation_name: str, **kwargs
+) -> ExpectationResponse:
+    "Builds the response the expectation itself returns on success"
+    return ExpectationResponse(
+        expectation_input=expectation_input_for(
+            query_runner, expectation_name, **kwargs
+        ),
+        result=True,
+        msg="Success: data quality as expected",
+        details=None,
+        sqlite_dataset=query_runner.inform_dataset_path(),
+    )
+
+
+def run_expectation(
+    query_runner: QueryRunner,
+    expectation_name: str,
+    collect_metrics: bool = False,
+    **kwargs,
+):
+    """Runs an expectation by name. With collect_metrics its response gets
+    its metrics (see metrics.measure)."""
+    with span("dq.expectation", {"expectation_name": expectation_name}):
+        if not collect_metrics:
+            return getattr(dq_expectations, expectation_name)(
+                query_runner=query_runner, **kwargs
+            )
+        with measure() as metrics:
+            response = getattr(dq_expectations, expectation_name)(
+                query_runner=query_runner, **kwargs
+            )
+    response.metrics = metrics
+    return response
+
+
+def _scan_span(scan):
+    return span(
+        "dq.scan",
+        {
+            "scan": type(scan).__name__,
+            "table_name": scan.table_name,
+            "members": len(scan.members),
+        },
+    )
+
+
+def run_fused_scan(
+    query_runner: QueryRunner,
+    fused_scan: FusedScan,
+    collect_metrics: bool = False,
+    **kwargs,
+):
+    """Runs the single scan of a FusedScan and splits it back into one
+    ExpectationResponse per member. Members that passed get their success
+    response straight from the scan, members with violations are re-run on
+    their own to collect the details. With collect_metrics every member
+    gets its share of the scan (see metrics.with_scan_share). Returns
+    (position, response) pairs.
+    """
+    with _scan_span(fused_scan), measure() as scan_metrics:
+        sql_query, member_columns = compile_fused_scan(fused_scan, query_runner.backend)
+        aggregated = query_runner.run_query(sql_query).iloc[0]
+
+    responses = []
+    for (position, expectation), columns in zip(fused_scan.members, member_columns):
+        arguments = {**expectation, **kwargs}
+        aggregated_values = [aggregated[column] for column in columns]
+        if _member_failed(expectation, aggregated_values):
+            response = run_expectation(
+                query_runner=query_runner, collect_metrics=collect_metrics, **arguments
+            )
+        else:
+            response = _success_response(query_runner=query_runner, **arguments)
+        if collect_metrics:
+            response.metrics = with_scan_share(
+                response.metrics, scan_metrics, len(fused_scan.members)
+            )
+        responses.append((position, response))
+
+    return responses
+
+
+def run_vectorized_scan(
+    query_runner: QueryRunner,
+    vectorized_scan: VectorizedScan,
+    collect_metrics: bool = False,
+    **kwargs,
+):
+    """Evaluates the members of a VectorizedScan with the vectorized engine
+    (see vectorized.evaluate_table). Members that passed get their success
+    response, the others are run on their own, which gives their final
+    result and details. Metrics are shared as in run_fused_scan. Returns
+    (position, response) pairs.
+    """
+    with _scan_span(vectorized_scan), measure() as scan_metrics:
+        failed = evaluate_table(
+            query_runner,
+            vectorized_scan.table_name,
+            [expectation for position, expectation in vectorized_scan.members],
+        )
+
+    responses = []
+    for (position, expectation), member_failed in zip(vectorized_scan.members, failed):
+        arguments = {**expectation, **kwargs}
+        if member_failed:
+            response = run_expectation(
+                query_runner=query_runner, collect_metrics=collect_metrics, **arguments
+            )
+        else:
+            response = _success_response(query_runner=query_runner, **arguments)
+        if collect_metrics:
+            response.metrics = with_scan_share(
+                response.metrics, scan_metrics, len(vectorized_scan.members)
+            )
+        responses.append((position, response))
+
+    return responses
+
+
+def run_step(query_runner: QueryRunner, step, collect_metrics: bool = False, **kwargs):
+    """Runs one step of a plan, returning (position, response) pairs. When
+    the query_runner samples, the members of a fused or vectorized scan run
+    on their own so each reports its estimated violation rate."""
+    if isinstance(step, (FusedScan, VectorizedScan)):
+        if query_runner.sample is None:
+            run_scan = (
+                run_vectorized_scan
+                if isinstance(step, VectorizedScan)
+                else run_fused_scan
+            )
+            return run_scan(
+                query_runner, step, collect_metrics=collect_metrics, **kwargs
+            )
+        return [
+            response
+            for member in step.members
+            for response in run_step(
+                query_runner, member, collect_metrics=collect_metrics, **kwargs
+            )
+        ]
+
+    position, expectation = step
+    return [
+        (
+            position,
+            run_expectation(
+                query_runner=query_runner,
+                collect_metrics=collect_metrics,
+                **expectation,
+                **kwargs,
+            ),
+        )
+    ]
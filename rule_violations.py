@@ -0,0 +1,73 @@
+from core import QueryRunner
+
+
+def rule_violations_query(
+    backend, ref_columns: list, rules: list, rows_query: str
+) -> str:
+    """The query checking rules in a single pass over the rows of
+    rows_query: per rule ({"rule", "violation" predicate over the columns of
+    rows_query, "sample_column"}, in order) dq_rule_<n>, 1 when a row
+    violates it, followed by its sample_column when it has one, after the
+    ref_columns. Only the rows violating at least one rule are returned."""
+    columns = list(ref_columns)
+    for position, rule in enumerate(rules):
+        columns.append(
+            f"CASE WHEN {rule['violation']} THEN 1 ELSE 0 END AS dq_rule_{position}"
+        )
+        if rule["sample_column"] is not None:
+            columns.append(rule["sample_column"])
+    violated = " OR ".join(f"dq_rule_{position} = 1" for position in range(len(rules)))
+    # rows_query is not flattened into the rules, so what it computes once per
+    # row is not computed again by every rule reading it
+    return f"""
+        SELECT * FROM (
+            SELECT {",".join(columns)} FROM (
+                {rows_query}
+                {backend.unflattened_subquery_sql})
+        ) AS rules
+        WHERE {violated};"""
+
+
+def collect_rule_violations(
+    query_runner: QueryRunner,
+    sql_query: str,
+    ref_fields: list,
+    rules: list,
+    max_failure_samples: int = None,
+    batch_size: int = 10000,
+):
+    """Streams the rows of a query checking rules (see
+    rule_violations_query), each row being its ref_fields then, per rule,
+    whether it violates it and its sample value (when the rule has a
+    sample_column). Returns the number of rows, the number of violations per
+    rule and, per rule, the ref_fields (and value) of the first
+    max_failure_samples violating rows (all of them if None); rules without
+    violations are left out."""
+    violations_per_rule = {rule["rule"]: 0 for rule in rules}
+    samples_per_rule = {rule["rule"]: [] for rule in rules}
+    failures_count = 0
+    for batch in query_runner.iter_query(sql_query, batch_size=batch_size):
+        for row in batch:
+            failures_count += 1
+            refs = dict(zip(ref_fields, row[: len(ref_fields)]))
+            row_values = iter(row[len(ref_fields) :])
+            for rule in rules:
+                violated = next(row_values)
+                value = next(row_values) if rule["sample_column"] is not None else None
+                if not violated:
+                    continue
+                violations_per_rule[rule["rule"]] += 1
+                samples = samples_per_rule[rule["rule"]]
+                if max_failure_samples is None or len(samples) < max_failure_samples:
+                    record = dict(refs)
+                    if value is not None:
+                        record["value"] = value
+                    samples.append(record)
+
+    violations_per_rule = {
+        rule_name: count for rule_name, count in violations_per_rule.items() if count
+    }
+    samples_per_rule = {
+        rule_name: samples_per_rule[rule_name] for rule_name in violations_per_rule
+    }
+    return failures_count, violations_per_rule, samples_per_rule
@@ -0,0 +1,149 @@
+import dataclasses
+import io
+import json
+import math
+from collections.abc import Mapping
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from uuid import UUID
+
+
+def _default(value):
+    "Converts the values the json module can't encode (same as dataclasses_json)"
+    if _is_missing(value):
+        return None
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, Mapping):
+        return dict(value)
+    if hasattr(value, "item") and hasattr(value, "dtype"):
+        # numpy/pandas scalars
+        return value.item()
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (UUID, Decimal)):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _is_missing(value) -> bool:
+    "True for the missing value markers of pandas (NA, NaT)"
+    return type(value).__name__ in ("NAType", "NaTType")
+
+
+def _encode_key(key) -> str:
+    "Dict keys are written as strings, like the json module does"
+    return json.encoder.encode_basestring_ascii(
+        key if isinstance(key, str) else json.dumps(key)
+    )
+
+
+def _iter_json_chunks(value):
+    """Pure python encoding of a value, used for the values the fast encoder
+    rejects: NaN (and pandas NA/NaT) become null, infinities are kept as the
+    json module writes them"""
+    if value is None or _is_missing(value):
+        yield "null"
+    elif isinstance(value, str):
+        yield json.encoder.encode_basestring_ascii(value)
+    elif value is True:
+        yield "true"
+    elif value is False:
+        yield "false"
+    elif isinstance(value, int):
+        yield int.__repr__(value)
+    elif isinstance(value, float):
+        if math.isnan(value):
+            yield "null"
+        elif math.isinf(value):
+            yield "Infinity" if value > 0 else "-Infinity"
+        else:
+            yield float.__repr__(value)
+    elif isinstance(value, dict):
+        yield "{"
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                yield ", "
+            yield _encode_key(key)
+            yield ": "
+            yield from _iter_json_chunks(item)
+        yield "}"
+    elif isinstance(value, list):
+        yield "["
+        for i, item in enumerate(value):
+            if i:
+                yield ", "
+            yield from _iter_json_chunks(item)
+        yield "]"
+    else:
+        yield from _iter_json_chunks(_default(value))
+
+
+# C accelerated encoder used for the bulk of the values, NaN is rejected so
+# the values holding one are re-encoded by _iter_json_chunks
+_fast_encoder = json.JSONEncoder(allow_nan=False, default=_default)
+
+
+def encode_json_value(value) -> str:
+    "Encodes a single value, C accelerated unless it holds a NaN"
+    try:
+        return _fast_encoder.encode(value)
+    except ValueError:
+        return "".join(_iter_json_chunks(value))
+
+
+def _write_streamed_value(value, write) -> int:
+    """Writes a value, lists (and dicts of lists, like details) element by
+    element so no encoded copy of the whole value is ever built"""
+    written = 0
+    if isinstance(value, (list, tuple, set, frozenset)):
+        written += write("[")
+        for i, item in enumerate(value):
+            if i:
+                written += write(", ")
+            written += write(encode_json_value(item))
+        written += write("]")
+    elif isinstance(value, dict):
+        written += write("{")
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                written += write(", ")
+            written += write(_encode_key(key) + ": ")
+            written += _write_streamed_value(item, write)
+        written += write("}")
+    else:
+        written += write(encode_json_value(value))
+    return written
+
+
+def write_response_json(response, file, result_as_string: bool = True) -> int:
+    """Streams the json of an ExpectationResponse to a text file, with the
+    same layout as ExpectationResponse.to_json (fields in declaration order).
+    The response is neither copied nor modified: sets, numpy/pandas scalars
+    and NaN (written as null) are handled while encoding. With
+    result_as_string the result is written as "True"/"False" as in the
+    files saved by save_to_file. Returns the number of characters written
+    (the output is ascii, so also the number of bytes).
+    """
+    write = file.write
+    written = write("{")
+    for i, response_field in enumerate(dataclasses.fields(response)):
+        value = getattr(response, response_field.name)
+        if i:
+            written += write(", ")
+        written += write(f'"{response_field.name}": ')
+        if response_field.name == "result" and result_as_string:
+            value = str(value)
+        written += _write_streamed_value(value, write)
+    written += write("}")
+    return written
+
+
+def response_to_json(response, result_as_string: bool = True) -> str:
+    "Returns the json of an ExpectationResponse (see write_response_json)"
+    buffer = io.StringIO()
+    write_response_json(response, buffer, result_as_string=result_as_string)
+    return buffer.getvalue()
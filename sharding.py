@@ -0,0 +1,74 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import pandas as pd
+from core import QueryRunner
+
+# QueryRunners of a worker process, one per runner settings. Read-only
+# connections are left for the OS to release when the worker exits.
+_process_query_runners = {}
+
+
+def process_query_runner(query_runner_settings: dict) -> QueryRunner:
+    """The QueryRunner of the current worker process built from the settings
+    of a runner (see QueryRunner.settings), opened once per process"""
+    key = repr(sorted(query_runner_settings.items()))
+    query_runner = _process_query_runners.get(key)
+    if query_runner is None:
+        query_runner = QueryRunner(**query_runner_settings)
+        _process_query_runners[key] = query_runner
+    return query_runner
+
+
+def rowid_shards(query_runner: QueryRunner, table_name: str, shards: int) -> list:
+    """Splits the rowids of a table into at most shards contiguous
+    [first_rowid, last_rowid] ranges of the same width (from MIN and MAX of
+    the rowid, so without reading the table); an empty table has none"""
+    if not query_runner.backend.supports_sampling:
+        raise ValueError(
+            f"the {query_runner.backend.name} backend can't shard tables by rowid"
+        )
+    if shards < 1:
+        raise ValueError(f"shards must be at least 1, got {shards}")
+
+    first_rowid, last_rowid = query_runner.rowid_range(table_name)
+    if first_rowid is None:
+        return []
+    width = -(-(last_rowid - first_rowid + 1) // shards)
+    return [
+        (start, min(start + width - 1, last_rowid))
+        for start in range(first_rowid, last_rowid + 1, width)
+    ]
+
+
+def _run_query_in_process(query_runner_settings: dict, sql_query: str):
+    return process_query_runner(query_runner_settings).run_query(sql_query)
+
+
+def run_sharded_queries(query_runner: QueryRunner, sql_queries: list) -> pd.DataFrame:
+    """Runs the queries of the shards of a table, each in a worker process
+    with its own QueryRunner and connection (so CPU bound queries, e.g. shape
+    validation, use as many cores as there are workers), and concatenates
+    their results in the order of the queries. The pool is started for the
+    queries, with a worker per query but no more than the cores of the
+    machine. It is not the pool of the suite (see execution.make_executor):
+    the step waiting for the shards runs in a worker of that pool, so shards
+    queued behind it could never run. A runner that can't be rebuilt in a
+    worker process (e.g. the ExplainQueryRunner of a dry run, whose queries
+    are planned rather than run) runs them one after the other itself."""
+    if not query_runner.runs_in_worker_processes:
+        return pd.concat(
+            [query_runner.run_query(sql_query) for sql_query in sql_queries],
+            ignore_index=True,
+        )
+    workers = min(len(sql_queries), os.cpu_count() or 1)
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            pool.submit(_run_query_in_process, query_runner.settings(), sql_query)
+            for sql_query in sql_queries
+        ]
+        results = [future.result() for future in futures]
+    finally:
+        # when a shard fails the shards still queued are not run
+        pool.shutdown(cancel_futures=True)
+    return pd.concat(results, ignore_index=True)
@@ -0,0 +1,66 @@
+from core import QueryRunner
+
+# JSON expectations, mapped to the argument naming the field they parse
+JSON_EXPECTATIONS = {
+    "expect_values_for_a_key_stored_in_json_are_within_a_set": "field",
+    "expect_keys_in_json_field_to_be_in_set_of_options": "field_name",
+}
+
+
+def json_field_key(expectation: dict):
+    "(table_name, field) of the JSON field an expectation parses, or None"
+    argument = JSON_EXPECTATIONS.get(expectation.get("expectation_name"))
+    if argument is None or "table_name" not in expectation:
+        return None
+    return expectation["table_name"], expectation[argument]
+
+
+def json_shredding_builds(
+    query_runner: QueryRunner, steps: list, min_expectations: int = 2
+) -> list:
+    """Scratch tables (see indexes.provision_scratch_tables) holding, for
+    every JSON field parsed by at least min_expectations of the expectations
+    of steps (the (position, expectation) steps of a plan), the json_each
+    rows of its JSON objects: (row_id, id, key, value, type), stored in
+    document order and indexed on (key, row_id). The field is parsed once
+    instead of once per expectation, the expectations then read the keys
+    and values they check (see QueryRunner.shredded_json). Rows whose field
+    is not a JSON object (NULL, malformed, an array, ...) have no key."""
+    positions_by_key = {}
+    for step in steps:
+        if not isinstance(step, tuple):
+            continue
+        position, expectation = step
+        key = json_field_key(expectation)
+        if key is not None:
+            positions_by_key.setdefault(key, []).append(position)
+
+    builds = []
+    for (table_name, field_name), positions in positions_by_key.items():
+        if len(positions) < min_expectations:
+            continue
+        table_columns = set(
+            query_runner.run_query(f"PRAGMA table_info('{table_name}');")["name"]
+        )
+        # fields that are sql expressions are parsed by the expectations
+        if field_name not in table_columns:
+            continue
+        builds.append(
+            {
+                "key": QueryRunner.scratch_key(table_name, [field_name], "json_each"),
+                "stage": "json_shred",
+                "prefix": "json",
+                "statements": [
+                    # json_each gives an array its indexes as keys and a
+                    # scalar a NULL key: only object keys are text
+                    f"""CREATE TABLE {{scratch_table}} AS
+                        SELECT t.rowid AS row_id, j.id AS id, j.key AS key,
+                            j.value AS value, j.type AS type
+                        FROM source.{table_name} AS t, json_each(t."{field_name}") AS j
+                        WHERE json_valid(t."{field_name}") AND typeof(j.key) = 'text';""",
+                    "CREATE INDEX {scratch_table}_index ON {scratch_table} (key, row_id);",
+                ],
+                "members": len(positions),
+            }
+        )
+    return builds
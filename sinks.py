@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+from core import ExpectationResponse
+from serializer import write_response_json
+
+SINKS = ("file", "ndjson", "sqlite")
+
+RESULTS_DATABASE_NAME = "dq_results.sqlite3"
+
+
+class FileSink:
+    """Saves one json file per expectation in the results path of its
+    collection (see ExpectationResponse.save_to_file). The write of every
+    sink returns the size of the json saved for the response."""
+
+    def __init__(self, results_path: str, data_quality_execution_time: str):
+        self.results_path = results_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(
+        self,
+        response: ExpectationResponse,
+        collection_name: str = None,
+        results_path: str = None,
+    ):
+        return response.save_to_file(results_path or self.results_path)
+
+    def close(self):
+        pass
+
+
+class NDJSONSink(FileSink):
+    """Appends every response of a run, one json per line, to a single file
+    <results_path>/<data_quality_execution_time>_results.ndjson. Each line is
+    {"collection": <collection name>, "response": <saved response json>} so
+    several collections can share the file.
+    """
+
+    def __init__(self, results_path: str, data_quality_execution_time: str):
+        super().__init__(results_path, data_quality_execution_time)
+        self.file_path = os.path.join(
+            results_path, f"{data_quality_execution_time}_results.ndjson"
+        )
+        self._file = open(self.file_path, "a")
+
+    def write(
+        self,
+        response: ExpectationResponse,
+        collection_name: str = None,
+        results_path: str = None,
+    ):
+        self._file.write(f'{{"collection": {json.dumps(collection_name)}, "response": ')
+        bytes_serialized = write_response_json(response, self._file)
+        self._file.write("}\n")
+        return bytes_serialized
+
+    def close(self):
+        self._file.close()
+
+
+class SQLiteSink(FileSink):
+    """Inserts the responses into a results database
+    <results_path>/dq_results.sqlite3, in batches of batch_size rows, with an
+    index on (collection, data_quality_execution_time, expectation_name)."""
+
+    def __init__(
+        self,
+        results_path: str,
+        data_quality_execution_time: str,
+        batch_size: int = 500,
+    ):
+        super().__init__(results_path, data_quality_execution_time)
+        self.batch_size = batch_size
+        self._pending_rows = []
+        self._con = sqlite3.connect(os.path.join(results_path, RESULTS_DATABASE_NAME))
+        self._con.executescript("""
+            CREATE TABLE IF NOT EXISTS expectation_result (
+                collection TEXT,
+                data_quality_execution_time TEXT,
+                expectation_name TEXT,
+                expectation_severity TEXT,
+                result INTEGER,
+                msg TEXT,
+                sqlite_dataset TEXT,
+                response JSON
+            );
+            CREATE INDEX IF NOT EXISTS expectation_result_index
+                ON expectation_result (collection, data_quality_execution_time, expectation_name);
+            """)
+
+    def write(
+        self,
+        response: ExpectationResponse,
+        collection_name: str = None,
+        results_path: str = None,
+    ):
+        saved_json = response.to_saved_json()
+        self._pending_rows.append(
+            (
+                collection_name,
+                response.data_quality_execution_time,
+                response.expectation_input["expectation_name"],
+                response.expectation_input.get("expectation_severity"),
+                None if response.result is None else int(bool(response.result)),
+                response.msg,
+                response.sqlite_dataset,
+                saved_json,
+            )
+        )
+        if len(self._pending_rows) >= self.batch_size:
+            self.flush()
+        return len(saved_json)
+
+    def flush(self):
+        "Inserts the pending rows in a single transaction"
+        with self._con:
+            self._con.executemany(
+                "INSERT INTO expectation_result VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                self._pending_rows,
+            )
+        self._pending_rows = []
+
+    def close(self):
+        self.flush()
+        self._con.close()
+
+
+def make_sink(sink: str, results_path: str, data_quality_execution_time: str):
+    "Returns the results sink of the given kind, to be used as a context manager"
+    if sink == "file":
+        return FileSink(results_path, data_quality_execution_time)
+    elif sink == "ndjson":
+        return NDJSONSink(results_path, data_quality_execution_time)
+    elif sink == "sqlite":
+        return SQLiteSink(results_path, data_quality_execution_time)
+    else:
+        raise ValueError(f"sink must be one of {SINKS}, got '{sink}'")
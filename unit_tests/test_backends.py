@@ -0,0 +1,247 @@
+import pytest
+import sqlite3
+import pandas as pd
+from core import QueryRunner
+from execution import run_suite
+from planner import FusedScan, compile_fused_scan
+from expectations import _invalid_shapes_query
+from backends import *
+
+duckdb = pytest.importorskip("duckdb")
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+exported_tables = ["entity", "fact", "fact_resource"]
+
+suite_expectations = [
+    {
+        "expectation_name": "expect_database_to_have_set_of_tables",
+        "expected_tables_set": exported_tables,
+    },
+    {
+        "expectation_name": "expect_table_to_have_set_of_columns",
+        "table_name": "fact_resource",
+        "expected_columns_set": [
+            "end_date",
+            "fact",
+            "entry_date",
+            "entry_number",
+            "resource",
+            "start_date",
+        ],
+    },
+    {
+        "expectation_name": "expect_table_row_count_to_be_in_range",
+        "table_name": "entity",
+        "min_expected_row_count": 400,
+        "max_expected_row_count": 500,
+    },
+    {
+        "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+        "table_name": "fact",
+        "field_name": "entity",
+        "count_ranges_per_value": [
+            {"lookup_value": "42114488", "min_row_count": 1, "max_row_count": 9},
+        ],
+    },
+    {
+        "expectation_name": "expect_field_values_to_be_within_set",
+        "table_name": "fact",
+        "field_name": "field",
+        "expected_values_set": ["name", "reference"],
+    },
+    {
+        "expectation_name": "expect_values_for_field_to_be_unique",
+        "table_name": "fact_resource",
+        "fields": ["fact", "resource"],
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "reference",
+        "min_expected_value": 1021466,
+        "max_expected_value": 1300000,
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_keys_in_json_field_to_be_in_set_of_options",
+        "table_name": "entity",
+        "field_name": "json",
+        "ref_fields": ["entity"],
+        "expected_keys_set": ["name"],
+    },
+    {
+        "expectation_name": "expect_values_for_a_key_stored_in_json_are_within_a_set",
+        "table_name": "entity",
+        "field": "json",
+        "json_key": "listed-building-grade",
+        "expected_values_set": ["II", "II*"],
+        "ref_fields": ["entity"],
+    },
+]
+
+
+@pytest.fixture(scope="module")
+def parquet_dataset(tmp_path_factory):
+    "Parquet exports of a few tables of the testing dataset"
+    parquet_path = tmp_path_factory.mktemp("parquet_dataset")
+    con = sqlite3.connect(tested_dataset)
+    duckdb_con = duckdb.connect()
+    for table_name in exported_tables:
+        table = pd.read_sql(f"SELECT * FROM {table_name};", con)
+        duckdb_con.register("exported_table", table)
+        duckdb_con.execute(
+            f"COPY exported_table TO '{parquet_path / table_name}.parquet' (FORMAT parquet);"
+        )
+        duckdb_con.unregister("exported_table")
+    con.close()
+    return str(parquet_path)
+
+
+def _sorted_records(records):
+    return sorted(records, key=lambda record: record["entity"])
+
+
+def test_duckdb_backend_gives_the_results_of_spatialite(parquet_dataset):
+    spatialite_responses = list(run_suite(query_runner, suite_expectations))
+    with QueryRunner(parquet_dataset, backend="duckdb") as duckdb_query_runner:
+        duckdb_responses = list(run_suite(duckdb_query_runner, suite_expectations))
+
+    assert [response.result for response in duckdb_responses] == [
+        response.result for response in spatialite_responses
+    ]
+    assert [response.result for response in duckdb_responses] == [
+        True,
+        True,
+        True,
+        False,
+        False,
+        False,
+        False,
+        False,
+        False,
+    ]
+    # same rows out of range (18), compared as numbers rather than as text
+    assert _sorted_records(
+        duckdb_responses[6].details["records_with_value_out_of_range"]
+    ) == _sorted_records(
+        spatialite_responses[6].details["records_with_value_out_of_range"]
+    )
+    assert duckdb_responses[6].msg == spatialite_responses[6].msg
+    # the 35 grade I entities
+    assert _sorted_records(duckdb_responses[8].details["non_expected_values"]) == (
+        _sorted_records(spatialite_responses[8].details["non_expected_values"])
+    )
+    assert len(duckdb_responses[8].details["non_expected_values"]) == 35
+
+
+def test_duckdb_backend_fused_scans_and_vectorized_engine(parquet_dataset):
+    with QueryRunner(parquet_dataset, backend="duckdb") as duckdb_query_runner:
+        responses = list(run_suite(duckdb_query_runner, suite_expectations))
+        fused_responses = list(
+            run_suite(duckdb_query_runner, suite_expectations, fuse_scans=True)
+        )
+        vectorized_responses = list(
+            run_suite(duckdb_query_runner, suite_expectations, engine="vectorized")
+        )
+
+    assert [response.result for response in fused_responses] == [
+        response.result for response in responses
+    ]
+    assert [response.result for response in vectorized_responses] == [
+        response.result for response in responses
+    ]
+
+
+def test_json_schema_in_the_dialect_of_the_backend(parquet_dataset):
+    expectation = {
+        "expectation_name": "expect_json_field_to_match_schema",
+        "table_name": "entity",
+        "field_name": "json",
+        "json_schema": {
+            "required": ["listed-building-grade", "entity"],
+            "properties": {
+                "listed-building-grade": {"type": "string", "enum": ["I", "II"]},
+                "notes": {"type": "string", "format": "date"},
+                "description": {"type": "integer", "equals_field": "entity"},
+            },
+            "additionalProperties": False,
+        },
+        "ref_fields": ["entity"],
+    }
+
+    [spatialite_response] = run_suite(query_runner, [expectation])
+    with QueryRunner(parquet_dataset, backend="duckdb") as duckdb_query_runner:
+        [duckdb_response] = run_suite(duckdb_query_runner, [expectation])
+
+    assert duckdb_response.details["violations_per_rule"] == {
+        "required:entity": 465,
+        "enum:listed-building-grade": 49,
+        "format:notes": 465,
+        "type:description": 465,
+        "equals_field:description": 465,
+    }
+    assert duckdb_response.details == spatialite_response.details
+
+
+def test_geoshapes_validity_in_the_dialect_of_the_backend(parquet_dataset):
+    expectation = {
+        "expectation_name": "expect_geoshapes_to_be_valid",
+        "table_name": "entity",
+        "shape_field": "geometry",
+        "ref_fields": ["entity"],
+    }
+
+    with QueryRunner(parquet_dataset, backend="duckdb") as duckdb_query_runner:
+        # DuckDB doesn't flatten subqueries and rejects a negative LIMIT
+        sql_query = _invalid_shapes_query(
+            duckdb_query_runner, "entity", "geometry", ["entity"]
+        )
+        assert "LIMIT" not in sql_query
+        if (
+            duckdb_query_runner.run_query(
+                "SELECT COUNT(*) AS n FROM duckdb_extensions() WHERE extension_name = 'spatial' AND loaded;"
+            )["n"][0]
+            == 0
+        ):
+            pytest.skip("DuckDB's spatial extension is not installed")
+        [duckdb_response] = run_suite(duckdb_query_runner, [expectation])
+    [spatialite_response] = run_suite(query_runner, [expectation])
+
+    assert duckdb_response.result == spatialite_response.result == True
+    assert duckdb_response.details == spatialite_response.details
+
+
+def test_compile_fused_scan_in_the_dialect_of_the_backend():
+    fused_scan = FusedScan("entity", list(enumerate(suite_expectations[6:8])))
+
+    spatialite_sql, _ = compile_fused_scan(fused_scan)
+    duckdb_sql, _ = compile_fused_scan(fused_scan, make_backend("duckdb"))
+
+    assert "json_remove(json, '$.name')" in spatialite_sql
+    assert "TRY_CAST(reference AS DOUBLE)" not in spatialite_sql
+    assert "json_keys(json)" in duckdb_sql
+    assert "TRY_CAST(reference AS DOUBLE)" in duckdb_sql
+
+
+def test_geometry_metrics_in_the_dialect_of_the_backend():
+    duckdb_backend = make_backend("duckdb")
+
+    assert make_backend("spatialite").geometry_metric("min_x", "g") == "MbrMinX(g)"
+    assert duckdb_backend.geometry_metric("min_x", "g") == "ST_XMin(g)"
+    # DuckDB geometries carry no SRID
+    with pytest.raises(ValueError, match="'srid' is not supported"):
+        duckdb_backend.geometry_metric("srid", "g")
+
+
+def test_backend_choices():
+    assert make_backend("spatialite").supports_sampling
+    # a backend must at least open connections and attach databases
+    with pytest.raises(TypeError):
+        Backend()
+    with pytest.raises(ValueError):
+        make_backend("postgres")
+    with pytest.raises(ValueError):
+        QueryRunner(tested_dataset, backend="duckdb", sample={"fraction": 0.1})
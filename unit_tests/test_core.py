@@ -1,4 +1,7 @@
 import pandas as pd
+import pytest
+import sqlite3
+import threading
 from core import *
 
 
@@ -99,3 +102,87 @@ def test_config_parser():
     }
 
     assert result == expected_dictionary
+
+
+def test_query_runner_reuses_connection_per_thread():
+    tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+    with QueryRunner(tested_dataset) as query_runner:
+        first_connection = query_runner.get_connection()
+        query_runner.run_query("SELECT COUNT(*) FROM entity;")
+        query_runner.run_query("SELECT COUNT(*) FROM fact;")
+        assert query_runner.get_connection() is first_connection
+
+        other_thread_connections = []
+        thread = threading.Thread(
+            target=lambda: other_thread_connections.append(
+                query_runner.get_connection()
+            )
+        )
+        thread.start()
+        thread.join()
+        assert other_thread_connections[0] is not first_connection
+
+    assert query_runner._connections == []
+
+
+def test_query_runner_is_read_only():
+    tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+    with QueryRunner(tested_dataset) as query_runner:
+        with pytest.raises(sqlite3.OperationalError):
+            query_runner.run_query("DELETE FROM entity;")
+
+
+def test_query_runner_iter_query_yields_bounded_batches():
+    tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+    with QueryRunner(tested_dataset) as query_runner:
+        batches = list(
+            query_runner.iter_query("SELECT entity FROM entity;", batch_size=100)
+        )
+        assert [len(batch) for batch in batches] == [100, 100, 100, 100, 65]
+        assert isinstance(batches[0][0], tuple)
+
+        frames = list(
+            query_runner.iter_query(
+                "SELECT entity, reference FROM entity;",
+                batch_size=200,
+                as_dataframe=True,
+            )
+        )
+        assert [len(frame) for frame in frames] == [200, 200, 65]
+        assert list(frames[0].columns) == ["entity", "reference"]
+
+
+def test_query_runner_samples_a_rowid_stride():
+    tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+    with QueryRunner(tested_dataset, sample={"fraction": 0.1}) as query_runner:
+        sampled = query_runner.run_query(
+            f"SELECT entity FROM {query_runner.table_source('entity')};"
+        )
+        assert len(sampled) == 47
+        assert sampled["entity"].tolist()[:3] == [42114488, 42114498, 42114508]
+
+        report = query_runner.sample_report("entity", 2)
+        assert report["stride"] == 10
+        assert report["sampled_rows"] == 47
+        assert report["table_rows"] == 465
+        assert report["estimated_violations"] == 20
+        lower, upper = report["violation_rate_95_interval"]
+        assert lower < 2 / 47 < upper
+
+    with QueryRunner(tested_dataset, sample={"rows": 100}) as query_runner:
+        assert query_runner.sample_report("entity", 0)["sampled_rows"] == 93
+
+    with QueryRunner(tested_dataset) as query_runner:
+        assert query_runner.table_source("entity") == "entity"
+        assert query_runner.sample_report("entity", 0) is None
+
+    with pytest.raises(ValueError):
+        QueryRunner(tested_dataset, sample={"fraction": 2})
+
+
+def test_wilson_interval():
+    assert wilson_interval(0, 0) == [None, None]
+    lower, upper = wilson_interval(0, 100)
+    assert lower == 0.0 and 0.03 < upper < 0.04
+    lower, upper = wilson_interval(50, 100)
+    assert round(lower, 3) == 0.404 and round(upper, 3) == 0.596
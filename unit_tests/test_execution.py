@@ -0,0 +1,68 @@
+import pytest
+from execution import *
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+suite_expectations = [
+    {
+        "expectation_name": "expect_table_row_count_to_be_in_range",
+        "table_name": "entity",
+        "min_expected_row_count": 400,
+        "max_expected_row_count": 500,
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "reference",
+        "min_expected_value": 1021466,
+        "max_expected_value": 1300000,
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_values_for_field_to_be_unique",
+        "table_name": "fact",
+        "fields": ["fact"],
+    },
+    {
+        "expectation_name": "expect_keys_in_json_field_to_be_in_set_of_options",
+        "table_name": "entity",
+        "field_name": "json",
+        "ref_fields": ["entity"],
+        "expected_keys_set": ["name"],
+    },
+]
+
+
+@pytest.mark.parametrize("executor", EXECUTORS)
+@pytest.mark.parametrize("fuse_scans", [False, True])
+def test_run_suite_with_pool_matches_sequential_run(executor, fuse_scans):
+    "Concurrent runs give the same responses, in the order of the suite"
+    sequential_responses = list(
+        run_suite(
+            query_runner,
+            suite_expectations,
+            data_quality_execution_time="20220101_000000",
+        )
+    )
+
+    with make_executor(executor, 3) as pool:
+        concurrent_responses = list(
+            run_suite(
+                query_runner,
+                suite_expectations,
+                fuse_scans=fuse_scans,
+                pool=pool,
+                data_quality_execution_time="20220101_000000",
+            )
+        )
+
+    assert [response.to_dict() for response in concurrent_responses] == [
+        response.to_dict() for response in sequential_responses
+    ]
+
+
+def test_make_executor_unknown_executor():
+    with pytest.raises(ValueError):
+        make_executor("cluster", 2)
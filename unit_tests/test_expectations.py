@@ -1,5 +1,6 @@
 import pandas as pd
 from expectations import *
+from expectations import _point_coordinates
 
 # Shared testing resources
 tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
@@ -354,6 +355,34 @@ def test_row_count_grouped_by_field_Fail():
     ]
 
 
+def test_row_count_grouped_by_field_from_csv(tmp_path):
+    "Ranges read from a csv file, values not found are not flagged"
+    csv_path = tmp_path / "count_ranges.csv"
+    csv_path.write_text(
+        "lookup_value,min_row_count,max_row_count\n"
+        "42114488,8,10\n"
+        "42114490,6,8\n"
+        "not-an-entity,1,2\n"
+    )
+
+    response = expect_row_count_for_lookup_value_to_be_in_range(
+        query_runner=query_runner,
+        table_name="fact",
+        field_name="entity",
+        count_ranges_csv_path=str(csv_path),
+    )
+
+    assert response.result == False
+    assert response.details == [
+        {
+            "lookup_value": "42114490",
+            "min_row_count": 6,
+            "max_row_count": 8,
+            "rows_found": 9,
+        }
+    ]
+
+
 def test_check_field_values_within_expected_set_of_values_No_unexpected_value():
     "Returns True as all values are within the expected set (but not full expected set is found)"
     table_name = "fact"
@@ -417,28 +446,7 @@ def test_check_field_values_within_expected_set_of_values_One_unexpected_value()
     )
     assert response.details == {
         "table": "fact",
-        "expected_values": {
-            "not_present_value",
-            "name",
-            "description",
-            "organisation",
-            "reference",
-            "listed-building-grade",
-            "prefix",
-            "notes",
-            "geometry",
-        },
-        "found_values": {
-            "name",
-            "entry-date",
-            "description",
-            "organisation",
-            "reference",
-            "listed-building-grade",
-            "prefix",
-            "notes",
-            "geometry",
-        },
+        "unexpected_values": [{"value": "entry-date", "rows_found": 465}],
     }
 
 
@@ -478,29 +486,8 @@ def test_check_field_values_within_expected_set_of_values_Not_found_entire_expec
     )
     assert response.details == {
         "table": "fact",
-        "expected_values": {
-            "not_present_value",
-            "description",
-            "listed-building-grade",
-            "reference",
-            "geometry",
-            "notes",
-            "entry-date",
-            "organisation",
-            "prefix",
-            "name",
-        },
-        "found_values": {
-            "description",
-            "listed-building-grade",
-            "reference",
-            "geometry",
-            "notes",
-            "entry-date",
-            "organisation",
-            "prefix",
-            "name",
-        },
+        "unexpected_values": [],
+        "missing_expected_values": ["not_present_value"],
     }
 
 
@@ -536,6 +523,24 @@ def test_check_field_values_within_expected_set_of_values_Entire_expected_set_fo
     assert response.details == None
 
 
+def test_check_field_values_within_expected_set_of_values_compared_like_sqlite():
+    "Expected values are compared in sql, NULL (None) is never found in the field"
+    response = expect_field_values_to_be_within_set(
+        query_runner,
+        table_name="fact",
+        field_name="reference_entity",
+        expected_values_set={"", 700000, None},
+        fail_if_not_found_entire_expected_set=True,
+    )
+
+    assert response.result == False
+    assert response.details == {
+        "table": "fact",
+        "unexpected_values": [{"value": "700002", "rows_found": 430}],
+        "missing_expected_values": [None],
+    }
+
+
 def test_check_uniqueness_field_set_of_fields_True():
     """Test uniqueness with combination field that is unique.
     Should return True for uniqueness test
@@ -634,6 +639,102 @@ def test_check_geo_shapes_are_valid_False():
     assert response.details == {"invalid_shapes": [{"entity": 303443, "is_valid": 0}]}
 
 
+def test_check_points_within_expected_shapes_True():
+    "Points inside the shapes of two listed buildings"
+    probes = [
+        {"point": "POINT(-2.2761306 51.8282115)", "expected_value": 42114488},
+        {"point": "POINT(-2.2692493 51.821327)", "expected_value": "42114489"},
+    ]
+
+    response = expect_points_to_be_within_expected_shapes(
+        query_runner, "entity", "geometry", "entity", probes, only_expected_shapes=True
+    )
+
+    assert response.result == True
+    assert response.details == None
+
+
+def test_check_points_within_expected_shapes_False():
+    "A point in the shape of another building, a point in none"
+    probes = [
+        {"point": "POINT(-2.2761306 51.8282115)", "expected_value": 42114488},
+        {"point": "POINT(-2.2692493 51.821327)", "expected_value": 42114488},
+        {"point": "POINT(0 51.5)", "expected_value": 42114488},
+    ]
+
+    response = expect_points_to_be_within_expected_shapes(
+        query_runner, "entity", "geometry", "entity", probes
+    )
+
+    assert response.result == False
+    assert response.details == {
+        "failed_probes": [
+            {
+                "point": "POINT(-2.2692493 51.821327)",
+                "expected_value": "42114488",
+                "found_values": ["42114489"],
+            },
+            {
+                "point": "POINT(0 51.5)",
+                "expected_value": "42114488",
+                "found_values": [],
+            },
+        ]
+    }
+
+
+def test_check_points_within_expected_shapes_from_csv(tmp_path):
+    "Probes read from a csv file"
+    csv_path = tmp_path / "probes.csv"
+    csv_path.write_text(
+        "point,expected_value\n"
+        '"POINT(-2.2761306 51.8282115)",42114488\n'
+        '"POINT(-2.2692493 51.821327)",42114490\n'
+    )
+
+    response = expect_points_to_be_within_expected_shapes(
+        query_runner=query_runner,
+        table_name="entity",
+        shape_field="geometry",
+        ref_field="entity",
+        probes_csv_path=str(csv_path),
+    )
+
+    assert response.result == False
+    assert response.details == {
+        "failed_probes": [
+            {
+                "point": "POINT(-2.2692493 51.821327)",
+                "expected_value": "42114490",
+                "found_values": ["42114489"],
+            }
+        ]
+    }
+
+
+def test_point_coordinates_are_read_from_the_wkt():
+    assert _point_coordinates("POINT(-2.2761306 51.8282115)") == (
+        -2.2761306,
+        51.8282115,
+    )
+    assert _point_coordinates(" point ( 1 2 ) ") == (1.0, 2.0)
+    assert _point_coordinates("POINT(a b)") == (None, None)
+    assert _point_coordinates("LINESTRING(0 0, 1 1)") == (None, None)
+    # a probe that isn't a point is within no shape
+    response = expect_points_to_be_within_expected_shapes(
+        query_runner,
+        "entity",
+        "geometry",
+        "entity",
+        [{"point": "not a point", "expected_value": 42114488}],
+    )
+    assert response.details == {
+        "failed_probes": [
+            {"point": "not a point", "expected_value": "42114488", "found_values": []}
+        ]
+    }
+
+
 def test_check_json_values_for_key_within_expected_set_True():
     "Test case where all values found are within expected"
     table_name = "entity"
@@ -978,3 +1079,215 @@ def test_check_custom_query_expectataion_Fail():
             },
         ],
     }
+
+
+def test_check_geo_shapes_are_valid_with_validity_cache(tmp_path):
+    """Shapes are validated on the first run and read from the cache after"""
+    tested_dataset = "unit_tests/testing_dataset/five_valid_multipolygons.sqlite3"
+    query_runner = QueryRunner(tested_dataset)
+    validity_cache_path = str(tmp_path / "validity_cache.sqlite3")
+
+    table_name = "five_valid_multipolygons"
+    shape_field = "geometry"
+    ref_fields = ["entity"]
+
+    first_response = expect_geoshapes_to_be_valid(
+        query_runner,
+        table_name,
+        shape_field,
+        ref_fields,
+        validity_cache_path=validity_cache_path,
+    )
+    second_response = expect_geoshapes_to_be_valid(
+        query_runner,
+        table_name,
+        shape_field,
+        ref_fields,
+        validity_cache_path=validity_cache_path,
+    )
+
+    assert first_response.result == True
+    assert first_response.details == {
+        "validity_cache": {
+            "shapes": 5,
+            "cache_hits": 0,
+            "cache_misses": 5,
+            "hit_ratio": 0.0,
+        }
+    }
+    assert second_response.result == True
+    assert second_response.details == {
+        "validity_cache": {
+            "shapes": 5,
+            "cache_hits": 5,
+            "cache_misses": 0,
+            "hit_ratio": 1.0,
+        }
+    }
+
+
+def test_check_value_for_field_is_within_expected_range_False_with_max_failure_samples():
+    "Stops at the first 5 of the 18 records out of range, count unknown"
+    response = expect_values_in_field_to_be_within_range(
+        query_runner,
+        "entity",
+        "reference",
+        1021466,
+        1300000,
+        ["entity"],
+        max_failure_samples=5,
+    )
+
+    assert response.result == False
+    assert (
+        response.msg
+        == "Fail: found more than 5 values out of the expected range for field 'reference' on table 'entity', see details"
+    )
+    assert len(response.details["records_with_value_out_of_range"]) == 5
+    assert response.details["failures_count"] == None
+    assert response.details["details_truncated"] == True
+
+
+def test_check_value_for_field_is_within_expected_range_False_with_count_failures():
+    "Keeps 5 samples and counts the 18 records out of range"
+    response = expect_values_in_field_to_be_within_range(
+        query_runner,
+        "entity",
+        "reference",
+        1021466,
+        1300000,
+        ["entity"],
+        max_failure_samples=5,
+        count_failures=True,
+    )
+
+    assert response.result == False
+    assert (
+        response.msg
+        == "Fail: found 18 values out of the expected range for field 'reference' on table 'entity', see details"
+    )
+    assert response.details["records_with_value_out_of_range"] == [
+        {"entity": 42114935, "reference": "1303676"},
+        {"entity": 42114936, "reference": "1303751"},
+        {"entity": 42114937, "reference": "1340606"},
+        {"entity": 42114938, "reference": "1340607"},
+        {"entity": 42114939, "reference": "1340608"},
+    ]
+    assert response.details["failures_count"] == 18
+    assert response.details["details_truncated"] == True
+
+
+def test_check_json_keys_are_within_Expected_keys_set_False_count_only():
+    "Only counts the records with non-expected keys"
+    response = expect_keys_in_json_field_to_be_in_set_of_options(
+        query_runner,
+        "entity",
+        "json",
+        {"name"},
+        ["entity"],
+        count_only=True,
+    )
+
+    assert response.result == False
+    assert response.details == {
+        "records_with_non_expected_keys": [],
+        "failures_count": 465,
+        "details_truncated": True,
+    }
+
+
+def test_check_json_values_for_key_within_expected_set_True_with_max_failure_samples():
+    "Bounded mode keeps the success response unchanged"
+    response = expect_values_for_a_key_stored_in_json_are_within_a_set(
+        query_runner,
+        "entity",
+        "json",
+        "listed-building-grade",
+        {"I", "II", "III", "II*"},
+        ["entity"],
+        max_failure_samples=10,
+    )
+
+    assert response.result == True
+    assert response.details == None
+
+
+def test_check_value_for_field_is_within_expected_range_False_sampled():
+    "Every other entity is sampled, 9 of the 18 values out of range are in the sample"
+    sampled_query_runner = QueryRunner(tested_dataset, sample={"fraction": 0.5})
+
+    response = expect_values_in_field_to_be_within_range(
+        sampled_query_runner,
+        table_name="entity",
+        field_name="reference",
+        min_expected_value=1021466,
+        max_expected_value=1300000,
+        ref_fields=["entity"],
+    )
+
+    assert response.result == False
+    assert len(response.details["records_with_value_out_of_range"]) == 9
+    assert response.sample["stride"] == 2
+    assert response.sample["sampled_rows"] == 233
+    assert response.sample["table_rows"] == 465
+    assert response.sample["violations_in_sample"] == 9
+    assert response.sample["estimated_violations"] == 18
+    lower, upper = response.sample["violation_rate_95_interval"]
+    assert lower < 9 / 233 < upper
+
+
+def test_check_field_values_within_expected_set_of_values_sampled():
+    "The rows with the unexpected value 'entry-date' are counted in the sample"
+    sampled_query_runner = QueryRunner(tested_dataset, sample={"rows": 500})
+
+    response = expect_field_values_to_be_within_set(
+        sampled_query_runner,
+        table_name="fact",
+        field_name="field",
+        expected_values_set={
+            "organisation",
+            "reference",
+            "listed-building-grade",
+            "geometry",
+            "prefix",
+            "notes",
+            "name",
+            "description",
+        },
+    )
+
+    entry_dates_in_sample = sampled_query_runner.run_query(
+        f"""SELECT COUNT(*) AS n FROM {sampled_query_runner.table_source('fact')}
+            WHERE field = 'entry-date';"""
+    )["n"][0]
+    assert response.result == False
+    assert response.details["unexpected_values"] == [
+        {"value": "entry-date", "rows_found": entry_dates_in_sample}
+    ]
+    assert response.sample["violations_in_sample"] == entry_dates_in_sample > 0
+    assert response.sample["sampled_rows"] <= 500
+
+
+def test_check_field_values_expected_set_entirely_found_sampled():
+    "Expected values outside the sample are still found in the table"
+    entities = set(query_runner.run_query("SELECT entity FROM entity;")["entity"])
+    sampled_query_runner = QueryRunner(tested_dataset, sample={"rows": 50})
+
+    exact_response = expect_field_values_to_be_within_set(
+        query_runner,
+        table_name="fact",
+        field_name="entity",
+        expected_values_set=entities,
+        fail_if_not_found_entire_expected_set=True,
+    )
+    response = expect_field_values_to_be_within_set(
+        sampled_query_runner,
+        table_name="fact",
+        field_name="entity",
+        expected_values_set=entities,
+        fail_if_not_found_entire_expected_set=True,
+    )
+
+    assert exact_response.result == response.result == True
+    assert response.details == exact_response.details == None
+    assert response.sample["violations_in_sample"] == 0
@@ -0,0 +1,169 @@
+import json
+from explain import *
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = ExplainQueryRunner(tested_dataset)
+
+suite_expectations = [
+    {
+        "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+        "table_name": "fact",
+        "field_name": "entity",
+        "count_ranges_per_value": [
+            {"lookup_value": "42114488", "min_row_count": 1, "max_row_count": 9},
+        ],
+    },
+    {
+        "expectation_name": "expect_geoshapes_to_be_valid",
+        "table_name": "entity",
+        "shape_field": "geometry",
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_values_for_field_to_be_unique",
+        "table_name": "fact_resource",
+        "fields": ["fact", "resource"],
+    },
+    {
+        "expectation_name": "expect_custom_query_result_to_be_as_predicted",
+        "custom_query": "SELECT entity FROM missing_table;",
+        "expected_query_result": [],
+    },
+]
+
+
+def test_explain_suite_ranks_expectations_by_estimated_cost():
+    report = explain_suite(query_runner, suite_expectations)
+
+    assert [entry["positions"] for entry in report] == [[1], [2], [0], [3]]
+    assert report[0]["flags"] == [
+        "full scan of entity (~465 rows)",
+        "geometry parsed for every scanned row",
+    ]
+    assert report[1]["flags"] == [
+        "full scan of fact_resource (~4401 rows)",
+        "temporary b-tree for GROUP BY of ~4401 rows",
+    ]
+    # counting the rows of a lookup value only searches the index on entity
+    assert report[2]["flags"] == ["temporary b-tree for ORDER BY of ~1 rows"]
+    assert (
+        "SEARCH fact USING COVERING INDEX fact_on_entity_index (entity=?)"
+        in report[2]["queries"][0]["plan"]
+    )
+    assert report[0]["estimated_seconds"] == (
+        report[0]["estimated_cost"] * ROW_READ_SECONDS
+    )
+    # a query that can't be planned is reported, not raised
+    assert report[3]["estimated_cost"] == 0
+    assert "no such table: missing_table" in report[3]["queries"][0]["error"]
+
+
+def test_explain_suite_reports_expectations_that_stop():
+    expectations = [
+        {"expectation_name": "expect_table_to_be_fast", "table_name": "entity"},
+        {
+            "expectation_name": "expect_json_field_to_match_schema",
+            "table_name": "entity",
+            "field_name": "json",
+            "json_schema": {"properties": {"notes": {"pattern": "^N"}}},
+            "ref_fields": ["entity"],
+        },
+    ]
+
+    report = explain_suite(query_runner, expectations)
+
+    assert [entry["error"] for entry in report] == [
+        "AttributeError: module 'expectations' has no attribute 'expect_table_to_be_fast'",
+        "ValueError: unsupported keywords ['pattern'] for the key 'notes'",
+    ]
+    assert (
+        "- stopped before its end: ValueError: unsupported keywords"
+        in format_explain_report("listed-building", report)
+    )
+
+
+def test_explain_suite_with_fused_scans():
+    expectations = suite_expectations[:2] + [
+        {
+            "expectation_name": "expect_values_in_field_to_be_within_range",
+            "table_name": "entity",
+            "field_name": "reference",
+            "min_expected_value": 1021466,
+            "max_expected_value": 1300000,
+            "ref_fields": ["entity"],
+        },
+    ]
+
+    report = explain_suite(query_runner, expectations, fuse_scans=True)
+
+    assert report[0]["positions"] == [1, 2]
+    assert len(report[0]["queries"]) == 1
+
+
+def test_estimate_plan_cost_of_nested_loops():
+    sql_query = "SELECT e.entity FROM entity e JOIN fact f ON f.entity = e.entity;"
+    plan = [
+        (3, 0, 0, "SCAN e"),
+        (7, 0, 0, "SEARCH f USING INDEX fact_on_entity_index (entity=?)"),
+    ]
+
+    cost, flags = estimate_plan_cost(query_runner.statistics, sql_query, plan)
+
+    # one index lookup in fact per entity
+    assert flags == ["full scan of entity (~465 rows)"]
+    assert 465 < cost < 465 * 20
+
+
+def test_save_explain_report(tmp_path):
+    report = explain_suite(query_runner, suite_expectations[:1])
+
+    file_path = save_explain_report(str(tmp_path), "20220101_000000", report)
+
+    assert file_path == str(tmp_path / "20220101_000000_explain.json")
+    with open(file_path) as f:
+        assert json.load(f) == report
+    assert format_explain_report("listed-building", report).startswith(
+        "listed-building: estimated 0.0s (rough)"
+    )
+
+
+def test_explain_point_lookups_plans_the_spatial_index_build():
+    expectation = {
+        "expectation_name": "expect_points_to_be_within_expected_shapes",
+        "table_name": "entity",
+        "shape_field": "geometry",
+        "ref_field": "entity",
+        "probes": [{"point": "POINT(0 51.5)", "expected_value": 42114488}],
+    }
+
+    [entry] = explain_suite(query_runner, [expectation])
+
+    # the shapes are parsed once to build the index, the probes search it
+    build, lookup = entry["queries"]
+    assert build["flags"] == [
+        "full scan of entity (~465 rows)",
+        "geometry parsed for every scanned row",
+    ]
+    assert lookup["plan"][:2] == [
+        "SCAN probes",
+        "SCAN boxes VIRTUAL TABLE INDEX 2:B0D1B2D3",
+    ]
+    assert lookup["flags"] == []
+
+
+def test_explain_suite_explains_the_queries_of_every_shard():
+    expectation = {**suite_expectations[1], "shards": 4}
+
+    [entry] = explain_suite(query_runner, [expectation])
+
+    assert entry["error"] is None
+    assert len(entry["queries"]) == 4
+    # each shard searches its range of rowids, validating its shapes
+    assert "rowid BETWEEN 42114488 AND 42114604" in entry["queries"][0]["sql"]
+    assert all(
+        "SEARCH entity USING INTEGER PRIMARY KEY (rowid>? AND rowid<?)" in query["plan"]
+        for query in entry["queries"]
+    )
+    assert entry["estimated_cost"] == sum(query["cost"] for query in entry["queries"])
+    assert entry["estimated_cost"] > 0
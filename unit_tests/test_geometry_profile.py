@@ -0,0 +1,130 @@
+import pytest
+import sqlite3
+from geometry_profile import *
+from expectations import expect_geoshapes_to_match_profile
+from execution import run_suite
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+england_profile = {
+    "area": {"min": 1e-12, "max": 1e-3},
+    "min_x": {"min": -6.5},
+    "max_x": {"max": 1.8},
+    "min_y": {"min": 49.8},
+    "max_y": {"max": 55.9},
+    "vertices": {"max": 50},
+    "srid": {"min": 0, "max": 0},
+}
+
+
+def test_geoshapes_match_profile_but_for_the_vertices():
+    response = expect_geoshapes_to_match_profile(
+        query_runner=query_runner,
+        table_name="entity",
+        shape_field="geometry",
+        metric_ranges=england_profile,
+        ref_fields=["entity"],
+        max_failure_samples=2,
+    )
+
+    assert response.result == False
+    assert response.details == {
+        "records_with_violations": 15,
+        "violations_per_metric": {"vertices": 15},
+        "samples_per_metric": {
+            "vertices": [
+                {"entity": 42114509, "value": 64},
+                {"entity": 42114572, "value": 53},
+            ]
+        },
+    }
+
+
+def test_geoshapes_match_profile_True():
+    response = expect_geoshapes_to_match_profile(
+        query_runner=query_runner,
+        table_name="entity",
+        shape_field="geometry",
+        metric_ranges={**england_profile, "vertices": {"min": 4, "max": 1000}},
+        ref_fields=["entity"],
+    )
+
+    assert response.result == True
+    assert response.details is None
+
+
+def test_violations_are_counted_per_metric(tmp_path):
+    dataset_path = str(tmp_path / "dataset.sqlite3")
+    con = sqlite3.connect(dataset_path)
+    con.execute("CREATE TABLE thing (ref INTEGER, geometry TEXT);")
+    con.executemany(
+        "INSERT INTO thing VALUES (?, ?);",
+        [
+            (1, "POLYGON((-1 51,-0.9 51,-0.9 51.1,-1 51.1,-1 51))"),
+            # a point has no area
+            (2, "POINT(-1 51)"),
+            # in metres (British National Grid) rather than degrees
+            (3, "POLYGON((530000 180000,530100 180000,530100 180100,530000 180000))"),
+            (4, "not a shape"),
+            (5, None),
+        ],
+    )
+    con.commit()
+    con.close()
+
+    with QueryRunner(dataset_path) as dataset_query_runner:
+        response = expect_geoshapes_to_match_profile(
+            query_runner=dataset_query_runner,
+            table_name="thing",
+            shape_field="geometry",
+            metric_ranges={
+                "area": {"min": 1e-12, "max": 1},
+                "max_x": {"max": 1.8},
+                "min_y": {"min": 49.8, "max": 55.9},
+            },
+            ref_fields=["ref"],
+        )
+
+    assert response.details == {
+        "records_with_violations": 3,
+        "violations_per_metric": {"parse": 1, "area": 2, "max_x": 1, "min_y": 1},
+        "samples_per_metric": {
+            "parse": [{"ref": 4}],
+            "area": [{"ref": 2, "value": 0.0}, {"ref": 3, "value": 5000.0}],
+            "max_x": [{"ref": 3, "value": 530100.0}],
+            "min_y": [{"ref": 3, "value": 180000.0}],
+        },
+    }
+
+
+def test_parsed_geometries_give_the_same_response():
+    expectation = {
+        "expectation_name": "expect_geoshapes_to_match_profile",
+        "table_name": "entity",
+        "shape_field": "geometry",
+        "metric_ranges": england_profile,
+        "ref_fields": ["entity"],
+    }
+    expected_response = expect_geoshapes_to_match_profile(query_runner, **expectation)
+
+    with QueryRunner(tested_dataset) as parsing_query_runner:
+        responses = list(
+            run_suite(
+                parsing_query_runner,
+                [expectation, expectation],
+                parse_geometries=True,
+                collect_metrics=True,
+            )
+        )
+
+    assert responses[0].details == expected_response.details
+    assert responses[1].metrics["geometry_parse"]["members"] == 2
+
+
+def test_invalid_metric_ranges_are_rejected():
+    with pytest.raises(ValueError, match="must have a min and/or a max"):
+        compile_metric_ranges(query_runner.backend, {"area": {"above": 0}}, "shape")
+    with pytest.raises(ValueError, match="'perimeter' is not supported"):
+        compile_metric_ranges(query_runner.backend, {"perimeter": {"max": 1}}, "shape")
@@ -0,0 +1,96 @@
+from incremental import *
+from planner import run_expectation
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+expectation = {
+    "expectation_name": "expect_values_in_field_to_be_within_range",
+    "table_name": "entity",
+    "field_name": "reference",
+    "min_expected_value": 1021466,
+    "max_expected_value": 1300000,
+    "ref_fields": ["entity"],
+}
+
+
+def test_table_fingerprint_is_stable():
+    fingerprint = table_fingerprint(query_runner, "entity")
+
+    assert fingerprint == table_fingerprint(query_runner, "entity")
+    assert fingerprint["row_count"] == 465
+    assert fingerprint["max_rowid"] == 42114952
+
+
+def test_referenced_tables_of_custom_query():
+    custom_query_expectation = {
+        "expectation_name": "expect_custom_query_result_to_be_as_predicted",
+        "custom_query": "SELECT entity FROM Entity WHERE reference = '1'",
+    }
+
+    assert referenced_tables(query_runner, custom_query_expectation) == [
+        "sqlite_master",
+        "entity",
+    ]
+
+
+def test_incremental_state_reuses_unchanged_expectations(tmp_path):
+    "A recorded response is reused (marked cached) on the next run"
+    results_path = str(tmp_path) + "/"
+    first_run_state = IncrementalState(results_path)
+    assert first_run_state.cached_response(query_runner, expectation) is None
+
+    response = run_expectation(
+        query_runner=query_runner,
+        data_quality_execution_time="20220101_000000",
+        **expectation,
+    )
+    first_run_state.record(query_runner, expectation, response)
+    first_run_state.save()
+
+    cached_response = IncrementalState(results_path).cached_response(
+        query_runner, expectation, data_quality_execution_time="20220102_000000"
+    )
+    assert cached_response.cached == True
+    assert cached_response.cached_from == "20220101_000000"
+    assert cached_response.data_quality_execution_time == "20220102_000000"
+    assert cached_response.result == False
+    assert cached_response.msg == response.msg
+    assert cached_response.details == response.details
+
+    changed_expectation = {**expectation, "max_expected_value": 1500000}
+    assert (
+        IncrementalState(results_path).cached_response(
+            query_runner, changed_expectation
+        )
+        is None
+    )
+    assert (
+        IncrementalState(results_path, force=True).cached_response(
+            query_runner, expectation
+        )
+        is None
+    )
+
+
+def test_editing_an_input_file_invalidates_the_response(tmp_path):
+    csv_path = tmp_path / "count_ranges.csv"
+    csv_path.write_text("lookup_value,min_row_count,max_row_count\n42114488,8,10\n")
+    csv_expectation = {
+        "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+        "table_name": "fact",
+        "field_name": "entity",
+        "count_ranges_csv_path": str(csv_path),
+    }
+    state = IncrementalState(str(tmp_path) + "/")
+    state.record(
+        query_runner,
+        csv_expectation,
+        run_expectation(query_runner=query_runner, **csv_expectation),
+    )
+    assert state.cached_response(query_runner, csv_expectation).cached == True
+
+    csv_path.write_text("lookup_value,min_row_count,max_row_count\n42114488,1,2\n")
+
+    assert state.cached_response(query_runner, csv_expectation) is None
@@ -0,0 +1,181 @@
+import os
+from indexes import *
+from execution import make_executor, run_suite
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+suite_expectations = [
+    {
+        "expectation_name": "expect_values_for_field_to_be_unique",
+        "table_name": "fact_resource",
+        "fields": ["fact", "resource"],
+    },
+    {
+        "expectation_name": "expect_values_for_field_to_be_unique",
+        "table_name": "fact_resource",
+        "fields": ["resource", "fact"],
+    },
+    {
+        "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+        "table_name": "fact",
+        "field_name": "entity",
+        "count_ranges_per_value": [
+            {"lookup_value": "42114488", "min_row_count": 1, "max_row_count": 10},
+        ],
+    },
+    {
+        "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+        "table_name": "fact",
+        "field_name": "entity",
+        "count_ranges_per_value": [
+            {"lookup_value": "42114489", "min_row_count": 1, "max_row_count": 20},
+        ],
+    },
+]
+
+
+def test_grouping_key():
+    assert grouping_key(suite_expectations[0]) == grouping_key(suite_expectations[1])
+    assert grouping_key(suite_expectations[2]) == ("fact", ("entity",))
+    assert (
+        grouping_key(
+            {"expectation_name": "expect_table_row_count_to_be_in_range"},
+        )
+        is None
+    )
+
+
+def test_has_covering_index():
+    assert has_covering_index(query_runner, "fact", ["entity"])
+    # the index sqlite creates for the primary key
+    assert has_covering_index(query_runner, "fact", ["fact"])
+    # INTEGER PRIMARY KEY
+    assert has_covering_index(query_runner, "entity", ["entity"])
+    # fact_resource is only indexed on fact
+    assert not has_covering_index(query_runner, "fact_resource", ["fact", "resource"])
+
+
+def test_provisioned_indexes_give_the_same_responses():
+    expected_responses = list(
+        run_suite(
+            query_runner,
+            suite_expectations,
+            data_quality_execution_time="20220101_000000",
+        )
+    )
+    dataset_modified = os.path.getmtime(tested_dataset)
+
+    with QueryRunner(tested_dataset) as provisioned_query_runner:
+        responses = list(
+            run_suite(
+                provisioned_query_runner,
+                suite_expectations,
+                provision_indexes=True,
+                collect_metrics=True,
+                data_quality_execution_time="20220101_000000",
+            )
+        )
+        scratch_path = provisioned_query_runner.scratch["path"]
+        # fact is already indexed on entity
+        assert list(provisioned_query_runner.scratch["tables"]) == [
+            "fact_resource(fact,resource)"
+        ]
+        plan = provisioned_query_runner.run_query(
+            "EXPLAIN QUERY PLAN SELECT resource, fact, COUNT(*) FROM "
+            + provisioned_query_runner.grouping_source(
+                "fact_resource", ["resource", "fact"]
+            )
+            + " GROUP BY resource, fact;"
+        )
+        assert plan["detail"].tolist() == [
+            "SCAN fact_resource USING COVERING INDEX grouping_0_index"
+        ]
+
+    assert [response.result for response in responses] == [False, False, True, True]
+    for response, expected_response in zip(responses, expected_responses):
+        assert response.details == expected_response.details
+    # the build is counted against both expectations reading the index
+    assert responses[0].metrics["index_build"]["members"] == 2
+    assert "index_build" not in responses[2].metrics
+    assert os.path.getmtime(tested_dataset) == dataset_modified
+    assert not os.path.exists(scratch_path)
+
+
+def test_a_single_expectation_per_key_gets_no_index():
+    with QueryRunner(tested_dataset) as provisioned_query_runner:
+        list(
+            run_suite(
+                provisioned_query_runner,
+                suite_expectations[:1],
+                provision_indexes=True,
+            )
+        )
+        assert provisioned_query_runner.scratch is None
+
+
+def test_process_workers_read_the_scratch_database():
+    with QueryRunner(tested_dataset) as provisioned_query_runner:
+        with make_executor("process", 2) as pool:
+            responses = list(
+                run_suite(
+                    provisioned_query_runner,
+                    suite_expectations,
+                    pool=pool,
+                    provision_indexes=True,
+                    collect_metrics=True,
+                )
+            )
+
+    assert [response.result for response in responses] == [False, False, True, True]
+    assert responses[1].metrics["index_build"]["scratch_table"] == "grouping_0"
+
+
+def test_shapes_searched_by_several_point_lookups_are_indexed_once():
+    expectations = [
+        {
+            "expectation_name": "expect_points_to_be_within_expected_shapes",
+            "table_name": "entity",
+            "shape_field": "geometry",
+            "ref_field": "entity",
+            "probes": [
+                {"point": "POINT(-2.2761306 51.8282115)", "expected_value": 42114488}
+            ],
+        },
+        {
+            "expectation_name": "expect_points_to_be_within_expected_shapes",
+            "table_name": "entity",
+            "shape_field": "geometry",
+            "ref_field": "entity",
+            "probes": [
+                {"point": "POINT(-2.2692493 51.821327)", "expected_value": 42114488}
+            ],
+        },
+    ]
+    expected_responses = list(run_suite(query_runner, expectations))
+
+    with QueryRunner(tested_dataset) as provisioned_query_runner:
+        responses = list(
+            run_suite(
+                provisioned_query_runner,
+                expectations,
+                provision_indexes=True,
+                collect_metrics=True,
+            )
+        )
+        assert list(provisioned_query_runner.scratch["tables"]) == [
+            "rtree:entity(geometry)"
+        ]
+        # a box for every shape of entity
+        assert (
+            provisioned_query_runner.run_query(
+                "SELECT COUNT(*) AS n FROM dq_scratch.rtree_0;"
+            )["n"][0]
+            == 465
+        )
+
+    assert [response.result for response in responses] == [True, False]
+    for response, expected_response in zip(responses, expected_responses):
+        assert response.details == expected_response.details
+    assert responses[1].metrics["index_build"]["scratch_table"] == "rtree_0"
@@ -0,0 +1,148 @@
+import pytest
+import sqlite3
+from json_schema import *
+from expectations import expect_json_field_to_match_schema
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+listed_building_schema = {
+    "required": ["listed-building-grade", "notes"],
+    "properties": {
+        "listed-building-grade": {"type": "string", "enum": ["I", "II", "III"]},
+        "description": {"type": "string"},
+        "notes": {"type": "string"},
+    },
+    "additionalProperties": False,
+}
+
+
+def test_json_field_matches_schema_but_for_the_grades():
+    response = expect_json_field_to_match_schema(
+        query_runner=query_runner,
+        table_name="entity",
+        field_name="json",
+        json_schema=listed_building_schema,
+        ref_fields=["entity"],
+        max_failure_samples=2,
+    )
+
+    # the 49 grade II* entities
+    assert response.result == False
+    assert response.details["records_with_violations"] == 49
+    assert response.details["violations_per_rule"] == {"enum:listed-building-grade": 49}
+    assert response.details["samples_per_rule"] == {
+        "enum:listed-building-grade": [
+            {"entity": 42114490, "value": "II*"},
+            {"entity": 42114499, "value": "II*"},
+        ]
+    }
+
+
+def test_json_field_matches_schema_True():
+    schema = {
+        **listed_building_schema,
+        "properties": {
+            **listed_building_schema["properties"],
+            "listed-building-grade": {"enum": ["I", "II", "II*", "III"]},
+        },
+    }
+
+    response = expect_json_field_to_match_schema(
+        query_runner=query_runner,
+        table_name="entity",
+        field_name="json",
+        json_schema=schema,
+        ref_fields=["entity"],
+    )
+
+    assert response.result == True
+    assert response.details is None
+
+
+def test_violations_are_counted_per_rule(tmp_path):
+    dataset_path = str(tmp_path / "dataset.sqlite3")
+    con = sqlite3.connect(dataset_path)
+    con.execute("CREATE TABLE thing (ref INTEGER, code TEXT, json TEXT);")
+    con.executemany(
+        "INSERT INTO thing VALUES (?, ?, ?);",
+        [
+            (1, "a", '{"code": "a", "start-date": "2022-07-31", "size": 1.5}'),
+            (2, "b", '{"code": "c", "start-date": "31/07/2022", "size": 2}'),
+            (3, "c", '{"code": "c", "start-date": "2022-02-30", "size": "big"}'),
+            (4, "d", '{"start-date": null, "colour": "red"}'),
+            (5, "e", "not json"),
+            (6, "f", "[1, 2]"),
+            (7, "g", None),
+        ],
+    )
+    con.commit()
+    con.close()
+    schema = {
+        "required": ["code"],
+        "properties": {
+            "code": {"type": "string", "equals_field": "code"},
+            "start-date": {"type": ["string", "null"], "format": "date"},
+            "size": {"type": "number"},
+        },
+        "additionalProperties": False,
+    }
+
+    with QueryRunner(dataset_path) as dataset_query_runner:
+        response = expect_json_field_to_match_schema(
+            query_runner=dataset_query_runner,
+            table_name="thing",
+            field_name="json",
+            json_schema=schema,
+            ref_fields=["ref"],
+            max_failure_samples=1,
+        )
+
+    assert response.details == {
+        "records_with_violations": 5,
+        "violations_per_rule": {
+            "object": 2,
+            "required:code": 1,
+            "equals_field:code": 1,
+            "format:start-date": 2,
+            "type:size": 1,
+            "additional_keys": 1,
+        },
+        "samples_per_rule": {
+            "object": [{"ref": 5}],
+            "required:code": [{"ref": 4}],
+            "equals_field:code": [{"ref": 2, "value": "c"}],
+            "format:start-date": [{"ref": 2, "value": "31/07/2022"}],
+            "type:size": [{"ref": 3, "value": "string"}],
+            "additional_keys": [{"ref": 4, "value": '{"colour":"red"}'}],
+        },
+    }
+
+
+def test_unsupported_schema_keywords_are_rejected():
+    with pytest.raises(ValueError, match="unsupported keywords \\['pattern'\\]"):
+        CompiledJsonSchema(
+            query_runner.backend, {"properties": {"code": {"pattern": "^[a-z]+$"}}}
+        )
+    with pytest.raises(ValueError, match="unsupported format 'uri'"):
+        CompiledJsonSchema(
+            query_runner.backend, {"properties": {"code": {"format": "uri"}}}
+        )
+
+
+def test_keys_read_by_several_rules_are_extracted_once():
+    schema = CompiledJsonSchema(
+        query_runner.backend,
+        {
+            "required": ["code"],
+            "properties": {"code": {"type": "string", "enum": ["a"]}},
+        },
+    )
+
+    assert [rule["rule"] for rule in schema.rules] == [
+        "required:code",
+        "type:code",
+        "enum:code",
+    ]
+    assert list(schema.extractions) == ["dq_type_0", "dq_value_0"]
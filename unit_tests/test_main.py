@@ -0,0 +1,119 @@
+import os
+import yaml
+from click.testing import CliRunner
+import main
+from core import DataQualityException
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+
+suite = {
+    "collection_name": "listed-building",
+    "expectations": [
+        {
+            "expectation_name": "expect_table_row_count_to_be_in_range",
+            "table_name": "entity",
+            "min_expected_row_count": 400,
+            "max_expected_row_count": 500,
+        },
+        {
+            "expectation_name": "expect_table_row_count_to_be_in_range",
+            "table_name": "entity",
+            "min_expected_row_count": 0,
+            "max_expected_row_count": 10,
+        },
+    ],
+}
+
+
+def _write_yaml(path, content) -> str:
+    with open(path, "w") as f:
+        yaml.dump(content, f)
+    return str(path)
+
+
+def test_manifest_runs_every_collection(tmp_path, monkeypatch):
+    suite_path = _write_yaml(tmp_path / "suite.yaml", suite)
+    manifest_path = _write_yaml(
+        tmp_path / "manifest.yaml",
+        {
+            "collections": [
+                {
+                    "collection_name": "first",
+                    "sqlite_dataset_path": tested_dataset,
+                    "data_quality_yaml": suite_path,
+                },
+                {
+                    "collection_name": "second",
+                    "sqlite_dataset_path": tested_dataset,
+                    "data_quality_yaml": suite_path,
+                },
+            ]
+        },
+    )
+    results_path = str(tmp_path / "results")
+    parsed_configs = []
+    parse_config = main.config_parser
+
+    def config_parser(filepath):
+        parsed_configs.append(filepath)
+        return parse_config(filepath)
+
+    monkeypatch.setattr(main, "config_parser", config_parser)
+
+    result = CliRunner().invoke(
+        main.run_dq_suite,
+        ["--results-path", results_path, "--manifest", manifest_path],
+    )
+
+    # the suite shared by both collections is parsed once (with the manifest)
+    assert parsed_configs == [manifest_path, suite_path]
+    for collection_name in ("first", "second"):
+        assert len(os.listdir(os.path.join(results_path, collection_name))) == 2
+    assert isinstance(result.exception, DataQualityException)
+    assert str(result.exception) == (
+        "One or more expectations with severity RaiseError failed, see results "
+        "for more details (collections: first, second)"
+    )
+
+
+def test_a_collection_that_cannot_run_does_not_stop_the_others(tmp_path):
+    suite_path = _write_yaml(tmp_path / "suite.yaml", suite)
+    manifest_path = _write_yaml(
+        tmp_path / "manifest.yaml",
+        {
+            "collections": [
+                {
+                    "collection_name": "missing-yaml",
+                    "sqlite_dataset_path": tested_dataset,
+                    "data_quality_yaml": str(tmp_path / "missing.yaml"),
+                },
+                {
+                    "collection_name": "missing-dataset",
+                    "sqlite_dataset_path": str(tmp_path / "missing.sqlite3"),
+                    "data_quality_yaml": suite_path,
+                },
+                {
+                    "collection_name": "listed-building",
+                    "sqlite_dataset_path": tested_dataset,
+                    "data_quality_yaml": suite_path,
+                },
+            ]
+        },
+    )
+    results_path = str(tmp_path / "results")
+
+    result = CliRunner().invoke(
+        main.run_dq_suite,
+        ["--results-path", results_path, "--manifest", manifest_path],
+    )
+
+    assert len(os.listdir(os.path.join(results_path, "listed-building"))) == 2
+    assert isinstance(result.exception, DataQualityException)
+    msg = str(result.exception)
+    assert "(collections: listed-building)" in msg
+    assert (
+        "One or more collections could not be run (collections: missing-yaml (FileNotFoundError"
+        in msg
+    )
+    assert "missing-dataset (OperationalError" in msg
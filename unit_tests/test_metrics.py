@@ -0,0 +1,128 @@
+import json
+from contextlib import contextmanager
+from metrics import *
+from core import QueryRunner
+from execution import run_suite
+from serializer import response_to_json
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+suite_expectations = [
+    {
+        "expectation_name": "expect_field_values_to_be_within_set",
+        "table_name": "fact",
+        "field_name": "field",
+        "expected_values_set": ["name", "reference"],
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "entity",
+        "min_expected_value": 0,
+        "max_expected_value": 2**62,
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "reference",
+        "min_expected_value": 1021466,
+        "max_expected_value": 1300000,
+        "ref_fields": ["entity"],
+    },
+]
+
+
+def test_run_suite_collects_metrics_of_every_expectation():
+    responses = list(run_suite(query_runner, suite_expectations, collect_metrics=True))
+
+    # the 7 values of field that are not expected
+    assert responses[0].metrics["rows_fetched"] == 7
+    assert responses[0].metrics["queries"] == 1
+    assert responses[0].metrics["wall_time_s"] > 0
+    assert responses[0].metrics["peak_python_memory_bytes"] is None
+    assert "scan" not in responses[0].metrics
+    # the 18 references out of range
+    assert responses[2].metrics["rows_fetched"] == 18
+    assert list(run_suite(query_runner, suite_expectations))[0].metrics is None
+
+
+def test_fused_scan_members_share_the_scan_metrics():
+    responses = list(
+        run_suite(
+            query_runner, suite_expectations, fuse_scans=True, collect_metrics=True
+        )
+    )
+
+    # both range expectations on entity are fused in one scan
+    passed, failed = responses[1].metrics, responses[2].metrics
+    assert passed["scan"]["members"] == failed["scan"]["members"] == 2
+    assert passed["scan"]["rows_fetched"] == 1
+    assert passed["rows_fetched"] == 0
+    # the failed member was re-run on its own
+    assert failed["rows_fetched"] == 18
+    assert expectation_totals(failed)["rows_fetched"] == 18.5
+
+
+def test_saved_response_sizes_are_summarised_without_modifying_the_responses():
+    response = list(run_suite(query_runner, suite_expectations, collect_metrics=True))[
+        2
+    ]
+    metrics = dict(response.metrics)
+
+    saved = response_to_json(response)
+    summary = RunSummary()
+    summary.add("listed-building", 2, response, len(saved))
+
+    assert response.metrics == metrics
+    assert json.loads(saved)["metrics"] == metrics
+    assert (
+        f'dq_expectation_bytes_serialized{{collection="listed-building",expectation="expect_values_in_field_to_be_within_range",position="2"}} {float(len(saved))!r}'
+        in summary.to_text().splitlines()
+    )
+
+
+def test_run_summary_textfile(tmp_path):
+    summary = RunSummary()
+    responses = run_suite(query_runner, suite_expectations, collect_metrics=True)
+    for position, response in enumerate(responses):
+        summary.add(
+            'listed "building"', position, response, len(response_to_json(response))
+        )
+
+    metrics_path = tmp_path / "dq.prom"
+    summary.write_textfile(str(metrics_path))
+    lines = metrics_path.read_text().splitlines()
+
+    assert "# TYPE dq_run_wall_seconds gauge" in lines
+    assert (
+        'dq_run_expectations{collection="listed \\"building\\"",status="success"} 1.0'
+        in lines
+    )
+    assert (
+        'dq_expectation_rows_fetched{collection="listed \\"building\\"",expectation="expect_values_in_field_to_be_within_range",position="2"} 18.0'
+        in lines
+    )
+    # peak memory is only measured while tracemalloc is tracing
+    assert not any("peak_python_memory" in line for line in lines)
+    assert list(tmp_path.iterdir()) == [metrics_path]
+
+
+def test_span_hook_wraps_expectations_and_queries():
+    spans = []
+
+    @contextmanager
+    def hook(name, attributes):
+        spans.append((name, attributes))
+        yield
+
+    set_span_hook(hook)
+    try:
+        list(run_suite(query_runner, suite_expectations[:1]))
+    finally:
+        set_span_hook(None)
+
+    assert [name for name, _ in spans] == ["dq.expectation", "dq.query"]
+    assert spans[0][1] == {"expectation_name": "expect_field_values_to_be_within_set"}
@@ -0,0 +1,84 @@
+import os
+from parsed_geometries import *
+from execution import run_suite
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+suite_expectations = [
+    {
+        "expectation_name": "expect_geoshapes_to_be_valid",
+        "table_name": "entity",
+        "shape_field": "geometry",
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_points_to_be_within_expected_shapes",
+        "table_name": "entity",
+        "shape_field": "geometry",
+        "ref_field": "entity",
+        "probes": [
+            {"point": "POINT(-2.2761306 51.8282115)", "expected_value": 42114488}
+        ],
+    },
+    {
+        "expectation_name": "expect_points_to_be_within_expected_shapes",
+        "table_name": "entity",
+        "shape_field": "geometry",
+        "ref_field": "entity",
+        "probes": [
+            {"point": "POINT(-2.2692493 51.821327)", "expected_value": 42114488}
+        ],
+    },
+]
+
+
+def test_shape_field_key():
+    assert shape_field_key(suite_expectations[0]) == ("entity", "geometry")
+    assert shape_field_key(suite_expectations[1]) == ("entity", "geometry")
+    # with a validity cache only the new shapes are parsed
+    assert (
+        shape_field_key(
+            {**suite_expectations[0], "validity_cache_path": "validity.sqlite3"}
+        )
+        is None
+    )
+
+
+def test_parsed_geometries_give_the_same_responses():
+    expected_responses = list(run_suite(query_runner, suite_expectations))
+
+    with QueryRunner(tested_dataset) as parsing_query_runner:
+        responses = list(
+            run_suite(
+                parsing_query_runner,
+                suite_expectations,
+                parse_geometries=True,
+                provision_indexes=True,
+                collect_metrics=True,
+            )
+        )
+        scratch_path = parsing_query_runner.scratch["path"]
+        assert list(parsing_query_runner.scratch["tables"]) == [
+            "geometry:entity(geometry)",
+            "rtree:entity(geometry)",
+        ]
+        # the R*Tree is filled from the parsed geometries
+        parsed_shapes = parsing_query_runner.run_query(f"""SELECT COUNT(*) AS n
+                FROM {parsing_query_runner.parsed_geometries('entity', 'geometry')}
+                WHERE shape IS NOT NULL;""")["n"][0]
+        boxes = parsing_query_runner.run_query(
+            "SELECT COUNT(*) AS n FROM dq_scratch.rtree_1;"
+        )["n"][0]
+        assert parsed_shapes == boxes == 465
+
+    assert [response.result for response in responses] == [True, True, False]
+    for response, expected_response in zip(responses, expected_responses):
+        assert response.details == expected_response.details
+    # the shapes are parsed once for the 3 expectations, the parsing is
+    # reported apart from the evaluation
+    assert responses[0].metrics["geometry_parse"]["members"] == 3
+    assert responses[2].metrics["geometry_parse"]["scratch_table"] == "geometry_0"
+    assert responses[2].metrics["index_build"]["scratch_table"] == "rtree_1"
+    assert not os.path.exists(scratch_path)
@@ -0,0 +1,88 @@
+from planner import *
+from execution import run_suite
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+suite_expectations = [
+    {
+        "expectation_name": "expect_table_row_count_to_be_in_range",
+        "table_name": "entity",
+        "min_expected_row_count": 400,
+        "max_expected_row_count": 500,
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "reference",
+        "min_expected_value": 1021466,
+        "max_expected_value": 1481085,
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "reference",
+        "min_expected_value": 1021466,
+        "max_expected_value": 1300000,
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+        "table_name": "fact",
+        "field_name": "entity",
+        "count_ranges_per_value": [
+            {"lookup_value": "42114488", "min_row_count": 8, "max_row_count": 10},
+            {"lookup_value": "42114490", "min_row_count": 8, "max_row_count": 10},
+        ],
+    },
+    {
+        "expectation_name": "expect_keys_in_json_field_to_be_in_set_of_options",
+        "table_name": "entity",
+        "field_name": "json",
+        "ref_fields": ["entity"],
+        "expected_keys_set": ["name"],
+    },
+]
+
+
+def test_plan_suite_groups_fusable_expectations_by_table():
+    "Three fusable expectations on entity share a scan, fact stays single"
+    plan = plan_suite(suite_expectations)
+
+    assert plan[0] == (0, suite_expectations[0])
+    assert isinstance(plan[1], FusedScan)
+    assert plan[1].table_name == "entity"
+    assert [position for position, _ in plan[1].members] == [1, 2, 4]
+    assert plan[2] == (3, suite_expectations[3])
+
+
+def test_fused_suite_matches_running_expectations_one_by_one():
+    "Responses split out of the fused scan are the same as the individual ones"
+    planned_responses = list(
+        run_suite(
+            query_runner,
+            suite_expectations,
+            fuse_scans=True,
+            data_quality_execution_time="20220101_000000",
+        )
+    )
+    individual_responses = [
+        run_expectation(
+            query_runner=query_runner,
+            data_quality_execution_time="20220101_000000",
+            **expectation,
+        )
+        for expectation in suite_expectations
+    ]
+
+    assert [response.result for response in planned_responses] == [
+        True,
+        True,
+        False,
+        True,
+        False,
+    ]
+    for planned, individual in zip(planned_responses, individual_responses):
+        assert planned.to_dict() == individual.to_dict()
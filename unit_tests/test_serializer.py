@@ -0,0 +1,50 @@
+import copy
+import json
+import numpy as np
+import pandas as pd
+from serializer import *
+from expectations import QueryRunner, expect_values_in_field_to_be_within_range
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+
+def test_response_to_json_is_the_same_as_to_json():
+    "Same output as the previous deepcopy + to_json path"
+    response = expect_values_in_field_to_be_within_range(
+        query_runner, "entity", "reference", 1021466, 1300000, ["entity"]
+    )
+    response.details["records_set"] = {1, 2}
+
+    self_save_version = copy.deepcopy(response)
+    self_save_version.result = str(self_save_version.result)
+
+    assert response_to_json(response) == self_save_version.to_json()
+
+
+def test_response_to_json_handles_numpy_pandas_and_nan_without_mutation():
+    response = expect_values_in_field_to_be_within_range(
+        query_runner, "entity", "reference", 1021466, 1300000, ["entity"]
+    )
+    details = {
+        "records": [
+            {"count": np.int64(3), "ratio": float("nan"), "flag": np.bool_(True)},
+            {"count": pd.NA, "ratio": np.float64(0.5), "flag": None},
+        ]
+    }
+    response.details = details
+    response.result = np.bool_(False)
+
+    saved = json.loads(response_to_json(response))
+
+    assert saved["result"] == "False"
+    assert saved["details"] == {
+        "records": [
+            {"count": 3, "ratio": None, "flag": True},
+            {"count": None, "ratio": 0.5, "flag": None},
+        ]
+    }
+    assert response.details is details
+    assert isinstance(response.details["records"][0]["count"], np.int64)
+    assert response.result == np.bool_(False)
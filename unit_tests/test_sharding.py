@@ -0,0 +1,73 @@
+import pytest
+import sqlite3
+from sharding import *
+from expectations import expect_geoshapes_to_be_valid
+from planner import is_fusable
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+
+def test_rowid_shards():
+    # entity is the rowid of the table
+    assert rowid_shards(query_runner, "entity", 4) == [
+        (42114488, 42114604),
+        (42114605, 42114721),
+        (42114722, 42114838),
+        (42114839, 42114952),
+    ]
+    assert rowid_shards(query_runner, "entity", 1) == [(42114488, 42114952)]
+    with pytest.raises(ValueError):
+        rowid_shards(query_runner, "entity", 0)
+
+
+def test_sharded_validation_gives_the_same_response(tmp_path):
+    dataset_path = str(tmp_path / "dataset.sqlite3")
+    con = sqlite3.connect(dataset_path)
+    con.execute("CREATE TABLE thing (ref INTEGER, geometry TEXT);")
+    con.executemany(
+        "INSERT INTO thing VALUES (?, ?);",
+        [
+            (ref, "POLYGON((-1 51,-0.9 51,-0.9 51.1,-1 51.1,-1 51))")
+            for ref in range(1, 21)
+        ],
+    )
+    # a bow tie (self-intersecting) and a shape that can't be parsed
+    con.execute(
+        "UPDATE thing SET geometry = 'POLYGON((0 0,1 1,1 0,0 1,0 0))' WHERE ref = 7;"
+    )
+    con.execute("UPDATE thing SET geometry = 'not a shape' WHERE ref = 16;")
+    con.commit()
+    con.close()
+
+    with QueryRunner(dataset_path) as dataset_query_runner:
+        expected_response = expect_geoshapes_to_be_valid(
+            dataset_query_runner, "thing", "geometry", ["ref"]
+        )
+        response = expect_geoshapes_to_be_valid(
+            dataset_query_runner, "thing", "geometry", ["ref"], shards=3
+        )
+
+    assert expected_response.details == {
+        "invalid_shapes": [{"ref": 7, "is_valid": 0}, {"ref": 16, "is_valid": -1}]
+    }
+    assert response.result == False
+    assert response.msg == expected_response.msg
+    assert response.details == expected_response.details
+
+
+def test_sharded_validation_is_not_fused_nor_cached():
+    expectation = {
+        "expectation_name": "expect_geoshapes_to_be_valid",
+        "table_name": "entity",
+        "shape_field": "geometry",
+        "ref_fields": ["entity"],
+        "shards": 4,
+    }
+
+    assert not is_fusable(expectation)
+    with pytest.raises(ValueError, match="validity_cache_path"):
+        expect_geoshapes_to_be_valid(
+            query_runner, validity_cache_path="validity.sqlite3", **expectation
+        )
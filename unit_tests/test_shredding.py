@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+from shredding import *
+from execution import run_suite
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+suite_expectations = [
+    {
+        "expectation_name": "expect_values_for_a_key_stored_in_json_are_within_a_set",
+        "table_name": "entity",
+        "field": "json",
+        "json_key": "listed-building-grade",
+        "expected_values_set": ["I", "II", "III"],
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_values_for_a_key_stored_in_json_are_within_a_set",
+        "table_name": "entity",
+        "field": "json",
+        "json_key": "not-present-key",
+        "expected_values_set": ["I"],
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_keys_in_json_field_to_be_in_set_of_options",
+        "table_name": "entity",
+        "field_name": "json",
+        "expected_keys_set": ["listed-building-grade", "documentation-url"],
+        "ref_fields": ["entity", "reference"],
+    },
+    {
+        "expectation_name": "expect_keys_in_json_field_to_be_in_set_of_options",
+        "table_name": "entity",
+        "field_name": "json",
+        "expected_keys_set": [
+            "listed-building-grade",
+            "documentation-url",
+            "description",
+            "notes",
+        ],
+        "ref_fields": ["entity"],
+    },
+]
+
+
+def test_json_field_key():
+    assert json_field_key(suite_expectations[0]) == ("entity", "json")
+    assert json_field_key(suite_expectations[2]) == ("entity", "json")
+    assert (
+        json_field_key({"expectation_name": "expect_table_row_count_to_be_in_range"})
+        is None
+    )
+
+
+def test_shredded_json_gives_the_same_responses():
+    expected_responses = list(
+        run_suite(
+            query_runner,
+            suite_expectations,
+            data_quality_execution_time="20220101_000000",
+        )
+    )
+
+    with QueryRunner(tested_dataset) as shredding_query_runner:
+        responses = list(
+            run_suite(
+                shredding_query_runner,
+                suite_expectations,
+                shred_json=True,
+                collect_metrics=True,
+                data_quality_execution_time="20220101_000000",
+            )
+        )
+        scratch_path = shredding_query_runner.scratch["path"]
+        assert list(shredding_query_runner.scratch["tables"]) == [
+            "json_each:entity(json)"
+        ]
+        shredded_keys = shredding_query_runner.run_query(
+            f"""SELECT COUNT(DISTINCT row_id) AS n
+                FROM {shredding_query_runner.shredded_json('entity', 'json')};"""
+        )["n"][0]
+        assert shredded_keys == 465
+
+    assert [response.result for response in responses] == [False, False, False, True]
+    for response, expected_response in zip(responses[:2], expected_responses):
+        assert response.msg == expected_response.msg
+        assert response.details == expected_response.details
+    # the same objects, though characters escaped in the dataset (\uXXXX) are
+    # written as they are when the object is rebuilt
+    records = responses[2].details["records_with_non_expected_keys"]
+    expected_records = expected_responses[2].details["records_with_non_expected_keys"]
+    assert [
+        {**record, "non_expected_keys": json.loads(record["non_expected_keys"])}
+        for record in records
+    ] == [
+        {**record, "non_expected_keys": json.loads(record["non_expected_keys"])}
+        for record in expected_records
+    ]
+    assert responses[3].details is None
+    # the field is parsed once for the 4 expectations
+    assert responses[0].metrics["json_shred"]["members"] == 4
+    assert responses[3].metrics["json_shred"]["scratch_table"] == "json_0"
+    assert not os.path.exists(scratch_path)
+
+
+def test_rows_that_are_not_json_objects_have_no_keys(tmp_path):
+    dataset_path = str(tmp_path / "dataset.sqlite3")
+    con = sqlite3.connect(dataset_path)
+    con.execute("CREATE TABLE thing (ref INTEGER, json TEXT);")
+    con.executemany(
+        "INSERT INTO thing VALUES (?, ?);",
+        [(1, '{"a": "x"}'), (2, "not json"), (3, None), (4, "[1, 2]")],
+    )
+    con.commit()
+    con.close()
+    expectation = {
+        "expectation_name": "expect_values_for_a_key_stored_in_json_are_within_a_set",
+        "table_name": "thing",
+        "field": "json",
+        "json_key": "a",
+        "expected_values_set": ["x"],
+        "ref_fields": ["ref"],
+    }
+
+    with QueryRunner(dataset_path) as shredding_query_runner:
+        responses = list(
+            run_suite(
+                shredding_query_runner, [expectation, expectation], shred_json=True
+            )
+        )
+
+    assert responses[0].details == {
+        "non_expected_values": [
+            {"ref": 2, "value_found_for_key": None},
+            {"ref": 3, "value_found_for_key": None},
+            {"ref": 4, "value_found_for_key": None},
+        ]
+    }
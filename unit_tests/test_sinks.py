@@ -0,0 +1,64 @@
+import json
+import sqlite3
+from sinks import *
+from expectations import QueryRunner, expect_table_row_count_to_be_in_range
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+
+def responses_for_sink():
+    return [
+        expect_table_row_count_to_be_in_range(
+            query_runner=query_runner,
+            table_name="entity",
+            min_expected_row_count=min_expected_row_count,
+            max_expected_row_count=500,
+            data_quality_execution_time="20220101_000000",
+        )
+        for min_expected_row_count in (400, 480)
+    ]
+
+
+def test_ndjson_sink_writes_one_line_per_response(tmp_path):
+    results_path = str(tmp_path) + "/"
+    with make_sink("ndjson", results_path, "20220101_000000") as sink:
+        for response in responses_for_sink():
+            bytes_serialized = sink.write(response, collection_name="listed-building")
+            # the size of the saved response, reported in the run summary
+            assert bytes_serialized == len(response.to_saved_json())
+
+    with open(results_path + "20220101_000000_results.ndjson") as f:
+        lines = [json.loads(line) for line in f]
+
+    assert [line["collection"] for line in lines] == ["listed-building"] * 2
+    assert [line["response"]["result"] for line in lines] == ["True", "False"]
+
+
+def test_sqlite_sink_inserts_responses_in_batches(tmp_path):
+    results_path = str(tmp_path) + "/"
+    with SQLiteSink(results_path, "20220101_000000", batch_size=1) as sink:
+        for response in responses_for_sink():
+            sink.write(response, collection_name="listed-building")
+
+    con = sqlite3.connect(results_path + RESULTS_DATABASE_NAME)
+    rows = con.execute(
+        "SELECT collection, data_quality_execution_time, expectation_name, result FROM expectation_result;"
+    ).fetchall()
+    con.close()
+
+    assert rows == [
+        (
+            "listed-building",
+            "20220101_000000",
+            "expect_table_row_count_to_be_in_range",
+            1,
+        ),
+        (
+            "listed-building",
+            "20220101_000000",
+            "expect_table_row_count_to_be_in_range",
+            0,
+        ),
+    ]
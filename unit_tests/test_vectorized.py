@@ -0,0 +1,197 @@
+from execution import run_suite
+from vectorized import *
+import expectations as dq_expectations
+import json
+
+# Shared testing resources
+tested_dataset = "unit_tests/testing_dataset/lb_single_res.sqlite3"
+query_runner = QueryRunner(tested_dataset)
+
+fact_expectations = [
+    {
+        "expectation_name": "expect_field_values_to_be_within_set",
+        "table_name": "fact",
+        "field_name": "field",
+        "expected_values_set": [
+            "description",
+            "entry-date",
+            "geometry",
+            "listed-building-grade",
+            "name",
+            "notes",
+            "organisation",
+            "prefix",
+            "reference",
+        ],
+        "fail_if_not_found_entire_expected_set": True,
+    },
+    {
+        "expectation_name": "expect_field_values_to_be_within_set",
+        "table_name": "fact",
+        "field_name": "field",
+        "expected_values_set": ["name", "reference"],
+    },
+    {
+        "expectation_name": "expect_values_for_field_to_be_unique",
+        "table_name": "fact",
+        "fields": ["fact"],
+    },
+    {
+        "expectation_name": "expect_values_for_field_to_be_unique",
+        "table_name": "fact",
+        "fields": ["entity", "field"],
+    },
+    {
+        "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+        "table_name": "fact",
+        "field_name": "entity",
+        "count_ranges_per_value": [
+            {"lookup_value": "42114488", "min_row_count": 1, "max_row_count": 20},
+            {"lookup_value": "42114490", "min_row_count": 1, "max_row_count": 20},
+        ],
+    },
+    {
+        "expectation_name": "expect_row_count_for_lookup_value_to_be_in_range",
+        "table_name": "fact",
+        "field_name": "entity",
+        "count_ranges_per_value": [
+            {"lookup_value": "42114488", "min_row_count": 1, "max_row_count": 9},
+        ],
+    },
+]
+
+fact_resource_expectations = [
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "fact_resource",
+        "field_name": "entry_number",
+        "min_expected_value": 1,
+        "max_expected_value": 489,
+        "ref_fields": ["fact"],
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "fact_resource",
+        "field_name": "entry_number",
+        "min_expected_value": 1,
+        "max_expected_value": 400.5,
+        "ref_fields": ["fact"],
+    },
+    {
+        "expectation_name": "expect_values_for_field_to_be_unique",
+        "table_name": "fact_resource",
+        "fields": ["fact", "resource"],
+    },
+]
+
+entity_expectations = [
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "reference",
+        "min_expected_value": 1021466,
+        "max_expected_value": 1481085,
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "reference",
+        "min_expected_value": 1021466,
+        "max_expected_value": 1300000,
+        "ref_fields": ["entity"],
+    },
+    {
+        "expectation_name": "expect_values_in_field_to_be_within_range",
+        "table_name": "entity",
+        "field_name": "CAST(reference AS INTEGER)",
+        "min_expected_value": 1021466,
+        "max_expected_value": 1481085,
+        "ref_fields": ["entity"],
+    },
+]
+
+
+def _sql_failed(expectation: dict) -> bool:
+    arguments = dict(expectation)
+    response = getattr(dq_expectations, arguments.pop("expectation_name"))(
+        query_runner, **arguments
+    )
+    return not response.result
+
+
+def test_evaluate_table_agrees_with_sql():
+    "The vectorized verdicts match the expectations run in sql"
+    for table_name, expectations in [
+        ("fact", fact_expectations),
+        ("fact_resource", fact_resource_expectations),
+        ("entity", entity_expectations),
+    ]:
+        sql_failed = [_sql_failed(expectation) for expectation in expectations]
+        vectorized_failed = evaluate_table(
+            query_runner, table_name, expectations, chunk_size=1000
+        )
+        # the sql expression can't be vectorized, it is left to sql (True)
+        if table_name == "entity":
+            assert sql_failed == [False, True, False]
+            assert vectorized_failed == [False, True, True]
+        else:
+            assert vectorized_failed == sql_failed
+
+    assert evaluate_table(query_runner, "fact", fact_expectations) == [
+        False,
+        True,
+        False,
+        True,
+        False,
+        True,
+    ]
+
+
+def test_make_check_skips_what_it_cant_vectorize():
+    affinities = table_affinities(query_runner, "entity")
+    assert affinities["entity"] == "INTEGER"
+    assert affinities["reference"] == "TEXT"
+    assert affinities["json"] == "NUMERIC"
+
+    range_on_expression, range_on_text = entity_expectations[2], {
+        **entity_expectations[0],
+        "max_expected_value": 1481085.5,
+    }
+    assert make_check(range_on_expression, affinities) is None
+    assert make_check(range_on_text, affinities) is None
+    assert isinstance(make_check(entity_expectations[0], affinities), RangeCheck)
+
+
+def test_range_check_compares_like_sqlite():
+    "Text and blobs in a numeric column are above any number, NULLs are ignored"
+    check = RangeCheck("INTEGER", "value", 0, 10)
+    check.update(np.array([1, 10, None, 5.5], dtype=object))
+    assert not check.failed()
+    check.update(np.array([3, "7"], dtype=object))
+    assert check.violations == 1
+
+    check = RangeCheck("TEXT", "value", 100, 200)
+    check.update(np.array(["150", "1500", None], dtype=object))
+    assert not check.failed()
+    check.update(np.array(["99"], dtype=object))
+    assert check.failed()
+
+
+def test_run_suite_vectorized_matches_sql_engine():
+    "Same responses (but the execution time) with either engine"
+    expectations = fact_expectations + fact_resource_expectations + entity_expectations
+
+    def saved(response):
+        saved_json = json.loads(response.to_saved_json())
+        saved_json.pop("data_quality_execution_time")
+        return saved_json
+
+    sql_responses = list(run_suite(query_runner, expectations))
+    vectorized_responses = list(
+        run_suite(query_runner, expectations, engine="vectorized")
+    )
+
+    assert [saved(response) for response in vectorized_responses] == [
+        saved(response) for response in sql_responses
+    ]
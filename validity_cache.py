@@ -0,0 +1,100 @@
+import sqlite3
+import pandas as pd
+from core import QueryRunner
+
+
+class GeometryValidityCache:
+    """Persistent cache of ST_IsValid results in a sqlite file, keyed by the
+    md5 digest of the WKT text of the shape. Shapes whose WKT is unchanged
+    since a previous run are never parsed nor validated again."""
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        con = sqlite3.connect(cache_path, timeout=60)
+        try:
+            con.execute("""CREATE TABLE IF NOT EXISTS geometry_validity (
+                    wkt_digest TEXT PRIMARY KEY,
+                    is_valid INTEGER
+                ) WITHOUT ROWID;""")
+        finally:
+            con.close()
+
+    def store(self, validity_by_digest: dict):
+        "Adds the validity of newly seen shapes to the cache"
+        if not validity_by_digest:
+            return
+        con = sqlite3.connect(self.cache_path, timeout=60)
+        try:
+            with con:
+                con.executemany(
+                    "INSERT OR REPLACE INTO geometry_validity VALUES (?, ?);",
+                    validity_by_digest.items(),
+                )
+        finally:
+            con.close()
+
+
+def invalid_shapes_with_validity_cache(
+    query_runner: QueryRunner,
+    table_name: str,
+    shape_field: str,
+    ref_fields: list,
+    cache_path: str,
+    batch_size: int = 10000,
+):
+    """Finds the invalid shapes of a table looking up the validity of each
+    shape in a GeometryValidityCache first. Only shapes missing from the
+    cache are parsed and validated (once each) and are then added to it.
+    Returns a dataframe with the ref_fields and is_valid of the invalid
+    shapes and a dict with the cache hits and misses.
+    """
+    cache = GeometryValidityCache(cache_path)
+
+    str_ref_fields = ",".join(ref_fields)
+    unflattened = query_runner.backend.unflattened_subquery_sql
+    # the subqueries are not flattened, so the digest and the validity are
+    # computed once per row
+    sql_query = f"""
+        SELECT {str_ref_fields}, is_valid, wkt_digest, cache_hit FROM (
+            SELECT {str_ref_fields}, shapes.wkt_digest,
+                CASE WHEN cache.is_valid IS NULL
+                    THEN {query_runner.backend.is_valid("shapes." + shape_field)}
+                    ELSE cache.is_valid END AS is_valid,
+                cache.is_valid IS NOT NULL AS cache_hit
+            FROM (
+                SELECT {str_ref_fields}, {shape_field}, dq_digest({shape_field}) AS wkt_digest
+                FROM {table_name}
+                {unflattened}) AS shapes
+            LEFT JOIN validity_cache.geometry_validity AS cache
+                ON cache.wkt_digest = shapes.wkt_digest
+            {unflattened});"""
+
+    invalid_rows = []
+    new_validity_by_digest = {}
+    cache_hits = 0
+    cache_misses = 0
+    with query_runner.attached(cache.cache_path, "validity_cache"):
+        for batch in query_runner.iter_query(sql_query, batch_size=batch_size):
+            for *refs, is_valid, wkt_digest, cache_hit in batch:
+                if cache_hit:
+                    cache_hits += 1
+                else:
+                    cache_misses += 1
+                    if wkt_digest is not None:
+                        new_validity_by_digest[wkt_digest] = is_valid
+                if is_valid in (0, -1):
+                    invalid_rows.append((*refs, is_valid))
+
+    cache.store(new_validity_by_digest)
+
+    shapes = cache_hits + cache_misses
+    validity_cache_stats = {
+        "shapes": shapes,
+        "cache_hits": cache_hits,
+        "cache_misses": cache_misses,
+        "hit_ratio": cache_hits / shapes if shapes else None,
+    }
+    invalid_shapes = pd.DataFrame.from_records(
+        data=invalid_rows, columns=ref_fields + ["is_valid"]
+    )
+    return invalid_shapes, validity_cache_stats
@@ -0,0 +1,291 @@
+import numpy as np
+import pandas as pd
+from core import QueryRunner
+
+# Expectations the vectorized engine can evaluate from the columns of their
+# table (see make_check)
+VECTORIZED_EXPECTATIONS = (
+    "expect_values_in_field_to_be_within_range",
+    "expect_field_values_to_be_within_set",
+    "expect_values_for_field_to_be_unique",
+    "expect_row_count_for_lookup_value_to_be_in_range",
+)
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def column_affinity(declared_type: str) -> str:
+    "Affinity sqlite gives a column with the declared type (sqlite docs 3.1)"
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        return "INTEGER"
+    if any(text in declared_type for text in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if declared_type == "" or "BLOB" in declared_type:
+        return "BLOB"
+    if any(real in declared_type for real in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+def table_affinities(query_runner: QueryRunner, table_name: str) -> dict:
+    "Affinity of every column of a table, by column name"
+    table_info = query_runner.run_query(f"PRAGMA table_info('{table_name}');")
+    return {
+        name: column_affinity(declared_type)
+        for name, declared_type in zip(table_info["name"], table_info["type"])
+    }
+
+
+class RangeCheck:
+    """expect_values_in_field_to_be_within_range: counts the values for which
+    'field < min OR field > max' is true, comparing as sqlite does. In a TEXT
+    column the (integer) bounds are compared as text, in other columns
+    numbers compare as numbers and any text or blob is greater than them."""
+
+    def __init__(
+        self, affinity: str, field_name: str, min_expected_value, max_expected_value
+    ):
+        self.columns = [field_name]
+        self.affinity = affinity
+        self.min_expected_value = min_expected_value
+        self.max_expected_value = max_expected_value
+        self.violations = 0
+
+    @staticmethod
+    def supports(
+        affinities: dict,
+        field_name: str,
+        min_expected_value,
+        max_expected_value,
+        **kwargs,
+    ):
+        bounds = (min_expected_value, max_expected_value)
+        if field_name not in affinities:
+            return False
+        if affinities[field_name] == "TEXT":
+            # sqlite renders REAL bounds as text its own way, keep to integers
+            return all(type(bound) is int for bound in bounds)
+        return all(type(bound) in (int, float) for bound in bounds)
+
+    def update(self, values: np.ndarray):
+        values = values[pd.notna(values)]
+        if len(values) == 0:
+            return
+        kind = pd.api.types.infer_dtype(values, skipna=False)
+
+        if self.affinity == "TEXT":
+            if kind != "string":
+                # blobs in a TEXT column, leave it to sql
+                self.violations += len(values)
+                return
+            text = values.astype(str)
+            out_of_range = (text < str(self.min_expected_value)) | (
+                text > str(self.max_expected_value)
+            )
+        elif kind in ("integer", "floating", "mixed-integer-float"):
+            numbers = values.astype(np.int64 if kind == "integer" else np.float64)
+            out_of_range = (numbers < self.min_expected_value) | (
+                numbers > self.max_expected_value
+            )
+        else:
+            # text and blobs sort after every number, so they are above max
+            is_number = np.fromiter(
+                (isinstance(value, (int, float)) for value in values),
+                dtype=bool,
+                count=len(values),
+            )
+            numbers = np.where(is_number, values, 0).astype(np.float64)
+            out_of_range = ~is_number | (
+                (numbers < self.min_expected_value)
+                | (numbers > self.max_expected_value)
+            )
+        self.violations += int(np.count_nonzero(out_of_range))
+
+    def failed(self) -> bool:
+        return self.violations > 0
+
+
+class SetCheck:
+    """expect_field_values_to_be_within_set: collects the distinct values of
+    the field and compares them to the expected set like the expectation.
+    A NULL is reported as a failure so the expectation itself decides."""
+
+    def __init__(
+        self,
+        field_name: str,
+        expected_values_set: set,
+        fail_if_not_found_entire_expected_set: bool = False,
+    ):
+        self.columns = [field_name]
+        self.expected_values_set = set(expected_values_set)
+        self.fail_if_not_found_entire_expected_set = (
+            fail_if_not_found_entire_expected_set
+        )
+        self.found_values_set = set()
+        self.found_null = False
+
+    @staticmethod
+    def supports(affinities: dict, field_name: str, **kwargs):
+        return field_name in affinities
+
+    def update(self, values: np.ndarray):
+        distinct_values = pd.unique(values)
+        if pd.isna(distinct_values).any():
+            self.found_null = True
+        self.found_values_set.update(distinct_values)
+
+    def failed(self) -> bool:
+        if self.found_null:
+            return True
+        if self.fail_if_not_found_entire_expected_set:
+            return self.expected_values_set != self.found_values_set
+        return not self.found_values_set.issubset(self.expected_values_set)
+
+
+class UniqueCheck:
+    """expect_values_for_field_to_be_unique: keeps a 64 bit hash per row of
+    the combined fields (equal values hash equal, as they group in sqlite)
+    and looks for a repeated hash. A hash collision only means the
+    expectation itself is run to confirm."""
+
+    def __init__(self, fields: list):
+        self.columns = list(fields)
+        self.hashes = []
+
+    @staticmethod
+    def supports(affinities: dict, fields: list, **kwargs):
+        return len(fields) > 0 and all(field in affinities for field in fields)
+
+    def update(self, *values: np.ndarray):
+        keys = values[0] if len(values) == 1 else zip(*values)
+        self.hashes.append(
+            np.fromiter(map(hash, keys), dtype=np.int64, count=len(values[0]))
+        )
+
+    def failed(self) -> bool:
+        if not self.hashes:
+            return False
+        hashes = np.concatenate(self.hashes)
+        return len(np.unique(hashes)) < len(hashes)
+
+
+class LookupCountCheck:
+    """expect_row_count_for_lookup_value_to_be_in_range: counts the rows per
+    value of the field and applies the comparison of the expectation to the
+    counts (built into the same dataframe the expectation gets from sql)"""
+
+    def __init__(self, field_name: str, count_ranges_per_value: list):
+        self.columns = [field_name]
+        self.count_ranges_per_value = count_ranges_per_value
+        self.counts = pd.Series(dtype=np.int64)
+
+    @staticmethod
+    def supports(
+        affinities: dict, field_name: str, count_ranges_per_value=None, **kwargs
+    ):
+        # ranges read from a csv are left to the expectation
+        return field_name in affinities and count_ranges_per_value is not None
+
+    def update(self, values: np.ndarray):
+        chunk_counts = pd.Series(values, dtype=object).value_counts(dropna=False)
+        self.counts = self.counts.add(chunk_counts, fill_value=0)
+
+    def failed(self) -> bool:
+        expected_counts = pd.DataFrame(self.count_ranges_per_value)
+        expected_counts["lookup_value"] = expected_counts["lookup_value"].astype(
+            "string"
+        )
+        found_counts = pd.DataFrame.from_records(
+            data=[(value, int(count)) for value, count in self.counts.items()],
+            columns=["lookup_value", "rows_found"],
+        )
+        found_counts["lookup_value"] = found_counts["lookup_value"].astype("string")
+        expected_versus_found = expected_counts.merge(
+            found_counts, on="lookup_value", how="left"
+        )
+        not_within_range = (
+            expected_versus_found["rows_found"]
+            >= expected_versus_found["max_row_count"]
+        ) | (
+            expected_versus_found["rows_found"]
+            <= expected_versus_found["min_row_count"]
+        )
+        return bool(not_within_range.any())
+
+
+def make_check(expectation: dict, affinities: dict, compares_like_sqlite: bool = True):
+    """Returns the check evaluating an expectation over the columns of its
+    table, None if the expectation can't be vectorized (e.g. its field is an
+    sql expression rather than a column). Range checks follow the comparison
+    rules of sqlite, so they are only made for backends that compare alike."""
+    name = expectation["expectation_name"]
+    if name == "expect_values_in_field_to_be_within_range":
+        if compares_like_sqlite and RangeCheck.supports(affinities, **expectation):
+            return RangeCheck(
+                affinities[expectation["field_name"]],
+                expectation["field_name"],
+                expectation["min_expected_value"],
+                expectation["max_expected_value"],
+            )
+    elif name == "expect_field_values_to_be_within_set":
+        if SetCheck.supports(affinities, **expectation):
+            return SetCheck(
+                expectation["field_name"],
+                expectation["expected_values_set"],
+                expectation.get("fail_if_not_found_entire_expected_set", False),
+            )
+    elif name == "expect_values_for_field_to_be_unique":
+        if UniqueCheck.supports(affinities, **expectation):
+            return UniqueCheck(expectation["fields"])
+    elif name == "expect_row_count_for_lookup_value_to_be_in_range":
+        if LookupCountCheck.supports(affinities, **expectation):
+            return LookupCountCheck(
+                expectation["field_name"],
+                expectation["count_ranges_per_value"],
+            )
+    return None
+
+
+def evaluate_table(
+    query_runner: QueryRunner,
+    table_name: str,
+    expectations: list,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> list:
+    """Evaluates expectations on the same table with a single read of the
+    columns they need, in chunks of chunk_size rows turned into numpy arrays.
+    Returns, per expectation, False if it passed and True if it failed or
+    could not be vectorized: those are left for the expectation itself to
+    run (and to collect the details), so a True is never a final verdict.
+    """
+    affinities = table_affinities(query_runner, table_name)
+    compares_like_sqlite = query_runner.backend.name == "spatialite"
+    checks = [
+        make_check(expectation, affinities, compares_like_sqlite)
+        for expectation in expectations
+    ]
+
+    columns = []
+    for check in checks:
+        if check is not None:
+            columns.extend(column for column in check.columns if column not in columns)
+    column_positions = {column: i for i, column in enumerate(columns)}
+
+    if columns:
+        str_columns = ",".join(f'"{column}"' for column in columns)
+        for rows in query_runner.iter_query(
+            f"SELECT {str_columns} FROM {table_name};", batch_size=chunk_size
+        ):
+            chunk = np.empty((len(rows), len(columns)), dtype=object)
+            chunk[:] = rows
+            for check in checks:
+                if check is not None:
+                    check.update(
+                        *(
+                            chunk[:, column_positions[column]]
+                            for column in check.columns
+                        )
+                    )
+
+    return [check is None or check.failed() for check in checks]